@@ -0,0 +1,74 @@
+# Microphone DSP benchmark
+#
+# Compares the per-frame cost of calculate_energy() with FrameAnalyzer (measurement
+# only, and with AGC and the noise gate enabled) on random speech-level frames, and
+# reports the peak temporary memory each one allocates per frame. The AGC variant runs
+# on read-only bytes frames (a new bytes object per changed frame) and on writable
+# frames like the session's pooled ones (changed in place).
+#
+#   python benchmarks/bench_dsp.py --frames 20000 --chunk 1024
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sesame_voice.dsp import FrameAnalyzer, calculate_energy
+
+
+def make_frames(chunk, count=64):
+    rng = np.random.default_rng(0)
+    return [(rng.standard_normal(chunk) * 3000).astype(np.int16).tobytes() for _ in range(count)]
+
+
+def time_per_frame(func, frames, total):
+    start = time.perf_counter()
+    for i in range(total):
+        func(frames[i % len(frames)])
+    return (time.perf_counter() - start) / total * 1e6
+
+
+# Largest amount of memory allocated (and released again) during a single call
+def temporary_bytes(func, frames):
+    tracemalloc.start()
+    worst = 0
+    for frame in frames:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func(frame)
+        worst = max(worst, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=20000, help="Frames to process per variant")
+    parser.add_argument("--chunk", type=int, default=1024, help="Samples per frame")
+    args = parser.parse_args()
+
+    frames = make_frames(args.chunk)
+    pooled = [np.frombuffer(bytearray(frame), dtype=np.int16) for frame in frames]
+    variants = [
+        ("calculate_energy", calculate_energy, frames),
+        ("FrameAnalyzer", FrameAnalyzer(args.chunk).process, frames),
+        ("FrameAnalyzer + AGC + gate", FrameAnalyzer(args.chunk, agc=True, noise_gate=200).process, frames),
+        ("  on writable frames", FrameAnalyzer(args.chunk, agc=True, noise_gate=200).process, pooled),
+    ]
+
+    print(f"{'variant':<28} {'us/frame':>9} {'temp bytes/frame':>17}")
+    for name, func, frames in variants:
+        # Warm up
+        for frame in frames:
+            func(frame)
+        us = time_per_frame(func, frames, args.frames)
+        print(f"{name:<28} {us:>9.2f} {temporary_bytes(func, frames):>17}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+# End-to-end benchmark suite against the local stand-in server
+#
+# Starts the stand-in server (sesame_voice.standin) in its own process and runs client
+# sessions against it over real websockets, on PyAudioBackend with a FakePyAudio whose
+# microphone plays a speech-like pattern (a tone, then silence). Scenarios:
+#
+#   latency    - "reply" server with think time and jitter: end of speech to first reply
+#                audio as seen by the client's turn tracker, next to the server's view
+#   load       - N sessions per run: CPU per session, and resident memory sampled over
+#                the run with its growth rate
+#   reconnect  - the server drops every connection every few seconds: time until the
+#                session has a live connection again
+#
+# Every scenario runs in each audio I/O mode in --io-modes ("blocking" and "callback",
+# see audio_io), so both capture and playback paths are covered.
+#
+# Every client run is a fresh process, so runs don't share memory or threads. Results
+# are written as JSON (--output); --baseline prints the change from an earlier file.
+#
+# The sessions use StandinWebSocket by default. With --client sesame they use sesame_ai's
+# SesameWebSocket pointed at the stand-in instead (needs sesame_ai installed), which
+# checks the stand-in's guess at the protocol against the real client.
+#
+#   python benchmarks/bench_e2e.py --duration 20 --sessions 1 8 --output e2e.json
+#   python benchmarks/bench_e2e.py --scenarios latency --baseline e2e.json
+#   python benchmarks/bench_e2e.py --scenarios latency --client sesame
+
+import argparse
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_sessions import rss_mib
+from sesame_voice.audio_io import IO_MODES, LoopSource, PyAudioBackend
+from sesame_voice.session import Session, SessionConfig, SessionManager, sesame_websocket
+from sesame_voice.standin import FakePyAudio, StandinWebSocket, describe_ms, serve_process
+from sesame_voice.tracing import SERVER_TRACK
+
+SCENARIOS = ("latency", "load", "reconnect")
+CLIENTS = ("standin", "sesame")
+
+
+# Microphone pattern: `speech` seconds of a two-tone "voice", then `silence` seconds
+def speech_pattern(rate=16000, speech=1.5, silence=3.5):
+    t = np.arange(int(rate * speech)) / rate
+    voice = 2500 * np.sin(2 * np.pi * 180 * t) + 1500 * np.sin(2 * np.pi * 410 * t)
+    return voice.astype(np.int16).tobytes() + bytes(int(rate * silence) * 2)
+
+
+# Client process: run `sessions` sessions for `duration` seconds against the server
+def run_clients(url, sessions, duration, engine, sample_interval, client="standin", io_mode="blocking"):
+    logging.basicConfig(level=logging.ERROR)
+    # websocket-client reports every dropped connection, which is the point here
+    logging.getLogger("websocket").setLevel(logging.CRITICAL)
+    pcm = speech_pattern()
+    fake = FakePyAudio(source_factory=lambda: LoopSource(pcm))
+    backend = PyAudioBackend(fake, io_mode)
+    config = SessionConfig(engine=engine, interactive=False)
+    if client == "sesame":
+        from sesame_ai import SesameWebSocket
+        ws_factory = functools.partial(sesame_websocket, SesameWebSocket, url)
+    else:
+        ws_factory = functools.partial(StandinWebSocket, url=url)
+
+    manager = SessionManager(engine)
+    for i in range(sessions):
+        manager.add(Session("benchmark", backend, config, name=f"s{i}", ws_factory=ws_factory))
+
+    # Resident memory over the run
+    rss_samples = []
+    done = threading.Event()
+
+    def sample_rss():
+        start = time.monotonic()
+        while not done.wait(sample_interval):
+            rss_samples.append((time.monotonic() - start, rss_mib()))
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    rss_before = rss_mib()
+    cpu_before = time.process_time()
+    wall_before = time.monotonic()
+    sampler.start()
+    manager.run(duration)
+    done.set()
+    cpu = time.process_time() - cpu_before
+    wall = time.monotonic() - wall_before
+
+    think_ms = []
+    failover_ms = []
+    for session in manager.sessions:
+        think_ms += [span[3] * 1000 for span in session.tracker.spans if span[1] == SERVER_TRACK]
+        failover_ms += session.failover_times_ms
+    stats = manager.stats()
+
+    # Growth after the first quarter of the run (startup allocations settle by then)
+    steady = [(t, rss) for t, rss in rss_samples if t >= duration / 4]
+    growth = None
+    if len(steady) >= 2:
+        times, values = zip(*steady)
+        growth = float(np.polyfit(times, values, 1)[0]) * 60
+
+    return {
+        "sessions": sessions,
+        "wall_s": round(wall, 2),
+        "cpu_pct_per_session": round(100.0 * cpu / wall / sessions, 2),
+        "rss_mib_start": round(rss_before, 1),
+        "rss_mib_end": round(rss_samples[-1][1] if rss_samples else rss_mib(), 1),
+        "rss_growth_mib_per_min": None if growth is None else round(growth, 3),
+        "rss_samples": [[round(t, 1), round(rss, 1)] for t, rss in rss_samples],
+        "response_latency_ms": describe_ms(think_ms),
+        "reconnect_ms": describe_ms(failover_ms),
+        "reconnects": sum(s["reconnects"] for s in stats) - sessions,
+        "frames_sent": sum(s["frames_sent"] for s in stats),
+        "bytes_received": sum(s["bytes_received"] for s in stats),
+        "uplink_dropped": sum(s["uplink_dropped"] for s in stats),
+        "jitter_underruns": sum(s.get("jitter_underruns", 0) for s in stats),
+    }
+
+
+# One client run against a fresh server process; returns (client results, server stats)
+def run(server_options, sessions, duration, engine, sample_interval, client, io_mode):
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe()
+    server = ctx.Process(target=serve_process, args=(child, server_options), daemon=True)
+    server.start()
+    try:
+        url = parent.recv()
+        with ctx.Pool(1) as pool:
+            client = pool.apply(run_clients, (url, sessions, duration, engine, sample_interval, client, io_mode))
+        parent.send("stop")
+        server_stats = parent.recv()
+    finally:
+        server.join(5)
+        if server.is_alive():
+            server.kill()
+    return client, server_stats
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# Numeric leaves of a result tree as {"a.b.c": value}
+def flatten(tree, prefix=""):
+    flat = {}
+    if isinstance(tree, dict):
+        for key, value in tree.items():
+            flat.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(tree, list) and tree and isinstance(tree[0], dict):
+        for item in tree:
+            flat.update(flatten(item, f"{prefix}{item.get('sessions', '')}."))
+    elif isinstance(tree, (int, float)) and not isinstance(tree, bool):
+        flat[prefix[:-1]] = tree
+    return flat
+
+
+def compare(baseline, results):
+    old = flatten(baseline["scenarios"])
+    new = flatten(results["scenarios"])
+    print(f"\nChange from baseline ({baseline.get('git_revision') or 'unknown revision'}, "
+          f"{baseline.get('timestamp', '?')}):")
+    for key in sorted(old.keys() & new.keys()):
+        if "rss_samples" in key or old[key] == new[key]:
+            continue
+        change = f"{(new[key] - old[key]) / old[key] * 100:+.1f}%" if old[key] else ""
+        print(f"  {key:60} {old[key]:>10} -> {new[key]:<10} {change}")
+
+
+# Every scenario in args.scenarios with the clients in `io_mode`; prints a line per run
+# and returns the results by scenario
+def run_scenarios(args, faults, io_mode):
+    results = {}
+    options = (args.engine, args.sample_interval, args.client, io_mode)
+
+    if "latency" in args.scenarios:
+        client, server = run(dict(faults, mode="reply"), 1, args.duration, *options)
+        results["latency"] = {"client": client, "server": server}
+        client_ms, server_ms = client["response_latency_ms"], server["reply_delay_ms"]
+        print(f"{io_mode:<9} latency    client p50 {client_ms['p50'] if client_ms else '-'}ms "
+              f"p95 {client_ms['p95'] if client_ms else '-'}ms | "
+              f"server reply delay p50 {server_ms['p50'] if server_ms else '-'}ms, "
+              f"end-of-speech detection p50 {server['end_of_speech_detect_ms']['p50'] if server['turns'] else '-'}ms")
+
+    if "load" in args.scenarios:
+        runs = []
+        for n in args.sessions:
+            client, server = run(dict(faults, mode="echo"), n, args.duration, *options)
+            runs.append(dict(client, server=server))
+            print(f"{io_mode:<9} load       {n:>4} sessions  cpu {client['cpu_pct_per_session']:6.2f}%/session  "
+                  f"rss {client['rss_mib_end']:7.1f} MiB  growth {client['rss_growth_mib_per_min']} MiB/min  "
+                  f"underruns {client['jitter_underruns']}")
+        results["load"] = runs
+
+    if "reconnect" in args.scenarios:
+        client, server = run(dict(faults, mode="echo", drop_every=args.drop_every), 1, args.duration, *options)
+        results["reconnect"] = {"client": client, "server": server}
+        reconnect = client["reconnect_ms"]
+        print(f"{io_mode:<9} reconnect  {server['dropped_connections']} drops, "
+              f"reconnected p50 {reconnect['p50'] if reconnect else '-'}ms "
+              f"max {reconnect['max'] if reconnect else '-'}ms")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per client run")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16], help="Session counts for the load scenario")
+    parser.add_argument("--engine", choices=("asyncio", "threads"), default="asyncio")
+    parser.add_argument("--io-modes", nargs="+", choices=IO_MODES, default=list(IO_MODES),
+                        help="Audio I/O modes to run every scenario in")
+    parser.add_argument("--client", choices=CLIENTS, default="standin",
+                        help="Websocket client: the stand-in's own, or sesame_ai's SesameWebSocket")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Server think time")
+    parser.add_argument("--jitter-ms", type=float, default=30, help="Per-chunk network jitter")
+    parser.add_argument("--burst", type=int, default=1, help="Server releases audio in groups of this many chunks")
+    parser.add_argument("--drop-every", type=float, default=4.0, help="Seconds between dropped connections (reconnect)")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between memory samples")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results in this JSON file")
+    args = parser.parse_args()
+
+    faults = {"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "burst": args.burst, "seed": 1}
+    results = {
+        "benchmark": "e2e",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "scenarios": {},
+    }
+
+    for io_mode in args.io_modes:
+        results["scenarios"][io_mode] = run_scenarios(args, faults, io_mode)
+        print()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
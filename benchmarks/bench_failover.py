@@ -0,0 +1,119 @@
+# Failover benchmark
+#
+# Runs one session over real websockets against a local stand-in server
+# (sesame_voice.standin), has the server drop the session's active connection again and
+# again, and measures how long it takes until the session has a live connection again
+# and until the server receives microphone audio on it. Compares plain reconnects with
+# hot-standby promotion for both engines. --connect-delay is how long the server takes
+# to set up each call.
+#
+# Every kill must show up as exactly one failover in the session's own accounting
+# (failover_times_ms), and the first connection of the session as none; the script
+# exits with status 1 if it doesn't.
+#
+#   python benchmarks/bench_failover.py --kills 20 --connect-delay 0.3
+
+import argparse
+import functools
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sesame_voice.audio_io import VirtualBackend
+from sesame_voice.session import Session, SessionConfig, SessionManager
+from sesame_voice.standin import StandinServer, StandinWebSocket
+
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.0005)
+    return False
+
+
+def measure(engine, hot_standby, kills, connect_delay):
+    server = StandinServer(connect_delay_ms=connect_delay * 1000)
+    server.start()
+    config = SessionConfig(engine=engine, hot_standby=hot_standby, interactive=False)
+    ws_factory = functools.partial(StandinWebSocket, url=server.url)
+
+    session = Session("benchmark", VirtualBackend(), config, ws_factory=ws_factory)
+    manager = SessionManager(engine)
+    manager.add(session)
+    runner = threading.Thread(target=manager.run)
+    runner.start()
+
+    reconnected_ms = []
+    resumed_ms = []
+    try:
+        for _ in range(kills):
+            # Let the session settle (and the standby connect) before the next kill
+            if not wait_until(lambda: session.is_connected() and
+                              (not hot_standby or session.standby_ws is not None), 30):
+                raise RuntimeError("Session did not reconnect")
+            time.sleep(connect_delay + 0.2)
+
+            old_ws = session.current_ws
+            start = time.monotonic()
+            if not server.drop(old_ws.session_id):
+                raise RuntimeError("The server has no call for the active connection")
+
+            if not wait_until(lambda: session.current_ws is not old_ws and session.is_connected(), 30):
+                raise RuntimeError("Session did not fail over")
+            reconnected_ms.append((time.monotonic() - start) * 1000)
+
+            # Audio counts once the server has it on the new connection
+            new_call = server.calls.get(session.current_ws.session_id)
+            received = new_call.audio_bytes_received if new_call else 0
+            if not wait_until(lambda: new_call is not None and new_call.audio_bytes_received > received, 30):
+                raise RuntimeError("Audio did not resume")
+            resumed_ms.append((time.monotonic() - start) * 1000)
+    finally:
+        manager.stop()
+        runner.join()
+        server.stop()
+
+    return reconnected_ms, resumed_ms, len(session.failover_times_ms)
+
+
+def describe(values):
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return f"median {statistics.median(values):7.1f}ms  p95 {p95:7.1f}ms  max {values[-1]:7.1f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--kills", type=int, default=10, help="Connections to kill per run")
+    parser.add_argument("--connect-delay", type=float, default=0.3,
+                        help="Time the server takes to set up a call (seconds)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    # websocket-client reports every dropped connection, which is the point here
+    logging.getLogger("websocket").setLevel(logging.CRITICAL)
+
+    failed = False
+    for engine in ("threads", "asyncio"):
+        for hot_standby in (False, True):
+            reconnected, resumed, failovers = measure(engine, hot_standby, args.kills, args.connect_delay)
+            label = f"{engine:8} standby={'on ' if hot_standby else 'off'}"
+            print(f"{label}  reconnected: {describe(reconnected)}")
+            print(f"{'':22}  audio resumed: {describe(resumed)}")
+            print(f"{'':22}  failovers counted: {failovers} (expected {args.kills})")
+            if failovers != args.kills:
+                failed = True
+
+    if failed:
+        print("FAILED: the session should count each kill as one failover and its first connection as none")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
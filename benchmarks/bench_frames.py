@@ -0,0 +1,174 @@
+# Capture pipeline allocation benchmark
+#
+# Runs one session's capture path (microphone read, analyzer, voice activity gate,
+# uplink queue, send) frame by frame on a virtual microphone that delivers audio as
+# fast as it is read. The websocket discards what it is sent. For each variant it
+# reports the time per frame and the temporary memory allocated per frame (the peak
+# above the level before the frame, traced by tracemalloc across the capture and
+# uplink threads), as a median and a maximum. It also reports the memory still held
+# after the run and how often the frame pool had to grow.
+#
+# "read()" stands in for PyAudio's blocking streams, which can only return a new bytes
+# object that is then copied into the pooled frame; the other variants read in place.
+# "resample" reads 48 kHz audio and converts it into the frame (StreamingResampler
+# reuses its buffers, see resample).
+#
+# No audio buffer is allocated per frame on the in-place paths. What is left are small
+# Python objects that CPython cannot avoid, such as the ints of counters past 256 and
+# timestamps, so the typical frame's temporaries are a few hundred bytes at most rather
+# than zero: the script exits with status 1 if an in-place variant's median goes over
+# SMALL_OBJECTS_BOUND bytes. Resampling adds the iterator state numpy's take and matmul
+# allocate on every call, and is held to RESAMPLE_BOUND instead. The blocking PyAudio
+# path allocates one frame per read on top of that, which no client code can avoid:
+# only callback streams (AUDIO_IO_MODE "callback") and virtual devices read in place.
+#
+#   python benchmarks/bench_frames.py --frames 5000
+
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sesame_voice.audio_io import VirtualBackend
+from sesame_voice.session import MicActivity, Session, SessionConfig
+
+# Median temporary bytes per frame allowed on the in-place paths
+SMALL_OBJECTS_BOUND = 256
+# The same on the resampling path, which has numpy's per-call state on top
+RESAMPLE_BOUND = 1024
+
+
+# Connected websocket that drops everything sent to it
+class NullWebSocket:
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def is_connected(self):
+        return True
+
+    def send_audio_data(self, data):
+        self.bytes_sent += len(data)
+
+    def disconnect(self):
+        pass
+
+
+# Microphone stream without read_into, like PyAudio's blocking streams
+class ReadOnlyStream:
+    def __init__(self, stream):
+        self.read = stream.read
+        self.is_active = stream.is_active
+        self.stop_stream = stream.stop_stream
+        self.close = stream.close
+
+
+# Loops over a block of audio with readinto(), which copies into the frame without
+# creating any objects (LoopSource slices memoryviews, which would be counted here)
+class PatternSource:
+    def __init__(self, pcm):
+        self._file = io.BytesIO(pcm)
+
+    def read_into(self, out):
+        filled = self._file.readinto(out)
+        if filled < len(out):
+            self._file.seek(0)
+            filled += self._file.readinto(memoryview(out)[filled:])
+        return filled
+
+    # A new bytes object per read, like PyAudio's blocking streams
+    def read(self, nbytes):
+        data = self._file.read(nbytes)
+        if len(data) < nbytes:
+            self._file.seek(0)
+            data += self._file.read(nbytes - len(data))
+        return data
+
+
+# 1 s of speech-level tone followed by 1 s of silence, so the VAD opens and closes
+def speech_pattern(rate=16000):
+    t = np.arange(rate) / rate
+    return (3000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16).tobytes() + bytes(rate * 2)
+
+
+def make_session(agc=False, vad=False, read_only=False, mic_rate=None):
+    pcm = speech_pattern(mic_rate or 16000)
+    config = SessionConfig(interactive=False, mic_agc=agc, mic_noise_gate=200 if agc else 0,
+                           vad=vad, uplink_policy="block", mic_rate=mic_rate)
+    session = Session("benchmark", VirtualBackend(source_factory=lambda: PatternSource(pcm), speed=None),
+                      config, ws_factory=NullWebSocket)
+    session.open_streams()
+    if read_only:
+        session.mic_stream = ReadOnlyStream(session.mic_stream)
+    session.current_ws = NullWebSocket()
+    session.uplink.start()
+    return session
+
+
+def run_variant(frames, **options):
+    session = make_session(**options)
+    activity = MicActivity(session)
+    # Warm up: fills the pool's free list, numpy's caches and the queue's blocks
+    for _ in range(500):
+        session.capture_frame(activity)
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        session.capture_frame(activity)
+    us = (time.perf_counter() - start) / frames * 1e6
+
+    tracemalloc.start()
+    # Preallocated, so recording the results allocates nothing either
+    temporary = np.zeros(frames, dtype=np.int64)
+    baseline = tracemalloc.get_traced_memory()[0]
+    for i in range(frames):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        session.capture_frame(activity)
+        temporary[i] = tracemalloc.get_traced_memory()[1] - before
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    pool = session.frame_pool
+    session.close()
+    return us, float(np.median(temporary)), int(temporary.max()), retained, pool.grown, pool.frame_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=5000, help="Frames to capture per variant")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    variants = [
+        ("read_into", {}, SMALL_OBJECTS_BOUND),
+        ("read_into + AGC + gate", {"agc": True}, SMALL_OBJECTS_BOUND),
+        ("read_into + VAD", {"vad": True}, SMALL_OBJECTS_BOUND),
+        ("read_into + resample", {"mic_rate": 48000}, RESAMPLE_BOUND),
+        ("read() (PyAudio blocking)", {"read_only": True}, None),
+    ]
+    print(f"{'variant':<28} {'us/frame':>9} {'temp bytes/frame p50':>21} {'max':>7} "
+          f"{'retained':>9} {'pool grown':>11}")
+    failed = []
+    for name, options, bound in variants:
+        us, p50, worst, retained, grown, frame_bytes = run_variant(args.frames, **options)
+        print(f"{name:<28} {us:>9.1f} {p50:>21.0f} {worst:>7} {retained:>9} {grown:>11}")
+        if bound is not None and (p50 > bound or grown):
+            failed.append(name)
+    print(f"(frame size: {frame_bytes} bytes)")
+    print(f"In-place paths: no audio buffers per frame, only small Python objects (median bound "
+          f"{SMALL_OBJECTS_BOUND} bytes, {RESAMPLE_BOUND} when resampling); not zero in CPython. "
+          f"PyAudio's blocking read() adds one new frame per read.")
+    if failed:
+        print(f"FAILED: over the bound per frame or pool grown: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
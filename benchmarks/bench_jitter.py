@@ -0,0 +1,88 @@
+# Jitter buffer benchmark
+#
+# Simulates the playback loop on a virtual clock: server chunks of each size in
+# `--chunk-ms` arrive at real-time pace (optionally with random arrival jitter) and
+# the buffer is drained one playout frame every `--frame-ms`. Reports per chunk size
+# the target depth, the average depth (the latency the buffer adds), underruns,
+# overruns and compressed frames, and then the same after a network stall that
+# delivers `--stall-ms` of audio in one burst.
+#
+# Steady arrival must play without a single underrun, overrun or compressed frame
+# whatever the chunk size; the script exits with status 1 if it doesn't, so it can
+# guard changes to the buffer.
+#
+#   python benchmarks/bench_jitter.py --chunk-ms 20 100 200 --jitter-ms 5
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sesame_voice.jitter_buffer import JitterBuffer
+
+RATE = 24000
+FRAME_BYTES_PER_MS = RATE * 2 // 1000
+
+
+# Play `seconds` of chunk_ms chunks; returns the buffer and its average depth while playing
+def simulate(chunk_ms, frame_ms, seconds, jitter_ms, stall_ms, policy, seed=0):
+    rng = random.Random(seed)
+    buffer = JitterBuffer(RATE, overflow_policy=policy)
+    chunk = bytes(chunk_ms * FRAME_BYTES_PER_MS)
+    frame_bytes = frame_ms * FRAME_BYTES_PER_MS
+
+    arrivals = []
+    for i in range(int(seconds * 1000 / chunk_ms)):
+        at = i * chunk_ms + rng.uniform(0, jitter_ms)
+        # Everything due during the stall arrives when it ends
+        if stall_ms and seconds * 500 <= at < seconds * 500 + stall_ms:
+            at = seconds * 500 + stall_ms
+        arrivals.append(at)
+    arrivals.sort()
+
+    depths = []
+    next_arrival = 0
+    for tick in range(int(seconds * 1000 / frame_ms)):
+        now_ms = tick * frame_ms
+        while next_arrival < len(arrivals) and arrivals[next_arrival] <= now_ms:
+            buffer.push(chunk, now=arrivals[next_arrival] / 1000)
+            next_arrival += 1
+        if buffer.pop(frame_bytes, now=now_ms / 1000) and next_arrival < len(arrivals):
+            depths.append(buffer.depth_ms())
+    return buffer, sum(depths) / len(depths) if depths else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunk-ms", type=int, nargs="+", default=[20, 40, 100, 200], help="Server chunk sizes")
+    parser.add_argument("--frame-ms", type=int, default=20, help="Playout frame")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Audio per run")
+    parser.add_argument("--jitter-ms", type=float, default=5.0, help="Random delay added to each arrival")
+    parser.add_argument("--stall-ms", type=int, default=300, help="Network stall in the second set of runs")
+    parser.add_argument("--policy", default="compress", help="Overflow policy")
+    args = parser.parse_args()
+
+    failed = False
+    header = (f"{'chunk':<8} {'target ms':>10} {'avg depth ms':>13} {'underruns':>10} "
+              f"{'overruns':>9} {'compressed':>11}")
+    for stall_ms in (0, args.stall_ms):
+        print(f"{args.seconds:g}s, {args.frame_ms}ms frames, up to {args.jitter_ms:g}ms arrival jitter, "
+              f"{f'a {stall_ms}ms stall' if stall_ms else 'steady'}, {args.policy}")
+        print(header)
+        for chunk_ms in args.chunk_ms:
+            buffer, depth = simulate(chunk_ms, args.frame_ms, args.seconds, args.jitter_ms, stall_ms, args.policy)
+            print(f"{f'{chunk_ms}ms':<8} {buffer.target_ms:>10.0f} {depth:>13.0f} {buffer.underruns:>10} "
+                  f"{buffer.overruns:>9} {buffer.compressed_frames:>11}")
+            if not stall_ms and (buffer.underruns or buffer.overruns or buffer.compressed_frames):
+                failed = True
+        print()
+
+    if failed:
+        print("FAILED: steady arrival should play without underruns, overruns or compression")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Capture-loop jitter benchmark for the logging pipeline
+#
+# Runs a capture loop on a real-time virtual microphone that, like the client while
+# you speak, logs a message and updates the level meter on every frame. The log handler
+# and the console stream are made slow on purpose (most writes take a fraction of a
+# millisecond, an occasional one stalls like a busy disk or a scrolled-back terminal).
+# Reports how late each frame is picked up with the old synchronous setup (handler and
+# meter print on the capture thread) and with the queue-based pipeline and meter thread.
+#
+#   python benchmarks/bench_logging.py --seconds 10 --stall-ms 50
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sesame_voice.audio_io import SilenceSource, VirtualInputStream
+from sesame_voice.logs import MeterRenderer, start_async_logging
+
+
+# Stand-in for a disk or terminal that is usually fast but sometimes stalls
+class SlowSink:
+    def __init__(self, stall_ms, stall_chance, seed=0):
+        self.stall = stall_ms / 1000
+        self.stall_chance = stall_chance
+        self.random = random.Random(seed)
+
+    def delay(self):
+        time.sleep(self.stall if self.random.random() < self.stall_chance else 0.0002)
+
+    # File-like interface for the meter
+    def write(self, text):
+        self.delay()
+
+    def flush(self):
+        pass
+
+
+class SlowHandler(logging.Handler):
+    def __init__(self, sink):
+        super().__init__()
+        self.sink = sink
+
+    def emit(self, record):
+        self.format(record)
+        self.sink.delay()
+
+
+def capture_loop(seconds, frame_ms, log, meter_update):
+    rate = 16000
+    frames = int(rate * frame_ms / 1000)
+    period = frames / rate
+    stream = VirtualInputStream(SilenceSource(), 2, 1, rate)
+
+    stream.read(frames)
+    first = time.monotonic()
+    lateness_ms = []
+    for i in range(1, int(seconds / period)):
+        stream.read(frames)
+        lateness_ms.append((time.monotonic() - (first + i * period)) * 1000)
+        # What the capture loop does per speaking frame
+        level = 1000.0 + i % 50
+        log.info(f"Speaking detected. Energy level: {level:.1f}")
+        meter_update(level, level)
+    return lateness_ms
+
+
+def describe(values):
+    values = sorted(values)
+    p99 = values[int(0.99 * (len(values) - 1))]
+    late = sum(1 for v in values if v > 5)
+    return (f"p50 {values[len(values) // 2]:6.2f}ms  p99 {p99:6.2f}ms  max {values[-1]:6.2f}ms  "
+            f"frames >5ms late: {late}/{len(values)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--frame-ms", type=float, default=20.0)
+    parser.add_argument("--stall-ms", type=float, default=50.0, help="Duration of an occasional slow write")
+    parser.add_argument("--stall-chance", type=float, default=0.02, help="Probability that a write stalls")
+    args = parser.parse_args()
+
+    log = logging.getLogger("bench")
+    root = logging.getLogger()
+
+    # Synchronous: handler and meter print run on the capture thread
+    sink = SlowSink(args.stall_ms, args.stall_chance)
+    handler = SlowHandler(sink)
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+    def print_meter(level, energy):
+        bars = int(min(level / 100, 20))
+        sink.write(f"\rMic: {'|' * bars}{' ' * (20 - bars)} Level: {energy:.0f}")
+
+    sync = capture_loop(args.seconds, args.frame_ms, log, print_meter)
+    root.removeHandler(handler)
+
+    # Queue-based logging and a meter thread at 10 fps
+    sink = SlowSink(args.stall_ms, args.stall_chance)
+    async_logging = start_async_logging([SlowHandler(sink)], rate=None)
+    meter = MeterRenderer(stream=sink)
+    meter.start()
+    queued = capture_loop(args.seconds, args.frame_ms, log, meter.update)
+    meter.stop()
+    async_logging.stop()
+
+    print(f"synchronous   {describe(sync)}")
+    print(f"async + meter {describe(queued)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Resampler benchmark and quality check
+#
+# For common device/server rate pairs, feeds one second of audio through
+# StreamingResampler in 20 ms chunks and reports the cost per chunk and how many times
+# faster than real time it runs. Quality is checked against a reference resample done
+# with one FFT over the whole signal: the test signal is a sum of tones inside the
+# passband with a whole number of cycles, so the FFT resample of it is exact, and the
+# streaming output (shifted by the filter delay) should match it to within int16
+# rounding. Exits non-zero if any pair falls below --min-snr.
+#
+#   python benchmarks/bench_resample.py --seconds 5
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sesame_voice.resample import StreamingResampler
+
+RATE_PAIRS = [(16000, 48000), (24000, 48000), (24000, 44100), (44100, 16000), (48000, 16000)]
+
+# Fraction of the lower Nyquist frequency the filter passes flat (to within 0.01 dB);
+# above it the response rolls off towards the stopband
+FLAT_PASSBAND = 0.7
+
+
+# Sum of tones with a whole number of cycles in `seconds`, up to the passband edge
+def test_signal(rate, passband, seconds):
+    n = int(rate * seconds)
+    t = np.arange(n) / rate
+    freqs = np.round(np.linspace(100, passband, 12) * seconds) / seconds
+    signal = sum(np.sin(2 * np.pi * f * t + i) for i, f in enumerate(freqs))
+    return (signal / len(freqs) * 20000).astype(np.int16)
+
+
+# Band-limited resample of a periodic signal, delayed by `delay` output samples
+def fft_reference(x, out_len, delay):
+    spectrum = np.fft.rfft(x.astype(np.float64))
+    out_bins = out_len // 2 + 1
+    resized = np.zeros(out_bins, dtype=complex)
+    keep = min(out_bins, len(spectrum))
+    resized[:keep] = spectrum[:keep]
+    resized *= np.exp(-2j * np.pi * np.arange(out_bins) * delay / out_len)
+    return np.fft.irfft(resized, out_len) * out_len / len(x)
+
+
+def run_chunks(resampler, x, chunk):
+    return np.frombuffer(b"".join(resampler.process(x[i:i + chunk].tobytes())
+                                  for i in range(0, len(x), chunk)), dtype=np.int16)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=2.0, help="Audio to convert per rate pair")
+    parser.add_argument("--chunk-ms", type=float, default=20.0, help="Size of the chunks fed in")
+    parser.add_argument("--min-snr", type=float, default=60.0, help="Lowest acceptable SNR in dB")
+    args = parser.parse_args()
+
+    print(f"{'conversion':>15} {'us/chunk':>9} {'x realtime':>11} {'SNR dB':>7}")
+    failed = False
+    for in_rate, out_rate in RATE_PAIRS:
+        passband = FLAT_PASSBAND * min(in_rate, out_rate) / 2
+        x = test_signal(in_rate, passband, args.seconds)
+        chunk = int(in_rate * args.chunk_ms / 1000)
+
+        resampler = StreamingResampler(in_rate, out_rate)
+        start = time.perf_counter()
+        y = run_chunks(resampler, x, chunk)
+        elapsed = time.perf_counter() - start
+        chunks = -(-len(x) // chunk)
+
+        # Compare away from the start, where the filter is still filling up
+        reference = fft_reference(x, len(y), resampler.latency() * out_rate)
+        edge = int(0.05 * out_rate)
+        error = y[edge:-edge] - reference[edge:-edge]
+        snr = 10 * np.log10(np.mean(reference[edge:-edge] ** 2) / np.mean(error ** 2))
+        failed |= snr < args.min_snr
+
+        print(f"{in_rate:>6} -> {out_rate:<6} {elapsed / chunks * 1e6:>9.1f} "
+              f"{args.seconds / elapsed:>11.0f} {snr:>7.1f}")
+
+    if failed:
+        print(f"FAIL: SNR below {args.min_snr} dB")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Session scaling benchmark
+#
+# Runs N concurrent sessions in one process against the in-process loopback websocket,
+# with virtual audio devices that stream a looping tone in real time, and reports how
+# CPU time and resident memory grow per session. Each N runs in a fresh process.
+# With --vad the tone alternates with silence (1 s on, 2 s off) and the voice activity
+# gate is enabled, to show how much uplink traffic it saves.
+#
+#   python benchmarks/bench_sessions.py --sessions 1 4 16 64 --duration 10 --engine asyncio
+#   python benchmarks/bench_sessions.py --sessions 1 16 --vad
+
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sesame_voice.audio_io import LoopSource, VirtualBackend
+from sesame_voice.loopback import LoopbackWebSocket
+from sesame_voice.session import Session, SessionConfig, SessionManager
+
+
+# Resident set size in MiB (current where /proc is available, otherwise peak)
+def rss_mib():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def tone(rate, seconds=1.0, freq=440.0, amplitude=3000):
+    t = np.arange(int(rate * seconds)) / rate
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.int16).tobytes()
+
+
+def run_sessions(n, duration, engine, vad=False):
+    logging.basicConfig(level=logging.ERROR)
+    pcm = tone(16000)
+    if vad:
+        pcm += bytes(len(pcm) * 2)
+    config = SessionConfig(engine=engine, interactive=False, vad=vad)
+    backend = VirtualBackend(source_factory=lambda: LoopSource(pcm))
+
+    manager = SessionManager(engine)
+    for i in range(n):
+        manager.add(Session("benchmark", backend, config, name=f"s{i}",
+                            ws_factory=LoopbackWebSocket))
+
+    rss_before = rss_mib()
+    cpu_before = time.process_time()
+    wall_before = time.monotonic()
+    manager.run(duration)
+    cpu = time.process_time() - cpu_before
+    wall = time.monotonic() - wall_before
+    rss_after = rss_mib()
+
+    stats = manager.stats()
+    return {
+        "sessions": n,
+        "wall_s": wall,
+        "cpu_pct_per_session": 100.0 * cpu / wall / n,
+        "rss_mib": rss_after,
+        "rss_mib_per_session": (rss_after - rss_before) / n,
+        "frames_sent": sum(s["frames_sent"] for s in stats),
+        "bytes_received": sum(s["bytes_received"] for s in stats),
+        "uplink_kib_s_per_session": sum(s["bytes_sent"] for s in stats) / 1024 / wall / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per run")
+    parser.add_argument("--engine", choices=("asyncio", "threads"), default="asyncio")
+    parser.add_argument("--vad", action="store_true", help="Alternate tone and silence and gate the uplink")
+    args = parser.parse_args()
+
+    print(f"{'sessions':>8} {'cpu%/session':>13} {'rss MiB':>8} {'MiB/session':>12} {'frames sent':>12} "
+          f"{'uplink KiB/s':>13}")
+    ctx = multiprocessing.get_context("spawn")
+    for n in args.sessions:
+        with ctx.Pool(1) as pool:
+            result = pool.apply(run_sessions, (n, args.duration, args.engine, args.vad))
+        print(f"{result['sessions']:>8} {result['cpu_pct_per_session']:>13.2f} "
+              f"{result['rss_mib']:>8.1f} {result['rss_mib_per_session']:>12.2f} "
+              f"{result['frames_sent']:>12} {result['uplink_kib_s_per_session']:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
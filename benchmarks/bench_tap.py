@@ -0,0 +1,124 @@
+# Shared-memory audio tap benchmark
+#
+# Publishes microphone-sized frames into an AudioTap at `--speed` times real time while
+# reader processes consume them in place: a fast one, and one that sleeps for
+# `--slow-ms` per frame and so falls behind and loses frames. Every frame carries its
+# sequence number in its first bytes, so the readers check that what they read is the
+# frame they were told it is (and that TapFrame.valid() catches every frame that was
+# overwritten while in use). Reports the producer's cost per publish with and without
+# readers attached, and per reader the frames read, lost and torn.
+#
+#   python benchmarks/bench_tap.py --seconds 10 --speed 20
+
+import argparse
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sesame_voice.recorder import MIC_TRACK
+from sesame_voice.tap import AudioTap, TapReader
+
+SEQ = struct.Struct("<Q")
+
+
+# Reader process: consume frames in place until the tap closes
+def read_tap(path, slow_ms, ready, results):
+    reader = TapReader(path, MIC_TRACK)
+    ready.set()
+    mismatched = 0
+    torn = 0
+    level = 0.0
+    while True:
+        frame = reader.wait(timeout=5)
+        if frame is None:
+            break
+        samples = np.frombuffer(frame.data, dtype=np.int16)
+        level = max(level, float(np.abs(samples[4:]).max()))
+        seq = SEQ.unpack_from(frame.data)[0]
+        if slow_ms:
+            time.sleep(slow_ms / 1000)
+        if not frame.valid():
+            torn += 1
+        elif seq != frame.seq:
+            mismatched += 1
+        del samples
+        frame.data.release()
+    results.put({"slow_ms": slow_ms, "frames": reader.frames, "lost": reader.lost, "torn": torn,
+                 "mismatched": mismatched, "level": level})
+    reader.close()
+
+
+# Publish `frames` frames; returns the median and worst cost per publish in microseconds
+def publish(tap, frames, frame_bytes, interval):
+    pcm = (3000 * np.sin(np.arange(frame_bytes // 2) / 8)).astype(np.int16)
+    buffer = bytearray(pcm.tobytes())
+    costs = np.zeros(frames)
+    next_time = time.monotonic()
+    for seq in range(frames):
+        SEQ.pack_into(buffer, 0, seq)
+        start = time.perf_counter()
+        tap.publish(MIC_TRACK, buffer, 16000)
+        costs[seq] = (time.perf_counter() - start) * 1e6
+        next_time += interval
+        delay = next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    return float(np.median(costs)), float(costs.max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=10.0, help="Audio published per run")
+    parser.add_argument("--speed", type=float, default=20.0, help="Publishing speed (1.0 is real time)")
+    parser.add_argument("--chunk", type=int, default=1024, help="Samples per frame")
+    parser.add_argument("--slots", type=int, default=256, help="Slots per direction")
+    parser.add_argument("--slow-ms", type=float, default=5.0, help="Time the slow reader spends per frame")
+    args = parser.parse_args()
+
+    frame_bytes = args.chunk * 2
+    frames = int(args.seconds * 16000 / args.chunk)
+    interval = args.chunk / 16000 / args.speed
+    path = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+                        f"sesame_tap_bench_{os.getpid()}")
+
+    tap = AudioTap(path, slots=args.slots, slot_bytes=frame_bytes)
+    alone = publish(tap, frames, frame_bytes, interval)
+    tap.close()
+
+    tap = AudioTap(path, slots=args.slots, slot_bytes=frame_bytes)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    readers = []
+    for slow_ms in (0, args.slow_ms):
+        ready = context.Event()
+        process = context.Process(target=read_tap, args=(path, slow_ms, ready, results))
+        process.start()
+        ready.wait()
+        readers.append(process)
+    shared = publish(tap, frames, frame_bytes, interval)
+    tap.close(remove=False)
+    reports = [results.get() for _ in readers]
+    for process in readers:
+        process.join()
+    os.remove(path)
+
+    print(f"{frames} frames of {frame_bytes} bytes at {args.speed:g}x real time, {args.slots} slots")
+    print(f"{'publish':<22} {'p50 us':>8} {'max us':>8}")
+    print(f"{'no readers':<22} {alone[0]:>8.1f} {alone[1]:>8.1f}")
+    print(f"{'2 readers':<22} {shared[0]:>8.1f} {shared[1]:>8.1f}")
+    print(f"{'reader':<22} {'frames':>8} {'lost':>8} {'torn':>8} {'mismatched':>11}")
+    for report in sorted(reports, key=lambda r: r["slow_ms"]):
+        name = f"sleeps {report['slow_ms']:g}ms/frame" if report["slow_ms"] else "fast"
+        print(f"{name:<22} {report['frames']:>8} {report['lost']:>8} {report['torn']:>8} "
+              f"{report['mismatched']:>11}")
+
+
+if __name__ == "__main__":
+    main()
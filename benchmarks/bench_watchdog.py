@@ -0,0 +1,108 @@
+# Stall watchdog benchmark
+#
+# Measures what a Heartbeat costs per beat, then runs a loop paced like the capture
+# loop (one beat per `--frame-ms` frame) for `--seconds`, with and without a Watchdog
+# thread, injecting stalls of each length in `--stalls` at random frames. Reports the
+# process CPU time per second of loop both ways, and per stall length how many stalls
+# were injected, counted by the heartbeat (and its histogram) and sampled by the
+# watchdog with the stack they happened in.
+#
+#   python benchmarks/bench_watchdog.py --seconds 10 --stalls 50 150 400
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sesame_voice.metrics import LATENCY_BUCKETS, Histogram
+from sesame_voice.watchdog import Heartbeat, Watchdog
+
+
+def beat_cost(beats):
+    heartbeat = Heartbeat("bench")
+    start = time.perf_counter()
+    for _ in range(beats):
+        heartbeat.beat(1.0)
+    return (time.perf_counter() - start) / beats * 1e9
+
+
+# The stack the watchdog should find the loop in
+def injected_stall(ms):
+    time.sleep(ms / 1000)
+
+
+# Run the paced loop; returns the stalls injected per length and the CPU time used
+def run_loop(heartbeat, seconds, frame_ms, stalls, stall_every):
+    rng = random.Random(0)
+    injected = {ms: [] for ms in stalls}
+    frame = frame_ms / 1000
+    cpu = time.process_time()
+    next_time = time.monotonic()
+    end = next_time + seconds
+    while next_time < end:
+        heartbeat.beat(frame)
+        if rng.random() < 1 / stall_every:
+            ms = rng.choice(stalls)
+            injected[ms].append(time.monotonic())
+            injected_stall(frame_ms + ms)
+            next_time = time.monotonic()
+        next_time += frame
+        delay = next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    heartbeat.pause()
+    return injected, time.process_time() - cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--beats", type=int, default=1000000, help="Beats timed for the per-beat cost")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Length of each paced run")
+    parser.add_argument("--frame-ms", type=float, default=20.0, help="Loop period")
+    parser.add_argument("--stalls", type=float, nargs="+", default=[50, 150, 400],
+                        help="Stall lengths injected, in ms past the deadline")
+    parser.add_argument("--stall-every", type=int, default=25, help="One stall per this many frames, on average")
+    parser.add_argument("--threshold-ms", type=float, default=100, help="Stall threshold")
+    parser.add_argument("--interval", type=float, default=0.05, help="Watchdog check interval")
+    parser.add_argument("--verbose", action="store_true", help="Show the watchdog's stall warnings")
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.getLogger("sesame_voice").setLevel(logging.ERROR)
+
+    print(f"Heartbeat.beat(): {beat_cost(args.beats):.0f} ns")
+
+    heartbeat = Heartbeat("loop", args.threshold_ms)
+    _, alone = run_loop(heartbeat, args.seconds, args.frame_ms, args.stalls, args.stall_every)
+
+    histogram = Histogram("stalls", "", LATENCY_BUCKETS)
+    heartbeat = Heartbeat("loop", args.threshold_ms, histogram)
+    watchdog = Watchdog(interval=args.interval)
+    watchdog.watch("bench/loop", heartbeat)
+    watchdog.start()
+    injected, watched = run_loop(heartbeat, args.seconds, args.frame_ms, args.stalls, args.stall_every)
+    watchdog.stop()
+
+    sampled = sum(count for stack, count in heartbeat.profile.items()
+                  if any(frame.startswith("injected_stall ") for frame in stack))
+    print(f"{args.seconds:g}s at {args.frame_ms:g}ms frames, threshold {args.threshold_ms:g}ms, "
+          f"watchdog every {args.interval * 1000:g}ms")
+    print(f"{'CPU per second':<24} {'no watchdog':>12} {'watchdog':>12}")
+    print(f"{'':<24} {alone / args.seconds * 1000:>10.2f}ms {watched / args.seconds * 1000:>10.2f}ms")
+    print(f"{'stall length':<24} {'injected':>12} {'expected':>12}")
+    expected = 0
+    for ms, times in sorted(injected.items()):
+        counted = len(times) if ms > args.threshold_ms else 0
+        expected += counted
+        print(f"{f'{ms:g}ms':<24} {len(times):>12} {counted:>12}")
+    print(f"Counted: {heartbeat.stalls} (expected {expected}), histogram: {histogram.count}, "
+          f"sampled while stalled: {heartbeat.sampled_stalls}, worst: {heartbeat.worst_stall * 1000:.0f}ms")
+    print(f"Stack samples: {heartbeat.samples}, {sampled} in injected_stall, "
+          f"{len(heartbeat.profile)} distinct stacks, sampling time {watchdog.sampling_time * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,121 +1,227 @@
+# Sesame voice client
+#
+# Startup is arranged so the first microphone frame goes out as early as possible.
+# Nothing runs at import. main() fetches the first token (with sesame_ai imported on that
+# thread), imports the session modules (numpy, asyncio) and opens PyAudio concurrently.
+# The connection starts as soon as the session exists, while the microphone is picked
+# (from the cache when possible) and the streams are opened. The phase timings are
+# logged once the first frame has been sent.
+
 import time
-import threading
-import pyaudio
-import numpy as np
+
+# Startup is measured from here
+STARTED = time.monotonic()
+
+import argparse
+import atexit
+import functools
+import json
 import logging
 import os
+import signal
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from sesame_ai import SesameAI, TokenManager, SesameWebSocket
+from sesame_voice.logs import start_async_logging
+from sesame_voice.startup import StartupTimer
+from sesame_voice.tokens import SesameTokenSource, TokenService
 
-# Set up logging
-log_dir = "logs"
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
-
-log_filename = os.path.join(log_dir, f"sesame_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger("sesame_voice")
 
-logger.info("Starting Sesame Voice Client")
+log_dir = "logs"
+log_filename = os.path.join(log_dir, f"sesame_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
 
-# Initialize the client and get a token
-try:
-    client = SesameAI()
-    token_manager = TokenManager(client, token_file="token.json")
-    id_token = token_manager.get_valid_token()
-    logger.info("Successfully obtained authentication token")
-except Exception as e:
-    logger.error(f"Failed to initialize Sesame client: {e}")
-    logger.debug(traceback.format_exc())
-    raise
+# The file and console handlers run on a background thread fed by a queue, so disk or
+# terminal stalls never reach the audio loops. Each log call site is limited to
+# LOG_RATE_LIMIT messages per second (after a burst); set it to None to disable
+LOG_RATE_LIMIT = 5
 
 # Choose character: "Miles" or "Maya"
 CHARACTER = "Maya"  # Change to "Miles" if you prefer
-logger.info(f"Selected character: {CHARACTER}")
-
-# Global variables
-connection_active = True
-current_ws = None
-reconnect_count = 0
-audio_reset_count = 0
-
-# Function to create and set up a new websocket connection
-def setup_connection():
-    global current_ws, reconnect_count
-    
-    logger.info("Setting up new WebSocket connection")
-    
-    # Set up WebSocket connection
-    ws = SesameWebSocket(id_token=id_token, character=CHARACTER)
-    
-    # Connection callbacks
-    def on_connect():
-        logger.info(f"Connected to {CHARACTER}! Start speaking...")
-
-    def on_disconnect():
-        logger.info(f"Disconnected from {CHARACTER}")
-        
-    ws.set_connect_callback(on_connect)
-    ws.set_disconnect_callback(on_disconnect)
-    
-    # Connect to the server
-    logger.info(f"Connecting to {CHARACTER}...")
-    try:
-        ws.connect()
-    except Exception as e:
-        logger.error(f"Connection error: {e}")
-        logger.debug(traceback.format_exc())
-        return None
-    
-    # Wait for connection to establish
-    time.sleep(2)
-    
-    if ws.is_connected():
-        logger.info(f"Successfully connected to {CHARACTER}")
-        current_ws = ws
-        reconnect_count += 1
-        logger.info(f"Connection established. Reconnect count: {reconnect_count}")
-        return ws
-    else:
-        logger.error("Failed to connect. Will retry...")
-        return None
+
+# Websocket endpoint to connect to instead of the Sesame service, e.g. a local stand-in
+# server ("ws://127.0.0.1:8765/"); None uses the service
+SESAME_URL = None
+
+# Engine running the session: "threads" runs the capture, playback and monitor loops as
+# daemon threads, "asyncio" runs them as tasks on one event loop that wait on events
+ENGINE = "threads"
 
 # Audio settings
 CHUNK = 1024
-FORMAT = pyaudio.paInt16
+# Frame size auto-tuning: instead of CHUNK, start at the smallest of CHUNK_CANDIDATES and
+# move up while capture, the uplink or playback glitch. The size that settles is stored
+# per microphone in CHUNK_CACHE_FILE and used from the start next time
+CHUNK_AUTOTUNE = False
+CHUNK_CANDIDATES = (256, 512, 1024, 2048)
+CHUNK_CACHE_FILE = "chunk_sizes.json"
+SAMPLE_WIDTH = 2  # 16-bit samples
 CHANNELS = 1
 RATE = 16000
+# The speaker stays open at this rate for the whole session; the character's audio is
+# resampled to it, so a different server rate never means reopening the device
+SPEAKER_RATE = 48000
+
+# Audio I/O mode: "blocking" reads/writes the device directly from the worker threads,
+# "callback" lets PortAudio callbacks feed and drain ring buffers instead
+AUDIO_IO_MODE = "blocking"
+
+# Playback jitter buffer between the websocket and the speaker. Its target depth adapts
+# to measured network jitter (never below JITTER_MIN_DELAY_MS), and buffered audio is
+# capped at JITTER_MAX_LATENCY_MS by dropping ("drop") or speeding up ("compress", which
+# keeps the pitch) the backlog
+JITTER_BUFFER_ENABLED = True
+JITTER_MIN_DELAY_MS = 40
+JITTER_MAX_LATENCY_MS = 400
+JITTER_OVERFLOW_POLICY = "compress"
+JITTER_FRAME_MS = 20  # Playout frame written to the speaker
+
+# Keep a pre-connected standby websocket to switch to when the active one drops
+HOT_STANDBY = False
+
+# Microphone frames are sent from their own thread through a bounded queue, so a slow
+# network never stalls capture. When the queue is full: "drop_oldest" discards the oldest
+# frame, "drop_silence" discards silent frames first, "coalesce" sends the backlog in
+# larger messages (up to UPLINK_COALESCE_MAX frames each)
+UPLINK_POLICY = "drop_oldest"
+UPLINK_QUEUE_FRAMES = 50  # About 3 seconds of audio at CHUNK=1024, 16 kHz
+UPLINK_COALESCE_MAX = 4
+
+# Voice activity gate: send microphone audio only while you are speaking, plus
+# VAD_HANGOVER_MS after the last loud frame and VAD_PREROLL_MS of audio before it
+# starts. In silence nothing is sent, or one frame every VAD_KEEPALIVE_MS if non-zero.
+# Off by default because the server uses the trailing silence to detect end of turn
+VAD_ENABLED = False
+VAD_HANGOVER_MS = 500
+VAD_PREROLL_MS = 200
+VAD_KEEPALIVE_MS = 0
+
+# Record both sides of the conversation (your microphone on the left channel, the
+# character on the right) to recordings/ as "wav" or headerless "raw" 16-bit PCM
+RECORD_CONVERSATION = False
+RECORD_FORMAT = "wav"
+
+# Publish both directions to a shared-memory audio tap at this path, for transcription or
+# monitoring processes to read with sesame_voice.tap.TapReader (None disables it)
+TAP_PATH = None
+
+# Microphone front-end: automatic gain control towards MIC_AGC_TARGET (RMS), and a noise
+# gate that attenuates frames quieter than MIC_NOISE_GATE (0 disables it)
+MIC_AGC = False
+MIC_AGC_TARGET = 3000
+MIC_NOISE_GATE = 0
+
+# Barge-in: when you talk over the character (BARGE_IN_MS of microphone audio louder
+# than BARGE_IN_ENERGY while it plays), its queued audio is dropped at once and the rest
+# of that reply is discarded until the server has been quiet for BARGE_IN_RESUME_MS.
+# SUPPRESS_BLEED sends silence instead of quieter microphone frames while it plays, so
+# the server doesn't hear the speaker through the microphone (not needed with a headset).
+# Off by default: loud speakers without echo cancellation can interrupt the character
+BARGE_IN = False
+BARGE_IN_ENERGY = 1500
+BARGE_IN_MS = 100
+BARGE_IN_RESUME_MS = 300
+SUPPRESS_BLEED = False
+
+# Latency and throughput metrics in Prometheus text format: served on
+# http://127.0.0.1:METRICS_PORT/metrics while running (None disables the endpoint) and
+# written to METRICS_FILE on exit (None disables the dump)
+METRICS_PORT = 9464
+METRICS_FILE = os.path.join(log_dir, f"metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prom")
+
+# Timeline of every turn (your speech, server think time, character playback,
+# reconnects) written on exit as Chrome trace JSON; open it in chrome://tracing or
+# https://ui.perfetto.dev (None disables it)
+TRACE_FILE = os.path.join(log_dir, f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+
+# Stall watchdog: the capture, playback and uplink loops are logged with the stack they
+# are stuck in whenever they fall more than SessionConfig.stall_threshold_ms behind.
+# SIGUSR1 (kill -USR1 <pid>) writes every stack sampled so far to STALL_PROFILE_FILE as
+# collapsed stacks for flamegraph.pl or speedscope; it is also written on exit if any
+# stall was sampled (None disables the file)
+WATCHDOG = True
+STALL_PROFILE_FILE = os.path.join(log_dir, f"stalls_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+
+# The microphone picked last time is kept here and reused without asking, as long as
+# the device at that index still has the same name (--select-mic asks again; None
+# disables the cache)
+DEVICE_CACHE_FILE = "audio_device.json"
+
+
+# Command line: with --input the client runs headless, streaming audio files in place of
+# the microphone and writing the character's audio to --output in place of the speaker
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sesame voice client")
+    parser.add_argument("--input", nargs="+", metavar="FILE",
+                        help="WAV or raw 16-bit PCM files to stream as the microphone, one after another")
+    parser.add_argument("--output", metavar="FILE",
+                        help="Write received audio to this WAV (.wav) or raw PCM file instead of playing it")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Headless pacing: 1 is real time, 2 twice as fast, 0 as fast as possible")
+    parser.add_argument("--linger", type=float, default=5.0,
+                        help="Seconds to keep the session open after the last input file")
+    parser.add_argument("--select-mic", action="store_true",
+                        help="Choose the microphone again instead of reusing the last one")
+    return parser.parse_args()
 
-# Initialize PyAudio
-p = pyaudio.PyAudio()
 
-# Function to list and select audio devices
-def select_microphone():
-    # Get a list of all input devices
+def setup_logging():
+    os.makedirs(log_dir, exist_ok=True)
+    log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    log_handlers = [logging.FileHandler(log_filename), logging.StreamHandler()]
+    for handler in log_handlers:
+        handler.setFormatter(log_formatter)
+    async_logging = start_async_logging(log_handlers, level=logging.INFO, rate=LOG_RATE_LIMIT)
+    # Flush queued records even if startup fails
+    atexit.register(async_logging.stop)
+    return async_logging
+
+
+# Runs on a startup thread: the session modules and what they pull in (numpy, asyncio)
+def load_modules():
+    import sesame_voice.audio_io
+    import sesame_voice.metrics
+    import sesame_voice.session
+    import sesame_voice.tracing
+
+
+# Runs on a startup thread: fetch the first token and start refreshing it in the
+# background. The token is cached in memory, so reconnects never wait for token.json
+# or the network
+def start_token_service(token_service):
+    try:
+        token_service.start()
+        logger.info("Successfully obtained authentication token")
+    except Exception as e:
+        logger.error(f"Failed to initialize Sesame client: {e}")
+        logger.debug(traceback.format_exc())
+        raise
+
+
+# Input devices of the default host API as (device id, name)
+def list_microphones(p):
     input_devices = []
     info = p.get_host_api_info_by_index(0)
-    num_devices = info.get('deviceCount')
-    
-    logger.info("\nAVAILABLE MICROPHONES:")
-    
-    for i in range(0, num_devices):
+    for i in range(0, info.get('deviceCount')):
         device_info = p.get_device_info_by_host_api_device_index(0, i)
         if device_info.get('maxInputChannels') > 0:
             input_devices.append((i, device_info.get('name')))
-            logger.info(f"{len(input_devices)}. Device id {i} - {device_info.get('name')}")
-    
+    return input_devices
+
+
+# Function to list and select audio devices; returns (device id, name) or None
+def select_microphone(p):
+    input_devices = list_microphones(p)
+
+    logger.info("\nAVAILABLE MICROPHONES:")
+    for n, (i, name) in enumerate(input_devices, 1):
+        logger.info(f"{n}. Device id {i} - {name}")
+
     if not input_devices:
         logger.error("No input devices found!")
         return None
-    
+
     # Let user select a device
     choice = None
     while choice is None:
@@ -129,481 +235,317 @@ def select_microphone():
                 logger.warning("Invalid selection. Please try again.")
         except ValueError:
             logger.warning("Please enter a number.")
-    
-    return choice[0]  # Return the device ID
-
-# Select microphone
-selected_mic_id = select_microphone()
-
-# Open microphone stream with selected device
-try:
-    mic_stream = p.open(format=FORMAT,
-                      channels=CHANNELS,
-                      rate=RATE,
-                      input=True,
-                      input_device_index=selected_mic_id,
-                      frames_per_buffer=CHUNK)
-    logger.info(f"Successfully connected to selected microphone (Device ID: {selected_mic_id})")
-except Exception as e:
-    logger.error(f"Error connecting to selected microphone: {e}")
-    logger.debug(traceback.format_exc())
-    logger.info("Falling back to default microphone...")
-    try:
-        mic_stream = p.open(format=FORMAT,
-                          channels=CHANNELS,
-                          rate=RATE,
-                          input=True,
-                          frames_per_buffer=CHUNK)
-        logger.info("Connected to default microphone")
-    except Exception as e:
-        logger.critical(f"Failed to open any microphone: {e}")
-        logger.debug(traceback.format_exc())
-        raise
 
-# Open speaker stream
-try:
-    speaker_stream = p.open(format=FORMAT,
-                           channels=CHANNELS,
-                           rate=16000,
-                           output=True)
-    logger.info("Speaker stream opened successfully")
-except Exception as e:
-    logger.critical(f"Failed to open speaker: {e}")
-    logger.debug(traceback.format_exc())
-    raise
-
-# Function to calculate audio energy - with proper error handling
-def calculate_energy(audio_data):
-    try:
-        audio_array = np.frombuffer(audio_data, dtype=np.int16)
-        # Check if array is empty or all zeros
-        if len(audio_array) == 0 or np.all(audio_array == 0):
-            return 0.0
-        
-        # Calculate energy safely
-        return float(np.sqrt(np.mean(np.square(audio_array.astype(float)))))
-    except Exception as e:
-        logger.warning(f"Error calculating audio energy: {e}")
-        return 0.0
-
-# Function to reset audio streams - more gentle approach
-def reset_audio_streams():
-    global mic_stream, speaker_stream, audio_reset_count
-    
-    logger.info("Performing gentle audio stream reset...")
-    audio_reset_count += 1
-    
-    # Save current speaker rate
-    current_speaker_rate = None
-    if hasattr(speaker_stream, '_rate'):
-        current_speaker_rate = speaker_stream._rate
-    elif current_ws and hasattr(current_ws, 'server_sample_rate'):
-        current_speaker_rate = current_ws.server_sample_rate
-    
-    # Reset microphone first, then speaker to minimize disruption
+    return choice
+
+
+# The cached microphone if the device at its index still has the same name. Only that
+# one device is queried, so a cache hit skips enumerating every device.
+def cached_microphone(p):
     try:
-        # Close and reopen microphone
-        mic_stream.stop_stream()
-        mic_stream.close()
-        logger.info("Microphone stream closed")
-        
-        # Brief pause
-        time.sleep(0.1)
-        
-        # Reopen microphone
-        mic_stream = p.open(format=FORMAT,
-                          channels=CHANNELS,
-                          rate=RATE,
-                          input=True,
-                          input_device_index=selected_mic_id,
-                          frames_per_buffer=CHUNK)
-        logger.info("Microphone stream reset successfully")
-        
-        # Now handle speaker
-        speaker_stream.stop_stream()
-        speaker_stream.close()
-        logger.info("Speaker stream closed")
-        
-        # Brief pause
-        time.sleep(0.1)
-        
-        # Determine correct rate for speaker
-        rate = 16000  # Default
-        if current_speaker_rate:
-            rate = current_speaker_rate
-        elif current_ws and hasattr(current_ws, 'server_sample_rate'):
-            rate = current_ws.server_sample_rate
-        
-        logger.info(f"Using sample rate for speaker: {rate}")
-        
-        # Reopen speaker
-        speaker_stream = p.open(format=FORMAT,
-                               channels=CHANNELS,
-                               rate=rate,
-                               output=True)
-        logger.info("Speaker stream reset successfully")
-        
-    except Exception as e:
-        logger.error(f"Error during gentle audio reset: {e}")
-        logger.debug(traceback.format_exc())
-        # Try a more aggressive reset as fallback
+        with open(DEVICE_CACHE_FILE) as f:
+            cached = json.load(f)
+        device_info = p.get_device_info_by_host_api_device_index(0, cached["id"])
+    except Exception:
+        return None
+    if device_info.get('name') != cached.get("name") or device_info.get('maxInputChannels') <= 0:
+        return None
+    return cached["id"], cached["name"]
+
+
+# Device id of the microphone to use: the cached one, or else ask and cache the answer
+def choose_microphone(p, ask=False):
+    if DEVICE_CACHE_FILE and not ask:
+        choice = cached_microphone(p)
+        if choice:
+            logger.info(f"Using microphone: {choice[1]} (Device ID: {choice[0]}); --select-mic to change")
+            return choice[0]
+
+    choice = select_microphone(p)
+    if choice is None:
+        return None
+    if DEVICE_CACHE_FILE:
         try:
-            # Close everything
-            if hasattr(mic_stream, 'close'):
-                mic_stream.close()
-            if hasattr(speaker_stream, 'close'):
-                speaker_stream.close()
-            
-            # Reopen with defaults
-            mic_stream = p.open(format=FORMAT,
-                              channels=CHANNELS,
-                              rate=RATE,
-                              input=True,
-                              input_device_index=selected_mic_id,
-                              frames_per_buffer=CHUNK)
-            
-            rate = 16000
-            if current_ws and hasattr(current_ws, 'server_sample_rate'):
-                rate = current_ws.server_sample_rate
-            
-            speaker_stream = p.open(format=FORMAT,
-                                   channels=CHANNELS,
-                                   rate=rate,
-                                   output=True)
-            logger.info("Audio reset completed via fallback method")
-        except Exception as e2:
-            logger.critical(f"Critical error during audio reset: {e2}")
-            raise
-    
-    logger.info(f"Audio reset completed. Total resets: {audio_reset_count}")
-
-# Function to capture and send microphone audio
-def capture_microphone():
-    logger.info("Microphone capture thread started")
-    
-    # Variables for voice activity visualization
-    audio_levels = []
-    max_level_history = 5
-    silent_frames = 0
-    speaking_frames = 0
-    
-    # Variables for connection management
-    last_activity_time = time.time()
-    stream_reset_interval = 180  # Reset audio streams every 3 minutes
-    last_stream_reset = time.time()
-    last_heartbeat = time.time()
-    
-    try:
-        while connection_active:
-            if current_ws and current_ws.is_connected():
-                try:
-                    # Read audio data with error handling
-                    try:
-                        data = mic_stream.read(CHUNK, exception_on_overflow=False)
-                    except Exception as e:
-                        logger.warning(f"Error reading from microphone: {e}")
-                        time.sleep(0.1)
-                        continue
-                    
-                    # Calculate energy for activity detection
-                    energy = calculate_energy(data)
-                    
-                    # Track audio levels for better visualization
-                    audio_levels.append(energy)
-                    if len(audio_levels) > max_level_history:
-                        audio_levels.pop(0)
-                    
-                    # Update activity time if there's significant audio
-                    if energy > 500:
-                        last_activity_time = time.time()
-                        speaking_frames += 1
-                        silent_frames = 0
-                        
-                        # Only log occasionally to avoid flooding
-                        if speaking_frames % 10 == 0:
-                            logger.debug(f"Speaking detected. Energy level: {energy:.1f}")
-                        
-                        # Visual representation of audio level
-                        avg_level = sum(audio_levels) / len(audio_levels) if audio_levels else 0
-                        bars = int(min(avg_level / 100, 20))
-                        print(f"\rMic: {'|' * bars}{' ' * (20-bars)} Level: {energy:.0f}", end='')
-                    else:
-                        silent_frames += 1
-                        speaking_frames = 0
-                        
-                        # Log silence periods (occasionally)
-                        if silent_frames % 100 == 0 and silent_frames > 0:
-                            logger.debug(f"Silence continues. Frames: {silent_frames}")
-                    
-                    # Send audio data with error handling
-                    try:
-                        current_ws.send_audio_data(data)
-                    except Exception as e:
-                        logger.error(f"Error sending audio data: {e}")
-                        logger.debug(traceback.format_exc())
-                        # Don't continue to avoid excessive error logging
-                        time.sleep(0.5)
-                        continue
-                    
-                    # Check if we need to reset the audio streams
-                    current_time = time.time()
-                    if current_time - last_stream_reset > stream_reset_interval:
-                        logger.info(f"Performing scheduled audio stream reset after {stream_reset_interval} seconds")
-                        reset_audio_streams()
-                        last_stream_reset = current_time
-                    
-                    # Send a heartbeat ping if there's been no activity
-                    if current_time - last_heartbeat > 5:  # Heartbeat every 5 seconds
-                        logger.debug("Sending regular heartbeat ping")
-                        last_heartbeat = current_time
-                        
-                        # If there's been no activity for a while, log it
-                        if current_time - last_activity_time > 10:
-                            logger.info("No audio activity detected for 10+ seconds")
-                        
-                except Exception as e:
-                    logger.error(f"Error in microphone capture loop: {e}")
-                    logger.debug(traceback.format_exc())
-                    time.sleep(1)
-            else:
-                logger.warning("Not connected in microphone thread. Waiting...")
-                time.sleep(2)
-    except KeyboardInterrupt:
-        logger.info("Microphone capture stopped by user")
-    except Exception as e:
-        logger.error(f"Microphone thread crashed: {e}")
-        logger.debug(traceback.format_exc())
-    finally:
-        logger.info("Microphone capture thread ending")
-
-# Function to play received audio
-def play_audio():
-    logger.info("Audio playback thread started")
-    receiving_audio = False
-    silent_frames = 0
-    
+            with open(DEVICE_CACHE_FILE, "w") as f:
+                json.dump({"id": choice[0], "name": choice[1]}, f)
+        except OSError as e:
+            logger.warning(f"Could not save the microphone choice: {e}")
+    return choice[0]
+
+
+# Start the frame size tuner from the size that settled on this microphone last time,
+# and store the one that settles this time (off the capture loop)
+def resume_tuned_chunk(session, p):
+    from sesame_voice.autotune import load_tuned_chunk, save_tuned_chunk
+
+    index = session.input_device_index
     try:
-        while connection_active:
-            if current_ws and current_ws.is_connected():
-                try:
-                    # Get audio with timeout and error handling
-                    try:
-                        audio_chunk = current_ws.get_next_audio_chunk(timeout=0.01)
-                    except Exception as e:
-                        if "timeout" not in str(e).lower():
-                            logger.warning(f"Error getting audio chunk: {e}")
-                        time.sleep(0.01)
-                        continue
-                    
-                    if audio_chunk:
-                        # Reset silent frame counter when we get audio
-                        silent_frames = 0
-                        
-                        if not receiving_audio:
-                            logger.info("Character started speaking")
-                            print("\n→ Receiving audio from character...")
-                            receiving_audio = True
-                        
-                        # Play audio with error handling
-                        try:
-                            speaker_stream.write(audio_chunk)
-                        except Exception as e:
-                            logger.error(f"Error playing audio: {e}")
-                    else:
-                        silent_frames += 1
-                        
-                        # If we've been receiving audio but now got silence for a while
-                        if receiving_audio and silent_frames > 100:  # About 1 second of silence
-                            logger.info("Character finished speaking")
-                            print("← Character finished speaking")
-                            receiving_audio = False
-                            
-                except Exception as e:
-                    if "timeout" not in str(e).lower():  # Ignore timeout exceptions
-                        logger.error(f"Error in audio playback loop: {e}")
-                        logger.debug(traceback.format_exc())
-                    time.sleep(0.1)
-            else:
-                logger.warning("Not connected in playback thread. Waiting...")
-                time.sleep(2)
-    except KeyboardInterrupt:
-        logger.info("Audio playback stopped by user")
-    except Exception as e:
-        logger.error(f"Playback thread crashed: {e}")
-        logger.debug(traceback.format_exc())
-    finally:
-        logger.info("Audio playback thread ending")
-
-# Function to periodically check and maintain the connection
-def connection_monitor():
-    global current_ws
-    
-    reconnection_attempts = 0
-    logger.info("Connection monitor thread started")
-    
-    while connection_active:
-        try:
-            # Check if connection is still active
-            if current_ws is None or not current_ws.is_connected():
-                reconnection_attempts += 1
-                logger.warning(f"Connection lost or not established. Reconnection attempt {reconnection_attempts}...")
-                
-                # Try to disconnect cleanly if there's an existing connection
-                if current_ws:
-                    try:
-                        current_ws.disconnect()
-                        logger.info("Successfully disconnected old connection")
-                    except Exception as e:
-                        logger.warning(f"Error disconnecting: {e}")
-                
-                # Create a new connection
-                current_ws = setup_connection()
-                
-                # If successfully reconnected, reset speaker stream to match server sample rate
-                if current_ws and current_ws.is_connected() and hasattr(current_ws, 'server_sample_rate'):
-                    try:
-                        logger.info(f"Adjusting speaker to server sample rate: {current_ws.server_sample_rate}Hz")
-                        speaker_stream.close()
-                        speaker_stream = p.open(format=FORMAT,
-                                               channels=CHANNELS,
-                                               rate=current_ws.server_sample_rate,
-                                               output=True)
-                    except Exception as e:
-                        logger.error(f"Error adjusting speaker rate: {e}")
-            else:
-                # Connection is good, log status occasionally
-                if reconnection_attempts > 0:
-                    logger.info(f"Connection stable after {reconnection_attempts} reconnection attempts")
-                    reconnection_attempts = 0
-        except Exception as e:
-            logger.error(f"Error in connection monitor: {e}")
-            logger.debug(traceback.format_exc())
-        
-        # Check every 10 seconds
-        time.sleep(10)
-
-# Function to periodically check for system health and log statistics
-def system_monitor():
-    logger.info("System monitor thread started")
-    
-    # Track statistics
-    start_time = time.time()
-    last_stats_time = start_time
-    
-    while connection_active:
-        try:
-            current_time = time.time()
-            # Log stats every minute
-            if current_time - last_stats_time >= 60:
-                uptime = current_time - start_time
-                logger.info(f"System statistics - Uptime: {uptime:.1f}s, Reconnects: {reconnect_count}, Audio resets: {audio_reset_count}")
-                last_stats_time = current_time
-                
-                # Check if websocket is connected
-                if current_ws:
-                    logger.info(f"WebSocket connected: {current_ws.is_connected()}")
-                else:
-                    logger.warning("WebSocket not initialized")
-                
-                # Check audio streams
-                try:
-                    mic_active = mic_stream.is_active()
-                    speaker_active = speaker_stream.is_active()
-                    logger.info(f"Audio streams - Mic active: {mic_active}, Speaker active: {speaker_active}")
-                except:
-                    logger.warning("Could not check audio stream status")
-        except Exception as e:
-            logger.error(f"Error in system monitor: {e}")
-        
-        # Check every 15 seconds
-        time.sleep(15)
-
-# Initial connection
-logger.info("Establishing initial connection...")
-current_ws = setup_connection()
-
-# Update speaker sample rate after connection is established
-if current_ws and current_ws.is_connected() and hasattr(current_ws, 'server_sample_rate'):
-    logger.info(f"Adjusting to server sample rate: {current_ws.server_sample_rate}Hz")
-    speaker_stream.close()
-    speaker_stream = p.open(format=FORMAT,
-                           channels=CHANNELS,
-                           rate=current_ws.server_sample_rate,
-                           output=True)
-
-# Start threads
-logger.info("Starting worker threads...")
-
-mic_thread = threading.Thread(target=capture_microphone)
-mic_thread.daemon = True
-mic_thread.start()
-
-playback_thread = threading.Thread(target=play_audio)
-playback_thread.daemon = True
-playback_thread.start()
-
-monitor_thread = threading.Thread(target=connection_monitor)
-monitor_thread.daemon = True
-monitor_thread.start()
-
-stats_thread = threading.Thread(target=system_monitor)
-stats_thread.daemon = True
-stats_thread.start()
-
-# Initial instructions for the users 
-logger.info("All systems initialized")
-print("\n" + "="*50)
-print(f"You are now connected to {CHARACTER}!")
-print("HOW TO USE:")
-print("1. Speak clearly into your selected microphone")
-print("2. You'll see a visual audio level indicator when speaking")
-print("3. The system will automatically maintain the connection")
-print("4. Press Ctrl+C to exit")
-print("5. Log file is being created at: " + log_filename)
-print("="*50 + "\n")
-
-# Keep the main thread alive
-try:
-    print("Session active. Press Ctrl+C to exit")
-    while connection_active:
-        time.sleep(1)
-except KeyboardInterrupt:
+        name = p.get_device_info_by_index(index)['name'] if index is not None else "default"
+    except Exception:
+        name = "default"
+    device = f"{name} ({AUDIO_IO_MODE})"
+    tuned = load_tuned_chunk(CHUNK_CACHE_FILE, device)
+    if tuned:
+        logger.info(f"Starting from frame size {tuned}, tuned earlier for {device}")
+        session.chunk_tuner.resume(tuned)
+
+    def store(chunk):
+        threading.Thread(target=save_tuned_chunk, args=(CHUNK_CACHE_FILE, device, chunk), daemon=True).start()
+    session.chunk_tuner.on_settle = store
+
+
+# Initial instructions for the users
+def print_instructions():
+    logger.info("All systems initialized")
+    print("\n" + "="*50)
+    print(f"You are now connected to {CHARACTER}!")
+    print("HOW TO USE:")
+    print("1. Speak clearly into your selected microphone")
+    print("2. You'll see a visual audio level indicator when speaking")
+    print("3. The system will automatically maintain the connection")
+    print("4. Press Ctrl+C to exit")
+    print("5. Log file is being created at: " + log_filename)
+    print("="*50 + "\n")
+
+
+# Log the startup breakdown once the first microphone frame has been sent
+def report_startup(timer, session, connect_started):
+    first_frame_sent_at = session.wait_for_first_frame()
+    if session.first_connected_at is not None:
+        timer.add("connection", connect_started, session.first_connected_at)
+    if first_frame_sent_at is not None:
+        timer.mark("first frame sent", first_frame_sent_at)
+        logger.info(f"Startup - {timer.summary()}")
+
+
+# Turn Ctrl+C into a session stop so every asyncio task gets to finish its iteration
+def request_shutdown(session):
     logger.info("Shutdown initiated by user (Ctrl+C)")
     print("\nShutting down...")
-except Exception as e:
-    logger.critical(f"Critical error in main thread: {e}")
-    logger.debug(traceback.format_exc())
-finally:
-    # Clean up
-    connection_active = False
-    logger.info("Cleaning up resources...")
-    
-    if current_ws:
-        try:
-            current_ws.disconnect()
-            logger.info("WebSocket disconnected")
-        except Exception as e:
-            logger.error(f"Error disconnecting WebSocket: {e}")
-    
+    session.stop()
+
+
+# Headless: end the session once the reply to the last input file has had `linger`
+# seconds to arrive; called by the backend on the capture loop after the last file
+def stop_after_input(session, linger):
+    if session.active:
+        logger.info(f"All input streamed; stopping in {linger:.0f}s")
+        timer = threading.Timer(linger, session.stop)
+        timer.daemon = True
+        timer.start()
+
+
+# Write the stall profile; on SIGUSR1 from its own thread, as the signal may land on the event loop
+def dump_stall_profile(watchdog):
     try:
-        mic_stream.stop_stream()
-        mic_stream.close()
-        logger.info("Microphone stream closed")
+        watchdog.dump(STALL_PROFILE_FILE)
     except Exception as e:
-        logger.error(f"Error closing microphone stream: {e}")
-    
+        logger.error(f"Error writing stall profile: {e}")
+
+
+async def run_session_async(session):
+    import asyncio
     try:
-        speaker_stream.stop_stream()
-        speaker_stream.close()
-        logger.info("Speaker stream closed")
-    except Exception as e:
-        logger.error(f"Error closing speaker stream: {e}")
-    
+        asyncio.get_running_loop().add_signal_handler(signal.SIGINT, request_shutdown, session)
+    except (NotImplementedError, RuntimeError):
+        pass
+    await session.run_async()
+
+
+def main():
+    args = parse_args()
+    headless = bool(args.input)
+    timer = StartupTimer(STARTED)
+    async_logging = setup_logging()
+
+    logger.info("Starting Sesame Voice Client")
+    logger.info(f"Selected character: {CHARACTER}")
+
+    # The first token and the module imports run on startup threads while this thread
+    # opens PyAudio
+    token_service = TokenService(SesameTokenSource(token_file="token.json"))
+    startup = ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+    token_ready = startup.submit(timer.timed("token", start_token_service), token_service)
+    modules_ready = startup.submit(timer.timed("imports", load_modules))
+    startup.shutdown(wait=False)
+
+    p = None
+    if not headless:
+        with timer.phase("audio init"):
+            import pyaudio
+            p = pyaudio.PyAudio()
+
+    modules_ready.result()
+    import asyncio
+    from sesame_voice.audio_io import FileBackend, PyAudioBackend
+    from sesame_voice.metrics import MetricsRegistry, MetricsServer
+    from sesame_voice.session import ENGINES, Session, SessionConfig
+    from sesame_voice.tracing import export_trace
+    from sesame_voice.watchdog import Watchdog
+
+    if ENGINE not in ENGINES:
+        raise ValueError(f"Unknown engine: {ENGINE} (expected one of {ENGINES})")
+    logger.info(f"Session engine: {ENGINE}")
+
+    if headless:
+        # No audio devices: PyAudio isn't needed at all
+        backend = FileBackend(args.input, args.output, speed=args.speed or None)
+        logger.info(f"Headless mode: {len(args.input)} input file(s), output: {args.output or 'discarded'}, "
+                    f"speed: {args.speed or 'as fast as possible'}")
+    else:
+        backend = PyAudioBackend(p, AUDIO_IO_MODE)
+        logger.info(f"Audio I/O mode: {AUDIO_IO_MODE}")
+
+    record_path = None
+    if RECORD_CONVERSATION:
+        record_path = os.path.join("recordings", f"sesame_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{RECORD_FORMAT}")
+
+    config = SessionConfig(character=CHARACTER,
+                           chunk=CHUNK,
+                           chunk_autotune=CHUNK_AUTOTUNE,
+                           chunk_candidates=CHUNK_CANDIDATES,
+                           sample_width=SAMPLE_WIDTH,
+                           channels=CHANNELS,
+                           rate=RATE,
+                           speaker_rate=SPEAKER_RATE,
+                           engine=ENGINE,
+                           # Without a real-time playout clock there is no jitter to absorb
+                           jitter_buffer=JITTER_BUFFER_ENABLED and not (headless and args.speed != 1),
+                           jitter_min_delay_ms=JITTER_MIN_DELAY_MS,
+                           jitter_max_latency_ms=JITTER_MAX_LATENCY_MS,
+                           jitter_overflow_policy=JITTER_OVERFLOW_POLICY,
+                           jitter_frame_ms=JITTER_FRAME_MS,
+                           hot_standby=HOT_STANDBY,
+                           # File input waits for the uplink rather than losing audio
+                           uplink_policy="block" if headless else UPLINK_POLICY,
+                           uplink_queue_frames=UPLINK_QUEUE_FRAMES,
+                           uplink_coalesce_max=UPLINK_COALESCE_MAX,
+                           vad=VAD_ENABLED,
+                           vad_hangover_ms=VAD_HANGOVER_MS,
+                           vad_preroll_ms=VAD_PREROLL_MS,
+                           vad_keepalive_ms=VAD_KEEPALIVE_MS,
+                           mic_agc=MIC_AGC,
+                           mic_agc_target=MIC_AGC_TARGET,
+                           mic_noise_gate=MIC_NOISE_GATE,
+                           barge_in=BARGE_IN,
+                           barge_in_energy=BARGE_IN_ENERGY,
+                           barge_in_ms=BARGE_IN_MS,
+                           barge_in_resume_ms=BARGE_IN_RESUME_MS,
+                           suppress_bleed=SUPPRESS_BLEED,
+                           record_path=record_path,
+                           record_format=RECORD_FORMAT,
+                           tap_path=TAP_PATH,
+                           endpoint_url=SESAME_URL,
+                           interactive=not headless)
+    session = Session(token_service, backend, config)
+
+    # Connect while the microphone is chosen and the streams are opened; the connection
+    # waits for the first token on its own thread
+    connect_started = time.monotonic()
+    session.preconnect()
+    threading.Thread(target=report_startup, args=(timer, session, connect_started), daemon=True).start()
+
+    if not headless:
+        with timer.phase("microphone"):
+            session.input_device_index = choose_microphone(p, ask=args.select_mic)
+            if session.chunk_tuner and CHUNK_CACHE_FILE:
+                resume_tuned_chunk(session, p)
+    with timer.phase("streams"):
+        session.open_streams()
+    # Startup fails loudly without a token
+    try:
+        token_ready.result()
+    except Exception:
+        session.close()
+        if p:
+            p.terminate()
+        raise
+
+    metrics = MetricsRegistry()
+    metrics.add(session)
+    metrics_server = None
+    if METRICS_PORT:
+        try:
+            metrics_server = MetricsServer(metrics, port=METRICS_PORT)
+            metrics_server.start()
+        except OSError as e:
+            logger.warning(f"Could not serve metrics on port {METRICS_PORT}: {e}")
+            metrics_server = None
+
+    watchdog = None
+    if WATCHDOG:
+        watchdog = Watchdog()
+        watchdog.add(session)
+        watchdog.start()
+        if STALL_PROFILE_FILE and hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(
+                target=dump_stall_profile, args=(watchdog,), name="stall-dump", daemon=True).start())
+
+    if headless:
+        backend.on_input_finished = functools.partial(stop_after_input, session, args.linger)
+
+    # Keep the main thread alive
     try:
-        p.terminate()
-        logger.info("PyAudio terminated")
+        if ENGINE == "asyncio":
+            if not headless:
+                print_instructions()
+            print("Session active. Press Ctrl+C to exit")
+            asyncio.run(run_session_async(session))
+        else:
+            session.start_threads()
+            if not headless:
+                print_instructions()
+            print("Session active. Press Ctrl+C to exit")
+            while session.active:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Shutdown initiated by user (Ctrl+C)")
+        print("\nShutting down...")
     except Exception as e:
-        logger.error(f"Error terminating PyAudio: {e}")
-    
-    logger.info("All resources cleaned up. Session ended.")
-    print("Resources cleaned up. Check the log file for details.")
\ No newline at end of file
+        logger.critical(f"Critical error in main thread: {e}")
+        logger.debug(traceback.format_exc())
+    finally:
+        # Clean up
+        logger.info("Cleaning up resources...")
+        session.close()
+        token_service.stop()
+
+        if metrics_server:
+            metrics_server.stop()
+        if METRICS_FILE:
+            try:
+                metrics.dump(METRICS_FILE)
+            except Exception as e:
+                logger.error(f"Error writing metrics: {e}")
+        if TRACE_FILE:
+            try:
+                export_trace(TRACE_FILE, [session])
+                logger.info(f"Turn timeline written to {TRACE_FILE}")
+            except Exception as e:
+                logger.error(f"Error writing turn timeline: {e}")
+        if watchdog:
+            watchdog.stop()
+            logger.info(f"Watchdog - {watchdog.summary()}")
+            if STALL_PROFILE_FILE and any(heartbeat.samples for heartbeat in watchdog.heartbeats.values()):
+                dump_stall_profile(watchdog)
+
+        if headless:
+            try:
+                backend.close()
+            except Exception as e:
+                logger.error(f"Error closing output file: {e}")
+        else:
+            try:
+                p.terminate()
+                logger.info("PyAudio terminated")
+            except Exception as e:
+                logger.error(f"Error terminating PyAudio: {e}")
+
+        logger.info(f"Logging - {async_logging.summary()}")
+        logger.info("All resources cleaned up. Session ended.")
+        async_logging.stop()
+        print("Resources cleaned up. Check the log file for details.")
+
+
+if __name__ == "__main__":
+    main()
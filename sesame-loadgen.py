@@ -0,0 +1,60 @@
+# Load generator: how many concurrent conversations can this host sustain?
+#
+# Spreads simulated sessions over worker processes (see sesame_voice/loadgen.py) and
+# reports response latency percentiles, dropped frames and CPU per session for each
+# load level. Runs against local stand-in servers unless --url is given.
+#
+#   python sesame-loadgen.py --workers 4 --sessions 50 100 200 --duration 30
+#   python sesame-loadgen.py --sessions 100 --url ws://127.0.0.1:8765/ --output load.json
+
+import argparse
+import json
+import logging
+import os
+import time
+
+from sesame_voice.audio_io import IO_MODES
+from sesame_voice.loadgen import run_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the Sesame voice client")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[50],
+                        help="Total concurrent sessions; several values run one level after another")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per load level")
+    parser.add_argument("--engine", choices=("asyncio", "threads"), default="asyncio")
+    parser.add_argument("--io-mode", choices=IO_MODES, default="blocking", help="Audio I/O mode of the sessions")
+    parser.add_argument("--ramp", type=float, default=0.0, help="Spread worker starts over this many seconds")
+    parser.add_argument("--url", help="Server to use instead of local stand-in servers")
+    parser.add_argument("--server-processes", type=int, default=1, help="Local stand-in server processes")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Stand-in server think time")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="Stand-in server jitter")
+    parser.add_argument("--fixture", help="WAV or raw 16 kHz PCM file for the simulated microphones")
+    parser.add_argument("--output", help="Write the results of every level to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    levels = []
+    print(f"{'sessions':>8} {'cpu%/session':>13} {'latency p50':>12} {'p95':>8} {'p99':>8} "
+          f"{'turns':>6} {'dropped':>8} {'underruns':>10} {'reconnects':>11}")
+    for sessions in args.sessions:
+        result = run_load(args.workers, sessions, args.duration, engine=args.engine, url=args.url,
+                          io_mode=args.io_mode, fixture=args.fixture, ramp=args.ramp,
+                          server_processes=args.server_processes,
+                          server_options={"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms})
+        levels.append(result)
+        latency = result["response_latency_ms"] or {"p50": float("nan"), "p95": float("nan"), "p99": float("nan")}
+        print(f"{sessions:>8} {result['cpu_pct_per_session']:>13.2f} {latency['p50']:>10.0f}ms "
+              f"{latency['p95']:>6.0f}ms {latency['p99']:>6.0f}ms {result['turns']:>6} "
+              f"{result['dropped_frames']:>8} {result['jitter_underruns']:>10} {result['reconnects']:>11}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": vars(args),
+                       "levels": levels}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
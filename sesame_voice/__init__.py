@@ -0,0 +1 @@
+# Support modules for the Sesame voice chat client (sesame-agent.py)
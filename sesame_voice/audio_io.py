@@ -0,0 +1,603 @@
+# Audio backends and stream I/O modes
+#
+# PyAudioBackend opens device streams in one of two I/O modes. "blocking" opens plain
+# PyAudio streams and the worker threads call read()/write() on the device directly.
+# "callback" opens the streams with PortAudio callbacks that only copy into and out of
+# preallocated ring buffers; the worker threads then wait on the rings instead of the
+# device. VirtualBackend provides streams that are not backed by a device at all, and
+# FileBackend streams WAV or raw PCM files in and writes the received audio to a file,
+# for headless runs on machines without audio hardware.
+# Every kind of stream exposes the same read/write/close methods so the capture and
+# playback loops do not need to know where the audio comes from or goes to.
+
+import logging
+import threading
+import time
+import wave
+
+import numpy as np
+
+from sesame_voice.resample import StreamingResampler
+from sesame_voice.ring_buffer import RingBuffer
+
+logger = logging.getLogger("sesame_voice")
+
+IO_MODES = ("blocking", "callback")
+
+# Ring buffer size in device buffers
+RING_BUFFERS = 8
+# A speaker write returns once no more than this many device buffers are queued
+OUTPUT_QUEUE_BUFFERS = 2
+
+
+# Overrun/underrun counters shared by every stream opened for a session, so they
+# survive stream resets
+class AudioIOStats:
+    def __init__(self):
+        self.input_overruns = 0
+        self.output_underruns = 0
+        self.output_overruns = 0
+
+    def summary(self):
+        return (f"Input overruns: {self.input_overruns}, "
+                f"Output underruns: {self.output_underruns}, "
+                f"Output overruns: {self.output_overruns}")
+
+
+# PortAudio callback flags (paContinue, paInputOverflow): from the PyAudio object when
+# it carries them (standin.FakePyAudio does), otherwise from the pyaudio module
+def callback_flags(p):
+    if hasattr(p, "paContinue"):
+        return p.paContinue, p.paInputOverflow
+    import pyaudio
+    return pyaudio.paContinue, pyaudio.paInputOverflow
+
+
+class CallbackInputStream:
+    def __init__(self, p, format, channels, rate, frames_per_buffer,
+                 input_device_index=None, stats=None, read_timeout=1.0):
+        self._continue, self._overflow_flag = callback_flags(p)
+        self.frame_bytes = p.get_sample_size(format) * channels
+        self.frames_per_buffer = frames_per_buffer
+        self.stats = stats or AudioIOStats()
+        self.read_timeout = read_timeout
+        self._ring = RingBuffer(frames_per_buffer * self.frame_bytes * RING_BUFFERS)
+        self._ready = threading.Event()
+        # Time of the latest callback, for stall detection
+        self.last_callback = time.monotonic()
+        self._stream = p.open(format=format,
+                              channels=channels,
+                              rate=rate,
+                              input=True,
+                              input_device_index=input_device_index,
+                              frames_per_buffer=frames_per_buffer,
+                              stream_callback=self._callback)
+
+    # Runs on the PortAudio thread: copy into the ring and wake the reader
+    def _callback(self, in_data, frame_count, time_info, status_flags):
+        self.last_callback = time.monotonic()
+        written = self._ring.write(in_data)
+        if written < len(in_data) or status_flags & self._overflow_flag:
+            self.stats.input_overruns += 1
+        self._ready.set()
+        return (None, self._continue)
+
+    def _wait_for(self, needed):
+        deadline = time.monotonic() + self.read_timeout
+        while self._ring.available() < needed:
+            self._ready.clear()
+            if self._ring.available() >= needed:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise IOError("Timed out waiting for microphone data")
+            self._ready.wait(remaining)
+
+    def read(self, num_frames, exception_on_overflow=False):
+        needed = num_frames * self.frame_bytes
+        self._wait_for(needed)
+        return self._ring.read(needed)
+
+    # Copy num_frames straight from the ring into `out`; returns the number of bytes
+    def read_into(self, num_frames, out):
+        needed = num_frames * self.frame_bytes
+        self._wait_for(needed)
+        return self._ring.read_into(out if len(out) == needed else memoryview(out)[:needed])
+
+    def get_read_available(self):
+        return self._ring.available() // self.frame_bytes
+
+    def is_active(self):
+        return self._stream.is_active()
+
+    def start_stream(self):
+        self._stream.start_stream()
+
+    def stop_stream(self):
+        self._stream.stop_stream()
+        self._ready.set()
+
+    def close(self):
+        self._stream.close()
+        self._ready.set()
+
+
+class CallbackOutputStream:
+    def __init__(self, p, format, channels, rate, frames_per_buffer=1024,
+                 stats=None, write_timeout=1.0):
+        self._continue, _ = callback_flags(p)
+        self.frame_bytes = p.get_sample_size(format) * channels
+        self.frames_per_buffer = frames_per_buffer
+        self.stats = stats or AudioIOStats()
+        self.write_timeout = write_timeout
+        self._ring = RingBuffer(frames_per_buffer * self.frame_bytes * RING_BUFFERS)
+        self._queue_limit = frames_per_buffer * self.frame_bytes * OUTPUT_QUEUE_BUFFERS
+        self._out_buf = bytearray(frames_per_buffer * self.frame_bytes)
+        self._silence = memoryview(bytes(len(self._out_buf)))
+        self._space = threading.Event()
+        self._starved = True
+        # Set by flush(); the callback (the ring's consumer) empties the ring
+        self._flush = False
+        # Time of the latest callback, for stall detection
+        self.last_callback = time.monotonic()
+        self._stream = p.open(format=format,
+                              channels=channels,
+                              rate=rate,
+                              output=True,
+                              frames_per_buffer=frames_per_buffer,
+                              stream_callback=self._callback)
+
+    # Runs on the PortAudio thread: drain the ring, pad with silence when it runs dry
+    def _callback(self, in_data, frame_count, time_info, status_flags):
+        self.last_callback = time.monotonic()
+        needed = frame_count * self.frame_bytes
+        if needed != len(self._out_buf):
+            self._out_buf = bytearray(needed)
+            self._silence = memoryview(bytes(needed))
+
+        if self._flush:
+            self._flush = False
+            self._ring.clear()
+            self._starved = True
+        got = self._ring.read_into(self._out_buf)
+        if got < needed:
+            self._out_buf[got:] = self._silence[got:]
+            # Count the transition into starvation, not every idle callback
+            if got > 0 or not self._starved:
+                self.stats.output_underruns += 1
+            self._starved = True
+        else:
+            self._starved = False
+
+        self._space.set()
+        return (bytes(self._out_buf), self._continue)
+
+    # Queue audio for the callback. Like a blocking device write it returns once at most
+    # OUTPUT_QUEUE_BUFFERS buffers are left to play, so the playback loop keeps pace with
+    # the device instead of draining the jitter buffer into the ring (the rest of the
+    # ring only takes writes larger than that)
+    def write(self, frames, num_frames=None, exception_on_underflow=False):
+        data = memoryview(frames).cast('B')
+        deadline = time.monotonic() + self.write_timeout
+        while len(data):
+            written = self._ring.write(data)
+            data = data[written:]
+            if not len(data):
+                break
+            self._space.clear()
+            if self._ring.free():
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._stream.is_active():
+                self.stats.output_overruns += 1
+                logger.debug(f"Speaker ring full, dropped {len(data)} bytes")
+                return
+            self._space.wait(remaining)
+
+        while self._ring.available() > self._queue_limit:
+            self._space.clear()
+            if self._ring.available() <= self._queue_limit:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._stream.is_active():
+                break
+            self._space.wait(remaining)
+
+    # Drop queued audio at the next callback; returns the number of bytes dropped
+    def flush(self):
+        queued = self._ring.available()
+        self._flush = True
+        return queued
+
+    def get_write_available(self):
+        return self._ring.free() // self.frame_bytes
+
+    def is_active(self):
+        return self._stream.is_active()
+
+    def start_stream(self):
+        self._stream.start_stream()
+
+    def stop_stream(self):
+        self._stream.stop_stream()
+        self._space.set()
+
+    def close(self):
+        self._stream.close()
+        self._space.set()
+
+
+# Read num_frames from a microphone stream into `out` (a writable buffer), in place when
+# the stream supports it and otherwise by copying what read() returns (PyAudio's own
+# blocking streams); returns the number of bytes read
+def read_into(stream, num_frames, out):
+    reader = getattr(stream, "read_into", None)
+    if reader is not None:
+        return reader(num_frames, out)
+    data = stream.read(num_frames, exception_on_overflow=False)
+    out[:len(data)] = data
+    return len(data)
+
+
+# Drop audio a speaker stream has queued but not played yet, where the stream queues any
+# (callback streams); returns the number of bytes dropped
+def flush_output(stream):
+    flush = getattr(stream, "flush", None)
+    return flush() if flush is not None else 0
+
+
+# Open a microphone stream in the requested I/O mode
+def open_input_stream(p, mode, format, channels, rate, frames_per_buffer,
+                      input_device_index=None, stats=None):
+    if mode == "callback":
+        return CallbackInputStream(p, format, channels, rate, frames_per_buffer,
+                                   input_device_index=input_device_index, stats=stats)
+    if mode == "blocking":
+        return p.open(format=format,
+                      channels=channels,
+                      rate=rate,
+                      input=True,
+                      input_device_index=input_device_index,
+                      frames_per_buffer=frames_per_buffer)
+    raise ValueError(f"Unknown audio I/O mode: {mode} (expected one of {IO_MODES})")
+
+
+# Open a speaker stream in the requested I/O mode
+def open_output_stream(p, mode, format, channels, rate, frames_per_buffer=1024, stats=None):
+    if mode == "callback":
+        return CallbackOutputStream(p, format, channels, rate, frames_per_buffer, stats=stats)
+    if mode == "blocking":
+        return p.open(format=format,
+                      channels=channels,
+                      rate=rate,
+                      output=True)
+    raise ValueError(f"Unknown audio I/O mode: {mode} (expected one of {IO_MODES})")
+
+
+# Device audio through a (possibly shared) PyAudio instance
+class PyAudioBackend:
+    def __init__(self, p, mode="blocking"):
+        if mode not in IO_MODES:
+            raise ValueError(f"Unknown audio I/O mode: {mode} (expected one of {IO_MODES})")
+        self.p = p
+        self.mode = mode
+
+    def open_input(self, sample_width, channels, rate, frames_per_buffer,
+                   input_device_index=None, stats=None):
+        return open_input_stream(self.p, self.mode, self.p.get_format_from_width(sample_width),
+                                 channels, rate, frames_per_buffer,
+                                 input_device_index=input_device_index, stats=stats)
+
+    def open_output(self, sample_width, channels, rate, frames_per_buffer=1024, stats=None):
+        return open_output_stream(self.p, self.mode, self.p.get_format_from_width(sample_width),
+                                  channels, rate, frames_per_buffer, stats=stats)
+
+
+# Endless silence
+class SilenceSource:
+    def __init__(self):
+        self._zeros = memoryview(b"")
+
+    def read(self, nbytes):
+        return bytes(nbytes)
+
+    def read_into(self, out):
+        if len(self._zeros) < len(out):
+            self._zeros = memoryview(bytes(len(out)))
+        out[:] = self._zeros[:len(out)]
+        return len(out)
+
+
+# Loops over a fixed block of PCM audio, starting `offset` bytes in. A memoryview (e.g.
+# of shared memory) is read in place rather than copied.
+class LoopSource:
+    def __init__(self, pcm, offset=0):
+        if not len(pcm):
+            raise ValueError("LoopSource needs at least one byte of audio")
+        self._pcm = memoryview(pcm if isinstance(pcm, memoryview) else bytes(pcm)).cast('B')
+        self._pos = offset % len(self._pcm)
+
+    def read(self, nbytes):
+        out = bytearray()
+        while len(out) < nbytes:
+            piece = self._pcm[self._pos:self._pos + nbytes - len(out)]
+            out += piece
+            self._pos = (self._pos + len(piece)) % len(self._pcm)
+        return bytes(out)
+
+    def read_into(self, out):
+        filled = 0
+        while filled < len(out):
+            n = min(len(out) - filled, len(self._pcm) - self._pos)
+            out[filled:filled + n] = self._pcm[self._pos:self._pos + n]
+            filled += n
+            self._pos = (self._pos + n) % len(self._pcm)
+        return filled
+
+    # Let go of the audio, so a memoryview's buffer (e.g. shared memory) can be unmapped
+    def release(self):
+        self._pcm.release()
+
+
+# Input stream fed by a source object instead of a device. Reads are paced like a
+# device delivering audio at `speed` times the stream's sample rate (1.0 is real time);
+# speed=None delivers it as fast as it is read.
+class VirtualInputStream:
+    def __init__(self, source, sample_width, channels, rate, speed=1.0):
+        self.source = source
+        self.frame_bytes = sample_width * channels
+        self.rate = rate
+        self.speed = speed
+        self._next_time = None
+        self._active = True
+
+    # Wait until num_frames would have arrived from a device
+    def _pace(self, num_frames):
+        if not self._active:
+            raise IOError("Stream closed")
+        # A source that has run out (see FileSource) only has silence left, which is
+        # delivered in real time while the session waits for the reply
+        speed = 1.0 if getattr(self.source, "finished", False) else self.speed
+        if speed:
+            now = time.monotonic()
+            if self._next_time is None or self._next_time < now - 1.0:
+                self._next_time = now
+            self._next_time += num_frames / (self.rate * speed)
+            if self._next_time > now:
+                time.sleep(self._next_time - now)
+
+    def read(self, num_frames, exception_on_overflow=False):
+        self._pace(num_frames)
+        return self.source.read(num_frames * self.frame_bytes)
+
+    # read() into `out`, in place when the source supports it
+    def read_into(self, num_frames, out):
+        nbytes = num_frames * self.frame_bytes
+        if len(out) != nbytes:
+            out = memoryview(out)[:nbytes]
+        if hasattr(self.source, "read_into"):
+            self._pace(num_frames)
+            return self.source.read_into(out)
+        data = self.read(num_frames)
+        out[:len(data)] = data
+        return len(data)
+
+    def get_read_available(self):
+        return 0
+
+    def is_active(self):
+        return self._active
+
+    def start_stream(self):
+        self._active = True
+
+    def stop_stream(self):
+        self._active = False
+
+    def close(self):
+        self._active = False
+
+
+# Output stream that hands audio to a sink callable (or discards it) instead of a
+# device. Writes take as long as the audio would take to play at `speed` (1.0 is real
+# time); speed=None returns at once.
+class VirtualOutputStream:
+    def __init__(self, sample_width, channels, rate, sink=None, speed=1.0):
+        self.sink = sink
+        self.frame_bytes = sample_width * channels
+        self.rate = rate
+        self.speed = speed
+        self.bytes_written = 0
+        self._busy_until = 0.0
+        self._active = True
+
+    def write(self, frames, num_frames=None, exception_on_underflow=False):
+        if not self._active:
+            raise IOError("Stream closed")
+        if self.sink:
+            self.sink(frames)
+        self.bytes_written += len(frames)
+        if self.speed:
+            now = time.monotonic()
+            self._busy_until = max(self._busy_until, now) + len(frames) / (self.frame_bytes * self.rate * self.speed)
+            if self._busy_until > now:
+                time.sleep(self._busy_until - now)
+
+    def get_write_available(self):
+        return 0
+
+    def is_active(self):
+        return self._active
+
+    def start_stream(self):
+        self._active = True
+
+    def stop_stream(self):
+        self._active = False
+
+    def close(self):
+        self._active = False
+
+
+# Audio that never touches a device. source_factory() returns a new source for each
+# input stream (silence by default); sink_factory() returns the sink for each output
+# stream (audio is discarded by default).
+class VirtualBackend:
+    def __init__(self, source_factory=SilenceSource, sink_factory=None, speed=1.0):
+        self.source_factory = source_factory
+        self.sink_factory = sink_factory
+        self.speed = speed
+
+    def open_input(self, sample_width, channels, rate, frames_per_buffer,
+                   input_device_index=None, stats=None):
+        return VirtualInputStream(self.source_factory(), sample_width, channels, rate,
+                                  speed=self.speed)
+
+    def open_output(self, sample_width, channels, rate, frames_per_buffer=1024, stats=None):
+        sink = self.sink_factory() if self.sink_factory else None
+        return VirtualOutputStream(sample_width, channels, rate, sink=sink, speed=self.speed)
+
+
+# Plays WAV or raw PCM files back to back, then silence. Audio is converted to the
+# format the stream is opened with; raw files are taken to be in that format already.
+class FileSource:
+    # on_finished() is called once, on the reading thread, after the last file
+    def __init__(self, paths, sample_width, channels, rate, read_frames=4096, on_finished=None):
+        if sample_width != 2:
+            raise ValueError("File input supports 16-bit audio only")
+        self.paths = list(paths)
+        self.channels = channels
+        self.rate = rate
+        self.read_frames = read_frames
+        self.on_finished = on_finished
+        self.finished = False
+        self.files_played = 0
+        self._pending = bytearray()
+        self._file = None
+        self._read = None
+        self._file_channels = channels
+        self._resampler = None
+        self._open_next()
+
+    def _open_next(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+            self.files_played += 1
+        if not self.paths:
+            self.finished = True
+            if self.on_finished:
+                self.on_finished()
+            return
+
+        path = self.paths.pop(0)
+        if path.lower().endswith(".wav"):
+            reader = wave.open(path, "rb")
+            if reader.getsampwidth() != 2:
+                reader.close()
+                raise ValueError(f"{path}: only 16-bit WAV files are supported")
+            file_rate, file_channels = reader.getframerate(), reader.getnchannels()
+            self._read = reader.readframes
+        else:
+            reader = open(path, "rb")
+            file_rate, file_channels = self.rate, self.channels
+            frame_bytes = 2 * file_channels
+            self._read = lambda frames: reader.read(frames * frame_bytes)
+        if file_channels != self.channels and 1 not in (file_channels, self.channels):
+            reader.close()
+            raise ValueError(f"{path}: can't convert {file_channels} channels to {self.channels}")
+
+        self._file = reader
+        self._file_channels = file_channels
+        self._resampler = StreamingResampler(file_rate, self.rate, self.channels)
+        logger.info(f"Streaming {path} ({file_rate}Hz, {file_channels} channel(s))")
+
+    # Mix down or duplicate channels, then resample
+    def _convert(self, data):
+        if self._file_channels != self.channels:
+            samples = np.frombuffer(data, dtype=np.int16).reshape(-1, self._file_channels)
+            if self.channels == 1:
+                samples = samples.mean(axis=1).astype(np.int16)
+            else:
+                samples = np.repeat(samples, self.channels, axis=1)
+            data = samples.tobytes()
+        return self._resampler.process(data)
+
+    def read(self, nbytes):
+        while len(self._pending) < nbytes and not self.finished:
+            data = self._read(self.read_frames)
+            if not data:
+                self._open_next()
+                continue
+            self._pending += self._convert(data)
+
+        out = bytes(self._pending[:nbytes])
+        del self._pending[:nbytes]
+        if len(out) < nbytes:
+            out += bytes(nbytes - len(out))
+        return out
+
+
+# Writes received audio to a WAV file (by extension) or a raw PCM file
+class FileSink:
+    def __init__(self, path, sample_width, channels, rate):
+        self.path = path
+        self.bytes_written = 0
+        if path.lower().endswith(".wav"):
+            self._file = wave.open(path, "wb")
+            self._file.setsampwidth(sample_width)
+            self._file.setnchannels(channels)
+            self._file.setframerate(rate)
+            # The header sizes are filled in on close
+            self._write = self._file.writeframesraw
+        else:
+            self._file = open(path, "wb")
+            self._write = self._file.write
+
+    def __call__(self, frames):
+        self._write(frames)
+        self.bytes_written += len(frames)
+
+    def close(self):
+        self._file.close()
+
+
+# Headless audio: the microphone streams `input_paths` one after another and the
+# speaker writes to `output_path` (or nowhere), paced at `speed` times real time
+# (None: as fast as possible). The source and the sink outlive stream resets, so a
+# reopened stream carries on where the old one stopped. on_input_finished() is called
+# on the capture loop once every input file has been streamed.
+class FileBackend:
+    def __init__(self, input_paths, output_path=None, speed=1.0, on_input_finished=None):
+        self.input_paths = list(input_paths)
+        self.output_path = output_path
+        self.speed = speed
+        self.on_input_finished = on_input_finished
+        self.source = None
+        self.sink = None
+
+    def open_input(self, sample_width, channels, rate, frames_per_buffer,
+                   input_device_index=None, stats=None):
+        if self.source is None:
+            self.source = FileSource(self.input_paths, sample_width, channels, rate,
+                                     on_finished=self._input_finished)
+        return VirtualInputStream(self.source, sample_width, channels, rate, speed=self.speed)
+
+    def open_output(self, sample_width, channels, rate, frames_per_buffer=1024, stats=None):
+        if self.output_path and self.sink is None:
+            self.sink = FileSink(self.output_path, sample_width, channels, rate)
+        return VirtualOutputStream(sample_width, channels, rate, sink=self.sink, speed=self.speed)
+
+    def _input_finished(self):
+        if self.on_input_finished:
+            self.on_input_finished()
+
+    # True once every input file has been streamed
+    def input_finished(self):
+        return self.source is not None and self.source.finished
+
+    # Finish the output file
+    def close(self):
+        if self.sink:
+            self.sink.close()
+            logger.info(f"Received audio written to {self.output_path}")
@@ -0,0 +1,171 @@
+# Frame size (CHUNK) auto-tuning
+#
+# A frame of CHUNK samples is both the microphone's frames_per_buffer and one websocket
+# message, so it sets the capture latency and the send rate. ChunkTuner starts a
+# session at a small frame size and watches, per window of `window` seconds:
+#
+#   input overflows   - the device had audio to deliver and nowhere to put it
+#   late frames       - capture loop iterations taking more than late_factor frames
+#   uplink backlog    - frames still waiting for the network a frame later (or
+#                       dropped) because sends can't keep up with one message per frame
+#   playback underruns - the jitter buffer running dry in the middle of a reply
+#
+# A window with any of these moves up to the next candidate size; after settle_windows
+# clean windows in a row the size is settled and reported through on_settle (the client
+# stores it per device, see load_tuned_chunk). A settled size still moves up if glitches
+# come back later, but never down: the smallest clean size is the one it started from or
+# one it has already proven.
+#
+# The tuner runs on the capture loop, between frames, so the session can switch the
+# microphone stream over without racing the loop that reads it (see Session.apply_chunk).
+
+import json
+import logging
+import time
+
+logger = logging.getLogger("sesame_voice")
+
+# Frame sizes tried, in samples (16/32/64/128 ms at 16 kHz)
+CHUNK_CANDIDATES = (256, 512, 1024, 2048)
+
+
+class ChunkTuner:
+    def __init__(self, session, candidates=CHUNK_CANDIDATES, start=None, window=5.0, settle_windows=3,
+                 late_factor=2.0, max_late_ratio=0.02, max_backlog=2):
+        if not candidates:
+            raise ValueError("At least one candidate frame size is needed")
+        self.session = session
+        self.log = session.log
+        self.candidates = tuple(sorted(candidates))
+        self.window = window
+        self.settle_windows = settle_windows
+        self.late_factor = late_factor
+        self.max_late_ratio = max_late_ratio
+        self.max_backlog = max_backlog
+        # Called with the frame size once it has settled
+        self.on_settle = None
+
+        self.index = self._index(start or self.candidates[0])
+        self.settled = False
+        self.clean_windows = 0
+        self.changes = 0
+        self.new_window()
+
+    # The smallest candidate at least as large as chunk (or the largest one)
+    def _index(self, chunk):
+        for i, candidate in enumerate(self.candidates):
+            if candidate >= chunk:
+                return i
+        return len(self.candidates) - 1
+
+    @property
+    def chunk(self):
+        return self.candidates[self.index]
+
+    # Start from a size that worked before (e.g. stored for this device)
+    def resume(self, chunk):
+        self.index = self._index(chunk)
+        self.session.apply_chunk(self.chunk)
+        self.new_window()
+
+    # Start a measurement window from the session's current counters
+    def new_window(self, now=None):
+        session = self.session
+        self._window_start = now or time.monotonic()
+        self._last_frame = None
+        self.frames = 0
+        self.late = 0
+        self.max_depth = 0
+        self._overruns = session.io_stats.input_overruns
+        self._dropped = session.uplink.dropped_frames
+        self._underruns = session.jitter_buffer.underruns if session.jitter_buffer else 0
+
+    # Capture loop: a frame was read at `now` (call before queueing it); returns a new
+    # frame size to switch to, or None
+    def frame(self, now):
+        last = self._last_frame
+        self._last_frame = now
+        self.frames += 1
+        if last is not None and now - last > self.late_factor * self.chunk / self.session.config.mic_rate:
+            self.late += 1
+        depth = self.session.uplink.depth()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+        if now - self._window_start < self.window:
+            return None
+        # Backlog and playback say nothing while the connection is down
+        if not self.session.is_connected():
+            self.new_window(now)
+            return None
+        return self._evaluate(now)
+
+    def _evaluate(self, now):
+        session = self.session
+        problems = []
+        overruns = session.io_stats.input_overruns - self._overruns
+        if overruns:
+            problems.append(f"{overruns} input overflows")
+        late_ratio = self.late / self.frames if self.frames else 0.0
+        if late_ratio > self.max_late_ratio:
+            problems.append(f"{late_ratio:.0%} of frames late")
+        dropped = session.uplink.dropped_frames - self._dropped
+        if dropped or self.max_depth > self.max_backlog:
+            problems.append(f"uplink backlog of {self.max_depth} frames ({dropped} dropped)")
+        if session.jitter_buffer:
+            underruns = session.jitter_buffer.underruns - self._underruns
+            if underruns:
+                problems.append(f"{underruns} playback underruns")
+        self.new_window(now)
+
+        if problems:
+            self.clean_windows = 0
+            if self.index + 1 == len(self.candidates):
+                self.log.warning(f"Frame size autotune: {', '.join(problems)} at the largest "
+                                 f"frame size ({self.chunk} samples)")
+                return None
+            old = self.chunk
+            self.index += 1
+            self.settled = False
+            self.changes += 1
+            self.log.info(f"Frame size autotune: {', '.join(problems)} at {old} samples, "
+                          f"switching to {self.chunk}")
+            return self.chunk
+
+        self.clean_windows += 1
+        if not self.settled and self.clean_windows >= self.settle_windows:
+            self.settled = True
+            ms = 1000 * self.chunk / session.config.mic_rate
+            self.log.info(f"Frame size autotune: settled on {self.chunk} samples ({ms:.0f}ms)")
+            if self.on_settle:
+                try:
+                    self.on_settle(self.chunk)
+                except Exception as e:
+                    self.log.warning(f"Could not store the tuned frame size: {e}")
+        return None
+
+    def summary(self):
+        state = "settled" if self.settled else f"measuring ({self.clean_windows} clean windows)"
+        return f"Frame size: {self.chunk} samples, {state}, Changes: {self.changes}"
+
+
+# Frame size stored for a device by save_tuned_chunk, or None
+def load_tuned_chunk(path, device):
+    try:
+        with open(path) as f:
+            return int(json.load(f)[device])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+# Remember the frame size that settled for a device, next to those of other devices
+def save_tuned_chunk(path, device, chunk):
+    try:
+        with open(path) as f:
+            tuned = json.load(f)
+    except (OSError, ValueError):
+        tuned = {}
+    tuned[device] = chunk
+    with open(path, "w") as f:
+        json.dump(tuned, f, indent=2)
+    logger.info(f"Stored frame size {chunk} for {device} in {path}")
@@ -0,0 +1,126 @@
+# Barge-in: stop the character as soon as the user talks over it
+#
+# BargeIn watches the microphone on the capture side. While character audio is being
+# played (or was within the last BLEED_TAIL_MS, for the echo tail), frames louder
+# than `energy` count towards an interruption. Once they have gone on for min_ms, a
+# flush is requested. The threshold sits above SPEECH_ENERGY because speaker bleed
+# reaches the microphone quieter than a voice right in front of it.
+#
+# The playback side checks for a request on every step, so within one playout frame it
+# drops everything queued locally: the jitter buffer, the websocket's receive queue
+# and the speaker's ring. It then discards the rest of the interrupted reply until
+# nothing has arrived for resume_ms, and the next reply plays normally. The
+# interrupt-to-silence latency runs from the first loud frame to the flush.
+#
+# With suppress_bleed, microphone frames captured while the character plays that are
+# not loud enough to be the user are silenced (in place) before they are sent, so the
+# server doesn't hear its own voice come back.
+
+import threading
+import time
+
+# Speaker audio keeps reaching the microphone this long after the last frame was played
+BLEED_TAIL_MS = 250
+
+
+class BargeIn:
+    # frame_ms: duration of one microphone frame
+    def __init__(self, frame_ms, energy=1500, min_ms=100, resume_ms=300, suppress_bleed=False,
+                 metrics=None):
+        self.frame = frame_ms / 1000
+        self.energy = energy
+        self.min_duration = min_ms / 1000
+        self.resume = resume_ms / 1000
+        self.suppress_bleed = suppress_bleed
+        self.metrics = metrics
+        self._lock = threading.Lock()
+
+        # Capture side
+        self._loud_since = None
+        # Set by the capture side, cleared by the playback side
+        self.pending = False
+        self._requested_at = None
+
+        # Playback side
+        self._last_played = None
+        self.discarding = False
+        self._last_discarded = None
+
+        # Metrics
+        self.interruptions = 0
+        self.flushed_bytes = 0
+        self.discarded_bytes = 0
+        self.suppressed_frames = 0
+        self.latency_total = 0.0
+
+    # Capture side: character audio is (still) audible
+    def playing(self, now):
+        last = self._last_played
+        return last is not None and now - last < BLEED_TAIL_MS / 1000
+
+    # Capture side: one microphone frame of `energy` captured at `now`; returns True if
+    # the frame should be silenced instead of sent
+    def mic(self, energy, now=None):
+        now = now or time.monotonic()
+        if self.discarding or not self.playing(now):
+            self._loud_since = None
+            return False
+
+        if energy > self.energy:
+            if self._loud_since is None:
+                # The frame's audio started one frame before it was read
+                self._loud_since = now - self.frame
+            if not self.pending and now - self._loud_since >= self.min_duration:
+                with self._lock:
+                    self._requested_at = self._loud_since
+                    self.pending = True
+            return False
+
+        self._loud_since = None
+        if self.suppress_bleed:
+            self.suppressed_frames += 1
+            return True
+        return False
+
+    # Playback side: a frame went to the speaker
+    def played(self, now=None):
+        self._last_played = now or time.monotonic()
+
+    # Playback side: take a pending request after flushing; returns when the user started
+    # talking over the character
+    def flushed(self, nbytes, now=None):
+        now = now or time.monotonic()
+        with self._lock:
+            started = self._requested_at
+            self.pending = False
+        self.interruptions += 1
+        self.flushed_bytes += nbytes
+        self.latency_total += now - started
+        if self.metrics:
+            self.metrics.barge_in_latency.observe(now - started)
+        self._last_played = None
+        self._loud_since = None
+        self.discarding = True
+        self._last_discarded = now
+        return started
+
+    # Playback side: audio of the interrupted reply arrived and was dropped
+    def discarded(self, nbytes, now=None):
+        self.discarded_bytes += nbytes
+        self._last_discarded = now or time.monotonic()
+
+    # Playback side: nothing arrived; returns True when the interrupted reply is over
+    def idle(self, now=None):
+        if not self.discarding:
+            return False
+        now = now or time.monotonic()
+        if now - self._last_discarded < self.resume:
+            return False
+        self.discarding = False
+        return True
+
+    def summary(self):
+        average = self.latency_total / self.interruptions * 1000 if self.interruptions else 0.0
+        return (f"Interruptions: {self.interruptions}, Interrupt to silence: {average:.0f}ms average, "
+                f"Flushed: {self.flushed_bytes} bytes, Discarded: {self.discarded_bytes} bytes, "
+                f"Suppressed frames: {self.suppressed_frames}")
@@ -0,0 +1,135 @@
+# Signal analysis helpers for microphone frames
+
+import logging
+import math
+
+import numpy as np
+
+logger = logging.getLogger("sesame_voice")
+
+
+# Function to calculate audio energy - with proper error handling
+def calculate_energy(audio_data):
+    try:
+        audio_array = np.frombuffer(audio_data, dtype=np.int16)
+        # Check if array is empty or all zeros
+        if len(audio_array) == 0 or np.all(audio_array == 0):
+            return 0.0
+
+        # Calculate energy safely
+        return float(np.sqrt(np.mean(np.square(audio_array.astype(float)))))
+    except Exception as e:
+        logger.warning(f"Error calculating audio energy: {e}")
+        return 0.0
+
+
+# Streaming front-end for microphone frames
+#
+# FrameAnalyzer measures each frame (RMS, peak, clipped samples and a smoothed level for
+# the meter) into preallocated buffers: the samples are converted once into a float32
+# work buffer, and every reduction runs over that buffer and writes into a preallocated
+# 0-d array rather than a new numpy scalar. Optional AGC and noise gate run on the same
+# buffer and write the result back into the frame when it is writable (a pooled frame,
+# see frame_pool), so the audio is never copied.
+#
+# What is still allocated per frame: the Python floats and small ints of the
+# measurements, an array header when the frame is passed as bytes, the clipped-sample
+# count on frames that clip, and a new bytes object when a read-only frame is changed by
+# AGC or the gate (benchmarks/bench_dsp.py reports the peak).
+class FrameAnalyzer:
+    FULL_SCALE = 32767
+
+    def __init__(self, frame_samples, smoothing=0.33, agc=False, agc_target=3000,
+                 agc_max_gain=8.0, agc_speed=0.1, noise_gate=0, gate_floor=0.1):
+        self.smoothing = smoothing
+        self.agc = agc
+        self.agc_target = agc_target
+        self.agc_max_gain = agc_max_gain
+        self.agc_speed = agc_speed
+        # Frames with an RMS below noise_gate are attenuated to gate_floor (0 disables)
+        self.noise_gate = noise_gate
+        self.gate_floor = gate_floor
+        self._allocate(frame_samples)
+
+        # Measurements of the last frame (before AGC and gate)
+        self.rms = 0.0
+        self.peak = 0
+        self.clipped = 0
+        # Exponentially smoothed RMS
+        self.level = 0.0
+        self.gain = 1.0
+
+        # Metrics
+        self.frames = 0
+        self.clipped_frames = 0
+        self.gated_frames = 0
+
+    def _allocate(self, frame_samples):
+        self.frame_samples = frame_samples
+        self._work = np.empty(frame_samples, dtype=np.float32)
+        self._out = np.empty(frame_samples, dtype=np.int16)
+        self._sum = np.zeros((), dtype=np.float32)
+        self._max_at = np.zeros((), dtype=np.intp)
+        self._min_at = np.zeros((), dtype=np.intp)
+        self._gain = np.ones((), dtype=np.float32)
+        self._high = np.full((), self.FULL_SCALE, dtype=np.float32)
+        self._low = np.full((), -self.FULL_SCALE, dtype=np.float32)
+
+    # Measure a frame of int16 samples (bytes-like or an int16 array) and apply AGC and
+    # the noise gate; returns the frame to send (the input itself, changed in place if
+    # writable, unless it is read-only and the audio had to change)
+    def process(self, data):
+        samples = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=np.int16)
+        n = len(samples)
+        if n == 0:
+            self.rms = 0.0
+            return data
+        # Resampled frames can vary by a sample; only grow the buffers, never shrink them
+        if n > self.frame_samples:
+            self._allocate(n)
+        work = self._work if n == len(self._work) else self._work[:n]
+
+        np.copyto(work, samples)
+        np.dot(work, work, out=self._sum)
+        self.rms = math.sqrt(self._sum.item() / n)
+        # argmax/argmin rather than max/min: no reduction buffers allocated per frame. They
+        # run over the work buffer, which holds the same integer values: on a read-only
+        # int16 view (a bytes frame) numpy copies the whole frame first
+        work.argmax(out=self._max_at)
+        work.argmin(out=self._min_at)
+        self.peak = int(max(work.item(self._max_at.item()), -work.item(self._min_at.item())))
+        self.clipped = 0
+        if self.peak >= self.FULL_SCALE:
+            self.clipped = int(np.count_nonzero(samples >= self.FULL_SCALE) +
+                               np.count_nonzero(samples <= -self.FULL_SCALE))
+            self.clipped_frames += 1
+        self.level += self.smoothing * (self.rms - self.level)
+        self.frames += 1
+
+        gain = 1.0
+        if self.agc and self.level > 0:
+            # Move the gain towards the one that brings the smoothed level to the target
+            wanted = min(self.agc_target / self.level, self.agc_max_gain)
+            self.gain += self.agc_speed * (wanted - self.gain)
+            gain = self.gain
+        if self.noise_gate and self.rms < self.noise_gate:
+            gain *= self.gate_floor
+            self.gated_frames += 1
+
+        if gain == 1.0:
+            return data
+        self._gain.fill(gain)
+        np.multiply(work, self._gain, out=work)
+        # minimum/maximum with out= clip without np.clip's per-call temporaries
+        np.minimum(work, self._high, out=work)
+        np.maximum(work, self._low, out=work)
+        if samples.flags.writeable:
+            np.copyto(samples, work, casting="unsafe")
+            return data
+        out = self._out[:n]
+        np.copyto(out, work, casting="unsafe")
+        return out.tobytes()
+
+    def summary(self):
+        return (f"Level: {self.level:.0f}, Gain: {self.gain:.2f}, Clipped frames: {self.clipped_frames}, "
+                f"Gated frames: {self.gated_frames}")
@@ -0,0 +1,119 @@
+# Preallocated microphone frames shared along the capture pipeline
+#
+# FramePool owns a fixed set of frame buffers that the capture loop fills in place (see
+# audio_io.read_into). The Frame object itself is handed on to the analyzer, the voice
+# activity gate, the uplink queue, the recorder and the websocket. Nothing copies the
+# audio: a stage that keeps a frame past the call it was given in owns a reference and
+# releases it when done, and the frame goes back to the pool with its last reference.
+# Every frame keeps a memoryview and an int16 array over its buffer, so passing a full
+# frame along creates no new objects.
+#
+# If every frame is in use (consumers holding on to more frames than the pool was sized
+# for), the pool grows by one frame and counts it rather than stalling capture.
+#
+# get/retain/release run for every frame and take the lock with acquire()/release():
+# entering a `with` block allocates a little on every call.
+
+import threading
+
+import numpy as np
+
+
+class Frame:
+    __slots__ = ("pool", "buffer", "view", "samples", "size", "refs", "silent", "captured")
+
+    def __init__(self, pool, nbytes):
+        self.pool = pool
+        self.buffer = bytearray(nbytes)
+        self.view = memoryview(self.buffer)
+        self.samples = np.frombuffer(self.buffer, dtype=np.int16)
+        self.size = nbytes  # Bytes of audio in the buffer
+        self.refs = 0
+        # Set by the uplink queue while the frame waits there
+        self.silent = False
+        self.captured = 0.0
+
+    def __len__(self):
+        return self.size
+
+    # The audio as a memoryview (bytes-like, e.g. for the websocket and the recorder)
+    def data(self):
+        return self.view if self.size == len(self.buffer) else self.view[:self.size]
+
+    # The audio as a writable int16 array over the buffer
+    def pcm(self):
+        return self.samples if self.size == len(self.buffer) else self.samples[:self.size // 2]
+
+    # Copy audio in, e.g. a resampler's output; anything past the buffer is cut off
+    def fill(self, data):
+        n = min(len(data), len(self.buffer))
+        self.view[:n] = data[:n] if n < len(data) else data
+        self.size = n
+
+    def retain(self):
+        self.pool.retain(self)
+
+    def release(self):
+        self.pool.release(self)
+
+
+class FramePool:
+    def __init__(self, frame_bytes, count):
+        if frame_bytes <= 0 or frame_bytes % 2:
+            raise ValueError("Frames must hold a whole number of 16-bit samples")
+        self.frame_bytes = frame_bytes
+        self._lock = threading.Lock()
+        self._frames = [Frame(self, frame_bytes) for _ in range(count)]
+        self._free = list(self._frames)
+
+        # Metrics
+        self.gets = 0
+        self.grown = 0
+        self.max_in_use = 0
+
+    # A free frame holding one reference (the caller's), sized to the full buffer
+    def get(self):
+        self._lock.acquire()
+        try:
+            if self._free:
+                frame = self._free.pop()
+            else:
+                frame = Frame(self, self.frame_bytes)
+                self._frames.append(frame)
+                self.grown += 1
+            frame.refs = 1
+            frame.size = self.frame_bytes
+            self.gets += 1
+            in_use = len(self._frames) - len(self._free)
+            if in_use > self.max_in_use:
+                self.max_in_use = in_use
+            return frame
+        finally:
+            self._lock.release()
+
+    def retain(self, frame):
+        self._lock.acquire()
+        try:
+            if frame.refs <= 0:
+                raise RuntimeError("Frame retained after it went back to the pool")
+            frame.refs += 1
+        finally:
+            self._lock.release()
+
+    def release(self, frame):
+        self._lock.acquire()
+        try:
+            if frame.refs <= 0:
+                raise RuntimeError("Frame released more often than it was retained")
+            frame.refs -= 1
+            if frame.refs == 0:
+                self._free.append(frame)
+        finally:
+            self._lock.release()
+
+    def in_use(self):
+        return len(self._frames) - len(self._free)
+
+    def summary(self):
+        return (f"Frames: {len(self._frames)} x {self.frame_bytes} bytes, In use: {self.in_use()} "
+                f"(max {self.max_in_use}), Grown: {self.grown}")
@@ -0,0 +1,126 @@
+# Audio stream health monitoring
+#
+# StreamHealthMonitor watches the microphone and speaker streams separately and says
+# when one of them needs to be reopened. Signals, counted over a sliding window:
+#
+#   xruns    - input overflows / output underruns reported by the stream callbacks
+#   errors   - read() or write() raising
+#   stalls   - a read() or write() call taking longer than stall_ms, or (callback
+#              streams) no callback for stall_ms while the stream should be running
+#
+# A stream is only reset when one of these crosses its threshold, and never twice
+# within the cooldown, so a flaky device can't put the session into a reset loop.
+
+import time
+
+
+class StreamHealth:
+    def __init__(self, name):
+        self.name = name
+
+        # Totals
+        self.calls = 0
+        self.errors = 0
+        self.stalls = 0
+        self.resets = 0
+        self.max_latency_ms = 0.0
+        self.last_reason = None
+
+        # Current window
+        self.window_start = time.monotonic()
+        self.window_errors = 0
+        self.window_stalls = 0
+        self.xrun_baseline = 0
+        self.last_reset = 0.0
+
+    def new_window(self, now, xruns):
+        self.window_start = now
+        self.window_errors = 0
+        self.window_stalls = 0
+        self.xrun_baseline = xruns
+
+    def summary(self):
+        return (f"resets {self.resets}, errors {self.errors}, stalls {self.stalls}, "
+                f"max call {self.max_latency_ms:.0f}ms"
+                + (f", last reset: {self.last_reason}" if self.last_reason else ""))
+
+
+class StreamHealthMonitor:
+    def __init__(self, io_stats, window=5.0, max_xruns=5, max_errors=3, max_stalls=2,
+                 stall_ms=500, cooldown=10.0):
+        self.io_stats = io_stats
+        self.window = window
+        self.max_xruns = max_xruns
+        self.max_errors = max_errors
+        self.max_stalls = max_stalls
+        self.stall = stall_ms / 1000
+        self.cooldown = cooldown
+        self.input = StreamHealth("input")
+        self.output = StreamHealth("output")
+
+    # Record one read()/write() call that took `elapsed` seconds
+    def record(self, health, elapsed, error=False):
+        health.calls += 1
+        latency_ms = elapsed * 1000
+        if latency_ms > health.max_latency_ms:
+            health.max_latency_ms = latency_ms
+        if error:
+            health.errors += 1
+            health.window_errors += 1
+        if elapsed > self.stall:
+            health.stalls += 1
+            health.window_stalls += 1
+
+    def record_read(self, elapsed, error=False):
+        self.record(self.input, elapsed, error)
+
+    def record_write(self, elapsed, error=False):
+        self.record(self.output, elapsed, error)
+
+    # Why the microphone stream should be reset, or None if it looks healthy
+    def input_reset_reason(self, stream):
+        return self._check(self.input, stream, self.io_stats.input_overruns, "input overflows")
+
+    # Why the speaker stream should be reset, or None if it looks healthy
+    def output_reset_reason(self, stream):
+        return self._check(self.output, stream, self.io_stats.output_underruns, "output underruns")
+
+    def _check(self, health, stream, xruns, xrun_name):
+        now = time.monotonic()
+        reason = None
+        window_xruns = xruns - health.xrun_baseline
+        if window_xruns >= self.max_xruns:
+            reason = f"{window_xruns} {xrun_name} in {now - health.window_start:.1f}s"
+        elif health.window_errors >= self.max_errors:
+            reason = f"{health.window_errors} {health.name} errors in {now - health.window_start:.1f}s"
+        elif health.window_stalls >= self.max_stalls:
+            reason = f"{health.window_stalls} {health.name} calls slower than {self.stall * 1000:.0f}ms"
+        else:
+            # Callback streams: the device stopped calling back
+            last_callback = getattr(stream, "last_callback", None)
+            if last_callback is not None and now - last_callback > self.stall:
+                try:
+                    active = stream.is_active()
+                except Exception:
+                    active = True
+                if active:
+                    reason = f"no {health.name} callback for {(now - last_callback) * 1000:.0f}ms"
+
+        if reason is None:
+            if now - health.window_start > self.window:
+                health.new_window(now, xruns)
+            return None
+
+        # Keep counting, but don't reset the same stream again straight away
+        if now - health.last_reset < self.cooldown:
+            if now - health.window_start > self.window:
+                health.new_window(now, xruns)
+            return None
+        health.last_reset = now
+        health.resets += 1
+        health.last_reason = reason
+        health.new_window(now, xruns)
+        return reason
+
+    def summary(self):
+        return f"Input: {self.input.summary()}; Output: {self.output.summary()}"
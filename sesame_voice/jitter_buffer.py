@@ -0,0 +1,226 @@
+# Adaptive playback jitter buffer for audio received from the character
+#
+# Chunks are pushed as they arrive from the websocket and popped in fixed playout
+# frames. The target depth is one chunk (the audio that has to be played before the
+# next one is due) plus a margin that follows the measured inter-arrival jitter
+# (RFC 3550 style running estimate). Audio beyond the target plus another chunk is a
+# backlog, and the total buffered audio is capped so a stalled speaker can never grow
+# memory or mouth-to-ear latency without bound (a cap below two chunks is raised to
+# fit them, or every chunk would overflow it).
+
+import collections
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger("sesame_voice")
+
+OVERFLOW_POLICIES = ("drop", "compress")
+
+# The "compress" policy drains a backlog by cutting one stretch of this length out of
+# a frame: a pitch period or two, picked where the waveform repeats best and
+# cross-faded, so the voice keeps its pitch (like WSOLA, or WebRTC's accelerate)
+COMPRESS_MIN_MS = 2.5
+COMPRESS_MAX_MS = 10.0
+COMPRESS_MATCH_MS = 5.0  # Waveform compared to find the best cut
+
+
+class JitterBuffer:
+    def __init__(self, sample_rate, sample_width=2, channels=1, min_delay_ms=40,
+                 max_latency_ms=400, overflow_policy="compress", gap_ms=500):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy} "
+                             f"(expected one of {OVERFLOW_POLICIES})")
+        if max_latency_ms <= min_delay_ms:
+            raise ValueError("max_latency_ms must be larger than min_delay_ms")
+
+        self.sample_width = sample_width
+        self.channels = channels
+        self.min_delay_ms = min_delay_ms
+        self.max_latency_ms = max_latency_ms
+        self.overflow_policy = overflow_policy
+        # A dry buffer followed by new audio within this window is an underrun;
+        # a longer gap is just the end of what the character was saying
+        self.gap_ms = gap_ms
+
+        self.underruns = 0
+        self.overruns = 0
+        self.dropped_bytes = 0
+        self.compressed_frames = 0
+        self.compressed_ms = 0.0  # Audio cut out by compression
+        self.max_depth_ms = 0.0
+
+        self.reset(sample_rate)
+
+    # Forget buffered audio and timing history, e.g. after a reconnect
+    def reset(self, sample_rate=None):
+        if sample_rate:
+            self.sample_rate = sample_rate
+        self._bytes_per_ms = self.sample_rate * self.sample_width * self.channels / 1000.0
+        self._chunks = collections.deque()
+        self._head = 0
+        self._buffered = 0
+        self._last_arrival = None
+        self._last_duration = 0.0
+        self._chunk_ms = 0.0  # Recent largest chunk, decaying
+        self._jitter_ms = 0.0
+        self._playing = False
+        self._starved_at = None
+        self.target_ms = float(self.min_delay_ms)
+
+    # Drop buffered audio but keep the jitter estimate, e.g. on barge-in; returns the
+    # number of bytes dropped
+    def flush(self):
+        dropped = self._buffered
+        self._chunks.clear()
+        self._head = 0
+        self._buffered = 0
+        self._playing = False
+        self._starved_at = None
+        return dropped
+
+    def depth_ms(self):
+        return self._buffered / self._bytes_per_ms
+
+    def jitter_ms(self):
+        return self._jitter_ms
+
+    def ready(self):
+        return self._playing
+
+    # Steady arrival peaks at the target plus one chunk; anything above is a backlog
+    def backlog_ms(self):
+        return self.target_ms + self._chunk_ms
+
+    # Hard cap on buffered audio
+    def limit_ms(self):
+        return max(self.max_latency_ms, self.backlog_ms())
+
+    # Add a received chunk and update the jitter estimate
+    def push(self, chunk, now=None):
+        if not chunk:
+            return
+        now = time.monotonic() if now is None else now
+
+        if self._last_arrival is not None:
+            # Deviation between arrival spacing and the audio duration it carried
+            spacing_ms = (now - self._last_arrival) * 1000.0
+            deviation = abs(spacing_ms - self._last_duration)
+            self._jitter_ms += (deviation - self._jitter_ms) / 16.0
+        self._last_arrival = now
+        self._last_duration = len(chunk) / self._bytes_per_ms
+        self._chunk_ms = max(self._last_duration, 0.9 * self._chunk_ms)
+        margin = max(self.min_delay_ms, 3.0 * self._jitter_ms)
+        self.target_ms = self._chunk_ms + min(margin, self.max_latency_ms / 2.0)
+
+        if self._starved_at is not None:
+            if (now - self._starved_at) * 1000.0 < self.gap_ms:
+                self.underruns += 1
+            self._starved_at = None
+
+        self._chunks.append(chunk)
+        self._buffered += len(chunk)
+        self.max_depth_ms = max(self.max_depth_ms, self.depth_ms())
+
+        if self.depth_ms() > self.limit_ms():
+            self._enforce_cap()
+
+    # Pop one playout frame of frame_bytes, or None while (re)buffering
+    def pop(self, frame_bytes, now=None):
+        now = time.monotonic() if now is None else now
+        if not self._playing:
+            if self._buffered == 0:
+                return None
+            # Start once the target depth is reached, or when the stream has gone
+            # quiet so the tail of an utterance is not held back
+            idle_ms = (now - self._last_arrival) * 1000.0
+            if self.depth_ms() < self.target_ms and idle_ms < self.target_ms:
+                return None
+            self._playing = True
+
+        if self._buffered < frame_bytes:
+            # Ran dry: play out what is left and rebuffer up to the target depth
+            self._playing = False
+            self._starved_at = now
+            return self._take(self._buffered) or None
+
+        if (self.overflow_policy == "compress"
+                and self.depth_ms() > self.backlog_ms()
+                and self.depth_ms() >= frame_bytes / self._bytes_per_ms + 2 * COMPRESS_MAX_MS):
+            return self._compress(frame_bytes)
+
+        return self._take(frame_bytes)
+
+    # Drop the oldest audio so the buffer is back at its target depth
+    def _enforce_cap(self):
+        excess = self._buffered - int(self.target_ms * self._bytes_per_ms)
+        excess -= excess % (self.sample_width * self.channels)
+        if excess <= 0:
+            return
+        self._take(excess)
+        self.overruns += 1
+        self.dropped_bytes += excess
+        logger.debug(f"Jitter buffer over {self.limit_ms():.0f}ms, dropped {excess} bytes")
+
+    # Play a frame and a cut stretch worth of audio in one frame to catch up on a backlog
+    def _compress(self, frame_bytes):
+        frame_align = self.sample_width * self.channels
+        out_len = frame_bytes // frame_align
+        samples_per_ms = self.sample_rate / 1000.0
+        min_cut = max(int(COMPRESS_MIN_MS * samples_per_ms), 1)
+        max_cut = min(max(int(COMPRESS_MAX_MS * samples_per_ms), min_cut), out_len)
+        match = max(int(COMPRESS_MATCH_MS * samples_per_ms), 1)
+        data = self._take((out_len + max(max_cut, match)) * frame_align)
+        samples = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels).astype(np.float32)
+
+        # The cut whose following audio best matches the start of the frame
+        mono = samples.mean(axis=1)
+        head = mono[:match]
+        windows = np.lib.stride_tricks.sliding_window_view(mono[min_cut:max_cut + match], match)
+        energy = np.sqrt((windows ** 2).sum(axis=1) * (head ** 2).sum())
+        if energy.max() < 1.0:
+            cut = max_cut  # Silence: skip as much as possible
+        else:
+            cut = min_cut + int(np.argmax(windows @ head / np.maximum(energy, 1e-9)))
+
+        # Cross-fade from the frame's start into the audio one cut later
+        fade = np.linspace(0.0, 1.0, cut, dtype=np.float32)[:, None]
+        out = np.empty((out_len, self.channels), dtype=np.float32)
+        out[:cut] = samples[:cut] * (1.0 - fade) + samples[cut:2 * cut] * fade
+        out[cut:] = samples[2 * cut:out_len + cut]
+        self._unread(data[(out_len + cut) * frame_align:])
+
+        self.compressed_frames += 1
+        self.compressed_ms += cut / samples_per_ms
+        return np.clip(out, -32768, 32767).astype(np.int16).tobytes()
+
+    # Put audio taken by _compress but not used back at the front
+    def _unread(self, data):
+        if not data:
+            return
+        if self._head:
+            self._chunks[0] = self._chunks[0][self._head:]
+            self._head = 0
+        self._chunks.appendleft(data)
+        self._buffered += len(data)
+
+    def _take(self, n):
+        out = bytearray()
+        while n > 0 and self._chunks:
+            chunk = self._chunks[0]
+            piece = chunk[self._head:self._head + n]
+            out += piece
+            n -= len(piece)
+            self._head += len(piece)
+            if self._head >= len(chunk):
+                self._chunks.popleft()
+                self._head = 0
+        self._buffered -= len(out)
+        return bytes(out)
+
+    def summary(self):
+        return (f"Depth: {self.depth_ms():.0f}ms (target {self.target_ms:.0f}ms, "
+                f"max {self.max_depth_ms:.0f}ms), Jitter: {self._jitter_ms:.1f}ms, "
+                f"Underruns: {self.underruns}, Overruns: {self.overruns}, "
+                f"Compressed frames: {self.compressed_frames} ({self.compressed_ms:.0f}ms cut)")
@@ -0,0 +1,172 @@
+# Load generator: many simulated conversations spread over worker processes
+#
+# run_load() spawns worker processes that each run a share of the sessions. These are
+# ordinary Sessions (capture, uplink, receive, jitter buffer, playback) on the asyncio
+# engine. Their audio devices are FakePyAudio streams in either I/O mode (see audio_io)
+# and their websockets talk to a server over the network. Unless a URL is given, the
+# server is one or more stand-in servers in "reply" mode, each in its own process.
+#
+# The microphone fixture is loaded once into shared memory. Workers map the segment and
+# every session loops over the same pages from its own random offset, so memory doesn't
+# grow with the number of workers. Each worker returns its raw response latencies,
+# dropped frame counts and CPU time, and aggregate() combines them across workers.
+
+import functools
+import logging
+import multiprocessing
+import random
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from sesame_voice.audio_io import FileSource, LoopSource, PyAudioBackend
+from sesame_voice.session import Session, SessionConfig, SessionManager
+from sesame_voice.standin import FakePyAudio, StandinWebSocket, describe_ms, serve_process
+from sesame_voice.tracing import SERVER_TRACK
+
+logger = logging.getLogger("sesame_voice")
+
+
+# Microphone audio for the simulated callers: a WAV or raw file converted to `rate`,
+# or by default 1.5 s of a two-tone "voice" followed by 3.5 s of silence
+def load_fixture(path=None, rate=16000):
+    if path is None:
+        t = np.arange(int(rate * 1.5)) / rate
+        voice = 2500 * np.sin(2 * np.pi * 180 * t) + 1500 * np.sin(2 * np.pi * 410 * t)
+        return voice.astype(np.int16).tobytes() + bytes(int(rate * 3.5) * 2)
+
+    source = FileSource([path], 2, 1, rate)
+    pcm = bytearray()
+    while not source.finished:
+        pcm += source.read(rate * 2)
+    return bytes(pcm)
+
+
+# Worker process: run `sessions` sessions for `duration` seconds and report raw results
+def run_worker(worker_id, fixture_name, fixture_bytes, urls, sessions, duration, engine, start_delay, seed,
+               io_mode="blocking"):
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger("websocket").setLevel(logging.CRITICAL)
+    rng = random.Random(seed)
+    # Spawned workers share the parent's resource tracker, so attaching here doesn't
+    # make this process an owner of the segment
+    segment = shared_memory.SharedMemory(name=fixture_name)
+    fixture = segment.buf[:fixture_bytes]
+    sources = []
+
+    # Every session starts somewhere else in the fixture so they don't speak in lockstep
+    def source_factory():
+        source = LoopSource(fixture, offset=rng.randrange(0, fixture_bytes // 2) * 2)
+        sources.append(source)
+        return source
+
+    backend = PyAudioBackend(FakePyAudio(source_factory=source_factory), io_mode)
+    config = SessionConfig(engine=engine, interactive=False)
+    manager = SessionManager(engine)
+    for i in range(sessions):
+        url = urls[(worker_id + i) % len(urls)]
+        manager.add(Session("loadgen", backend, config, name=f"w{worker_id}s{i}",
+                            ws_factory=functools.partial(StandinWebSocket, url=url)))
+
+    time.sleep(start_delay)
+    cpu_before = time.process_time()
+    wall_before = time.monotonic()
+    manager.run(duration)
+    cpu = time.process_time() - cpu_before
+    wall = time.monotonic() - wall_before
+
+    latency_ms = []
+    received_dropped = 0
+    for session in manager.sessions:
+        latency_ms += [span[3] * 1000 for span in session.tracker.spans if span[1] == SERVER_TRACK]
+        if session.current_ws is not None:
+            received_dropped += getattr(session.current_ws, "dropped_chunks", 0)
+    stats = manager.stats()
+
+    for source in sources:
+        source.release()
+    fixture.release()
+    segment.close()
+
+    return {
+        "worker": worker_id,
+        "sessions": sessions,
+        "cpu_s": cpu,
+        "wall_s": wall,
+        "latency_ms": latency_ms,
+        "connected": sum(1 for s in stats if s["reconnects"] > 0),
+        "reconnects": sum(max(s["reconnects"] - 1, 0) for s in stats),
+        "frames_sent": sum(s["frames_sent"] for s in stats),
+        "uplink_dropped": sum(s["uplink_dropped"] for s in stats),
+        "received_dropped": received_dropped,
+        "jitter_overruns": sum(s.get("jitter_overruns", 0) for s in stats),
+        "jitter_underruns": sum(s.get("jitter_underruns", 0) for s in stats),
+    }
+
+
+# Combine the results of every worker
+def aggregate(results):
+    sessions = sum(r["sessions"] for r in results)
+    wall = max(r["wall_s"] for r in results)
+    cpu = sum(r["cpu_s"] for r in results)
+    latency = [value for r in results for value in r["latency_ms"]]
+    totals = {key: sum(r[key] for r in results) for key in
+              ("connected", "reconnects", "frames_sent", "uplink_dropped", "received_dropped",
+               "jitter_overruns", "jitter_underruns")}
+    return dict(totals,
+                workers=len(results),
+                sessions=sessions,
+                wall_s=round(wall, 2),
+                cpu_pct_per_session=round(100.0 * cpu / wall / sessions, 2),
+                cpu_pct_per_worker=[round(100.0 * r["cpu_s"] / r["wall_s"], 1) for r in results],
+                response_latency_ms=describe_ms(latency),
+                turns=len(latency),
+                dropped_frames=totals["uplink_dropped"] + totals["received_dropped"] + totals["jitter_overruns"])
+
+
+# Run `sessions` sessions across `workers` processes for `duration` seconds. Worker
+# starts are spread over `ramp` seconds. Without `url`, `server_processes` stand-in
+# servers are started with `server_options` and their stats are included.
+def run_load(workers, sessions, duration, engine="asyncio", url=None, fixture=None, ramp=0.0,
+             server_processes=1, server_options=None, seed=0, io_mode="blocking"):
+    ctx = multiprocessing.get_context("spawn")
+    pcm = load_fixture(fixture)
+    segment = shared_memory.SharedMemory(create=True, size=len(pcm))
+    segment.buf[:len(pcm)] = pcm
+
+    servers = []
+    try:
+        if url:
+            urls = [url]
+        else:
+            options = dict({"mode": "reply", "latency_ms": 300, "jitter_ms": 20, "seed": seed}, **(server_options or {}))
+            for _ in range(server_processes):
+                parent, child = ctx.Pipe()
+                process = ctx.Process(target=serve_process, args=(child, options), daemon=True)
+                process.start()
+                servers.append((process, parent))
+            urls = [parent.recv() for _, parent in servers]
+
+        shares = [sessions // workers + (1 if i < sessions % workers else 0) for i in range(workers)]
+        jobs = [(i, segment.name, len(pcm), urls, shares[i], duration, engine,
+                 ramp * i / max(workers - 1, 1), seed + i, io_mode) for i in range(workers) if shares[i]]
+        logger.info(f"Running {sessions} sessions in {len(jobs)} worker processes against {', '.join(urls)}")
+        with ctx.Pool(len(jobs)) as pool:
+            results = pool.starmap(run_worker, jobs, chunksize=1)
+
+        summary = aggregate(results)
+        server_stats = []
+        for process, parent in servers:
+            parent.send("stop")
+            server_stats.append(parent.recv())
+        if server_stats:
+            summary["servers"] = server_stats
+        return summary
+    finally:
+        for process, _ in servers:
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+        segment.close()
+        segment.unlink()
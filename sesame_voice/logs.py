@@ -0,0 +1,166 @@
+# Logging and console output that stay off the audio hot path
+#
+# start_async_logging() routes every record through a bounded queue to a background
+# listener thread that owns the real handlers (file, console), so a slow disk or
+# terminal never blocks the capture or playback loops. The queue handler never waits:
+# when the queue is full the record is dropped and counted. A per-call-site rate limit
+# keeps a repeating warning in a tight loop from flooding the queue in the first place.
+#
+# MeterRenderer draws the microphone level meter from its own thread at a fixed, low
+# frame rate; the capture loop only stores the latest level.
+
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+
+# Drops records instead of blocking when the queue is full, and leaves the formatting
+# to the listener thread
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # Only merge the arguments into the message (so the record is safe to hand to
+    # another thread); timestamps and formatting are done by the listener
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# Lets each call site log at most `burst` messages at once and `rate` per second after
+# that, separately for every logger and session, so one noisy session cannot silence the
+# same message from the others; the next message that gets through reports how many
+# were suppressed. Records arrive on whichever thread logs them, hence the lock.
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate=5.0, burst=10, exempt_level=logging.CRITICAL):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.exempt_level = exempt_level
+        self.suppressed = 0
+        # (logger, session, pathname, lineno) -> [tokens, last refill time, suppressed count]
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.exempt_level:
+            return True
+
+        key = (record.name, getattr(record, "session", None), record.pathname, record.lineno)
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+
+            bucket[0] -= 1
+            suppressed = bucket[2]
+            bucket[2] = 0
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} (suppressed {suppressed} similar messages)"
+            record.args = None
+        return True
+
+
+class AsyncLogging:
+    def __init__(self, handler, listener, rate_limit):
+        self.handler = handler
+        self.listener = listener
+        self.rate_limit = rate_limit
+        self._stopped = False
+
+    # Flush what is queued to the real handlers and stop the listener thread
+    def stop(self):
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+
+    def summary(self):
+        suppressed = self.rate_limit.suppressed if self.rate_limit else 0
+        return f"Dropped: {self.handler.dropped}, Rate limited: {suppressed}"
+
+
+# Replace the root logger's handlers with a queue feeding `handlers` on a listener
+# thread. rate=None disables rate limiting.
+def start_async_logging(handlers, level=logging.INFO, queue_size=10000, rate=5.0, burst=10):
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = NonBlockingQueueHandler(log_queue)
+    rate_limit = None
+    if rate:
+        rate_limit = RateLimitFilter(rate=rate, burst=burst)
+        handler.addFilter(rate_limit)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return AsyncLogging(handler, listener, rate_limit)
+
+
+class MeterRenderer:
+    def __init__(self, fps=10, width=20, scale=100, stream=None):
+        self.interval = 1.0 / fps
+        self.width = width
+        self.scale = scale
+        self.stream = stream or sys.stdout
+        self._level = 0.0
+        self._energy = 0.0
+        self._version = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Called from the capture loop: just remember the latest values
+    def update(self, level, energy):
+        self._level = level
+        self._energy = energy
+        self._version += 1
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="meter", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        drawn = 0
+        while not self._stop.wait(self.interval):
+            version = self._version
+            if version == drawn:
+                continue
+            drawn = version
+            bars = int(min(self._level / self.scale, self.width))
+            try:
+                self.stream.write(f"\rMic: {'|' * bars}{' ' * (self.width - bars)} Level: {self._energy:.0f}")
+                self.stream.flush()
+            except Exception:
+                pass
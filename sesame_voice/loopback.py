@@ -0,0 +1,97 @@
+# In-process stand-in for SesameWebSocket
+#
+# LoopbackWebSocket has the same public methods as sesame_ai's SesameWebSocket but never
+# touches the network: audio sent with send_audio_data() comes back as character audio
+# after an optional delay. It is used to run sessions in benchmarks and load tests
+# without the live service, and drop() simulates the server killing the connection.
+
+import queue
+import threading
+import time
+
+
+class LoopbackWebSocket:
+    def __init__(self, id_token=None, character="Maya", server_sample_rate=16000,
+                 connect_delay=0.0, echo_delay=0.0, max_queue=1000):
+        self.id_token = id_token
+        self.character = character
+        self.server_sample_rate = server_sample_rate
+        self.connect_delay = connect_delay
+        self.echo_delay = echo_delay
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._audio_queue = queue.Queue(maxsize=max_queue)
+        self._connected = False
+        self._connect_callback = None
+        self._disconnect_callback = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def set_connect_callback(self, callback):
+        self._connect_callback = callback
+
+    def set_disconnect_callback(self, callback):
+        self._disconnect_callback = callback
+
+    # Connects in the background like the real client; the connect callback fires
+    # from another thread once the (simulated) handshake is done
+    def connect(self):
+        def finish():
+            if self.connect_delay:
+                time.sleep(self.connect_delay)
+            self._connected = True
+            if self._connect_callback:
+                self._connect_callback()
+
+        threading.Thread(target=finish, daemon=True).start()
+
+    def is_connected(self):
+        return self._connected
+
+    def disconnect(self):
+        self._close()
+
+    # Simulate the server dropping the connection
+    def drop(self):
+        self._close()
+
+    def _close(self):
+        if not self._connected:
+            return
+        self._connected = False
+        if self._disconnect_callback:
+            self._disconnect_callback()
+
+    def send_audio_data(self, data):
+        if not self._connected:
+            raise ConnectionError("Not connected")
+        self.bytes_sent += len(data)
+        chunk = bytes(data)
+        if not self.echo_delay:
+            self._deliver(chunk)
+            return
+
+        # Release delayed chunks in order once they are due
+        due = time.monotonic() + self.echo_delay
+        with self._lock:
+            self._pending.append((due, chunk))
+        threading.Timer(self.echo_delay, self._release_due).start()
+
+    def _release_due(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._pending and self._pending[0][0] <= now:
+                self._deliver(self._pending.pop(0)[1])
+
+    def _deliver(self, chunk):
+        try:
+            self._audio_queue.put_nowait(chunk)
+            self.bytes_received += len(chunk)
+        except queue.Full:
+            pass
+
+    def get_next_audio_chunk(self, timeout=None):
+        try:
+            return self._audio_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
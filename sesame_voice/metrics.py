@@ -0,0 +1,244 @@
+# Latency and throughput metrics
+#
+# Every Session has a SessionMetrics with histograms for the latencies that matter to a
+# conversation and counters that read the session's own totals. A MetricsRegistry
+# collects any number of sessions and renders them in the Prometheus text exposition
+# format (one series per session, labelled session="<name>"); MetricsServer serves that
+# on a local HTTP endpoint and dump() writes it to a file, e.g. on exit.
+
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger("sesame_voice")
+
+# Bucket upper bounds
+LATENCY_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+DEPTH_MS_BUCKETS = (0, 20, 40, 60, 80, 120, 160, 240, 320, 400, 600)
+
+
+class Counter:
+    # value_fn reads a total the session already keeps
+    def __init__(self, name, help, value_fn):
+        self.name = name
+        self.help = help
+        self.kind = "counter"
+        self.value_fn = value_fn
+
+    def samples(self, labels):
+        yield self.name, labels, self.value_fn()
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.kind = "histogram"
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    # Called per frame: acquire()/release() rather than a with block, which allocates
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        self._lock.acquire()
+        try:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+        finally:
+            self._lock.release()
+
+    # Estimate of quantile q (linear within the bucket it falls in)
+    def quantile(self, q):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            if count and seen + count >= rank:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return lower
+
+    def samples(self, labels):
+        with self._lock:
+            counts = list(self.counts)
+            total_sum = self.sum
+            total = self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            yield f"{self.name}_bucket", dict(labels, le=le), cumulative
+        yield f"{self.name}_sum", labels, total_sum
+        yield f"{self.name}_count", labels, total
+
+
+# Histograms of one family told apart by a label, e.g. one per loop
+class HistogramSet:
+    def __init__(self, name, help, buckets, label):
+        self.name = name
+        self.help = help
+        self.kind = "histogram"
+        self.buckets = tuple(buckets)
+        self.label = label
+        self.histograms = {}
+
+    # The histogram for one label value, created on first use
+    def histogram(self, value):
+        histogram = self.histograms.get(value)
+        if histogram is None:
+            histogram = self.histograms[value] = Histogram(self.name, self.help, self.buckets)
+        return histogram
+
+    def samples(self, labels):
+        for value, histogram in list(self.histograms.items()):
+            yield from histogram.samples(dict(labels, **{self.label: value}))
+
+
+class SessionMetrics:
+    def __init__(self, session):
+        self.session = session
+        self.response_latency = Histogram(
+            "sesame_response_latency_seconds",
+            "Time from the end of the user's speech to the first audio chunk of the reply (see tracing)",
+            LATENCY_BUCKETS)
+        self.frame_send_latency = Histogram(
+            "sesame_frame_send_latency_seconds",
+            "Time from capturing a microphone frame to handing it to the websocket",
+            FAST_BUCKETS)
+        self.capture_iteration = Histogram(
+            "sesame_capture_iteration_seconds",
+            "Duration of one capture loop iteration, including the microphone read",
+            FAST_BUCKETS)
+        self.playback_depth = Histogram(
+            "sesame_playback_queue_depth_ms",
+            "Audio buffered in the jitter buffer at each playout",
+            DEPTH_MS_BUCKETS)
+        self.reconnect_duration = Histogram(
+            "sesame_reconnect_duration_seconds",
+            "Time from losing the connection to having a live one again",
+            LATENCY_BUCKETS)
+        self.loop_stalls = HistogramSet(
+            "sesame_loop_stall_seconds",
+            "How far a hot loop (capture, playback, uplink) overran its deadline when it stalled (see watchdog)",
+            LATENCY_BUCKETS, "loop")
+        self.barge_in_latency = Histogram(
+            "sesame_barge_in_latency_seconds",
+            "Time from the user starting to talk over the character to its audio being flushed (see barge_in)",
+            LATENCY_BUCKETS)
+
+        self.families = [
+            self.response_latency,
+            self.frame_send_latency,
+            self.capture_iteration,
+            self.playback_depth,
+            self.reconnect_duration,
+            self.barge_in_latency,
+            self.loop_stalls,
+            Counter("sesame_bytes_sent_total", "Microphone audio bytes sent",
+                    lambda: session.bytes_sent),
+            Counter("sesame_bytes_received_total", "Character audio bytes received",
+                    lambda: session.bytes_received),
+            Counter("sesame_frames_sent_total", "Microphone frames sent",
+                    lambda: session.frames_sent),
+            Counter("sesame_reconnects_total", "Connections established",
+                    lambda: session.reconnect_count),
+            Counter("sesame_uplink_dropped_frames_total", "Microphone frames dropped by the uplink queue",
+                    lambda: session.uplink.dropped_frames),
+            Counter("sesame_stream_resets_total", "Audio stream resets",
+                    lambda: session.health.input.resets + session.health.output.resets),
+            Counter("sesame_barge_ins_total", "Character replies interrupted by the user",
+                    lambda: session.barge_in.interruptions if session.barge_in else 0),
+        ]
+
+    def summary(self):
+        def ms(histogram, q):
+            value = histogram.quantile(q)
+            return "-" if value is None else f"{value * 1000:.0f}ms"
+
+        return (f"Response p50 {ms(self.response_latency, 0.5)} / p95 {ms(self.response_latency, 0.95)}, "
+                f"Frame send p95 {ms(self.frame_send_latency, 0.95)}, "
+                f"Capture iteration p95 {ms(self.capture_iteration, 0.95)}, "
+                f"Barge-in p95 {ms(self.barge_in_latency, 0.95)}")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.sessions = []
+
+    def add(self, session):
+        self.sessions.append(session)
+
+    # Prometheus text exposition of every session's metrics
+    def render(self):
+        lines = []
+        if not self.sessions:
+            return ""
+        for index in range(len(self.sessions[0].metrics.families)):
+            first = self.sessions[0].metrics.families[index]
+            lines.append(f"# HELP {first.name} {first.help}")
+            lines.append(f"# TYPE {first.name} {first.kind}")
+            for session in self.sessions:
+                labels = {"session": session.name or "main"}
+                for name, sample_labels, value in session.metrics.families[index].samples(labels):
+                    label_text = ",".join(f'{key}="{val}"' for key, val in sample_labels.items())
+                    lines.append(f"{name}{{{label_text}}} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            f.write(self.render())
+        logger.info(f"Metrics written to {path}")
+
+
+class MetricsServer:
+    def __init__(self, registry, host="127.0.0.1", port=9464):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        # Imported here: the HTTP stack isn't needed until the endpoint is, and this runs
+        # after the session is up rather than on the startup path
+        import http.server
+
+        registry = self.registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # Keep scrapes out of the log
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,258 @@
+# Conversation recorder
+#
+# ConversationRecorder records both directions of a session into one two-track file:
+# track 0 is the microphone audio as captured (after AGC, the noise gate and bleed
+# suppression, before the voice activity gate), track 1 the character's audio as it is
+# played. The audio loops only copy each chunk into a preallocated per-track ring
+# together with its timestamp (no allocation, no locks, no file I/O); if a ring is full
+# the chunk is dropped and counted rather than waited for.
+#
+# A background writer drains the rings every flush_interval, places every chunk on a
+# common timeline by its timestamp (consecutive chunks stay back to back; gaps such as
+# a microphone being reopened become silence) and assembles the
+# interleaved output in a small fixed window of segments. Finished segments are copied
+# into the file through a memory map, so memory stays bounded however long the session.
+#
+# Formats: "wav" (16-bit PCM WAV; the RIFF size fields limit it to about 18 hours of
+# 16 kHz stereo) or "raw" (headerless interleaved little-endian int16).
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from sesame_voice.resample import StreamingResampler
+from sesame_voice.ring_buffer import RingBuffer
+
+logger = logging.getLogger("sesame_voice")
+
+RECORD_FORMATS = ("wav", "raw")
+
+# Track numbers
+MIC_TRACK = 0
+CHARACTER_TRACK = 1
+
+WAV_HEADER_BYTES = 44
+
+
+# Staging area for one direction: one producer (an audio loop), one consumer (the writer)
+class _Track:
+    def __init__(self, capacity_bytes, max_chunks):
+        self.ring = RingBuffer(capacity_bytes)
+        self.max_chunks = max_chunks
+        self.times = np.zeros(max_chunks)
+        self.sizes = np.zeros(max_chunks, dtype=np.int64)
+        self.rates = np.zeros(max_chunks, dtype=np.int64)
+        self.head = 0  # Chunks staged (producer)
+        self.tail = 0  # Chunks taken (writer)
+        self.dropped_chunks = 0
+
+        # Writer state
+        self.next_pos = None  # Timeline position right after the last chunk
+        self.resampler = None
+
+
+class ConversationRecorder:
+    def __init__(self, path, rate, channels=1, format="wav", segment_seconds=2.0,
+                 window_segments=3, staging_seconds=2.0, flush_interval=0.1, tolerance_ms=200):
+        if format not in RECORD_FORMATS:
+            raise ValueError(f"Unknown recording format: {format} (expected one of {RECORD_FORMATS})")
+        self.path = path
+        self.rate = rate
+        self.channels = channels
+        self.format = format
+        self.flush_interval = flush_interval
+        # A chunk is put right after the previous one unless its timestamp is further
+        # than this from where that puts it
+        self.tolerance = int(rate * tolerance_ms / 1000)
+
+        # Staging rings sized for the highest rate either direction may use
+        staging_bytes = int(staging_seconds * max(rate, 48000)) * 2 * channels
+        self._tracks = [_Track(staging_bytes, 1024), _Track(staging_bytes, 1024)]
+        self._scratch = bytearray(staging_bytes)
+
+        # Output window: window_segments segments of interleaved frames
+        self.out_channels = 2 * channels
+        self.frame_bytes = 2 * self.out_channels
+        self.segment_frames = int(segment_seconds * rate)
+        self.segment_bytes = self.segment_frames * self.frame_bytes
+        self.window_segments = window_segments
+        self._window = np.zeros((window_segments * self.segment_frames, self.out_channels), dtype=np.int16)
+        self._dirty = [False] * window_segments
+        self._first_segment = 0  # Oldest segment held in the window
+        self._data_offset = WAV_HEADER_BYTES if format == "wav" else 0
+
+        self._file = None
+        self._t0 = None
+        self._running = False
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Metrics
+        self.late_frames = 0
+        self.segments_written = 0
+        self.frames_recorded = 0
+
+    def start(self):
+        if self._running:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "w+b")
+        if self.format == "wav":
+            self._file.write(self._wav_header(0))
+            self._file.flush()
+        self._t0 = time.monotonic()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+        logger.info(f"Recording conversation to {self.path}")
+
+    # Called from the audio loops: stage a chunk of int16 audio at `rate`. Never blocks.
+    def record(self, track_index, data, rate):
+        if not self._running:
+            return
+        track = self._tracks[track_index]
+        size = len(data)
+        if track.head - track.tail >= track.max_chunks or track.ring.free() < size:
+            track.dropped_chunks += 1
+            return
+        track.ring.write(data)
+        slot = track.head % track.max_chunks
+        track.times[slot] = time.monotonic()
+        track.sizes[slot] = size
+        track.rates[slot] = rate
+        track.head += 1
+
+    # Stop recording, write out everything staged and finish the file
+    def close(self):
+        if not self._running:
+            return
+        self._running = False
+        self._stop.set()
+        self._thread.join()
+        logger.info(f"Recording saved to {self.path} - {self.summary()}")
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.flush_interval):
+                self._drain()
+                # Segments that ended a segment (plus the tolerance) before now can't
+                # receive any more audio
+                now_pos = int((time.monotonic() - self._t0) * self.rate)
+                margin = self.segment_frames + self.tolerance
+                while (self._first_segment + 1) * self.segment_frames + margin < now_pos:
+                    self._flush_oldest()
+            self._drain()
+            self._finish()
+        except Exception as e:
+            logger.error(f"Recorder stopped: {e}")
+
+    # Move staged chunks from the rings onto the timeline
+    def _drain(self):
+        for index, track in enumerate(self._tracks):
+            while track.tail < track.head:
+                slot = track.tail % track.max_chunks
+                size = int(track.sizes[slot])
+                if size > len(self._scratch):
+                    self._scratch = bytearray(size)
+                track.ring.read_into(memoryview(self._scratch)[:size])
+                rate = int(track.rates[slot])
+                t = float(track.times[slot])
+                track.tail += 1
+
+                data = memoryview(self._scratch)[:size]
+                if rate != self.rate:
+                    if track.resampler is None or track.resampler.in_rate != rate:
+                        track.resampler = StreamingResampler(rate, self.rate, self.channels)
+                    data = track.resampler.process(data)
+                samples = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+                self._place(index, track, samples, t)
+
+    def _place(self, index, track, samples, t):
+        frames = len(samples)
+        if not frames:
+            return
+        # The chunk ends at its timestamp
+        expected = int((t - self._t0) * self.rate) - frames
+        if track.next_pos is not None and expected <= track.next_pos + self.tolerance:
+            start = track.next_pos
+        else:
+            start = max(expected, 0)
+        track.next_pos = start + frames
+        self.frames_recorded = max(self.frames_recorded, track.next_pos)
+
+        columns = slice(index * self.channels, (index + 1) * self.channels)
+        pos = start
+        offset = 0
+        while offset < frames:
+            segment = pos // self.segment_frames
+            if segment < self._first_segment:
+                # Its segment is already on disk
+                skip = min(frames - offset, self._first_segment * self.segment_frames - pos)
+                self.late_frames += skip
+                pos += skip
+                offset += skip
+                continue
+            while segment >= self._first_segment + self.window_segments:
+                self._flush_oldest()
+
+            slot = segment % self.window_segments
+            within = pos - segment * self.segment_frames
+            count = min(frames - offset, self.segment_frames - within)
+            base = slot * self.segment_frames + within
+            self._window[base:base + count, columns] = samples[offset:offset + count]
+            self._dirty[slot] = True
+            pos += count
+            offset += count
+
+    # Write the oldest segment of the window to the file and reuse its slot
+    def _flush_oldest(self):
+        slot = self._first_segment % self.window_segments
+        if self._dirty[slot]:
+            block = self._window[slot * self.segment_frames:(slot + 1) * self.segment_frames]
+            self._write(self._data_offset + self._first_segment * self.segment_bytes, block)
+            block.fill(0)
+            self._dirty[slot] = False
+            self.segments_written += 1
+        self._first_segment += 1
+
+    # Copy a block of frames into the file through a memory map
+    def _write(self, offset, block):
+        data = memoryview(block).cast('B')
+        end = offset + len(data)
+        fd = self._file.fileno()
+        if os.fstat(fd).st_size < end:
+            os.ftruncate(fd, end)
+        aligned = offset - offset % mmap.ALLOCATIONGRANULARITY
+        with mmap.mmap(fd, end - aligned, offset=aligned) as mapped:
+            mapped[offset - aligned:end - aligned] = data
+
+    def _finish(self):
+        last_segment = -(-self.frames_recorded // self.segment_frames)
+        while self._first_segment < last_segment:
+            self._flush_oldest()
+
+        data_bytes = self.frames_recorded * self.frame_bytes
+        fd = self._file.fileno()
+        os.ftruncate(fd, self._data_offset + data_bytes)
+        if self.format == "wav":
+            self._file.seek(0)
+            self._file.write(self._wav_header(data_bytes))
+        self._file.close()
+
+    def _wav_header(self, data_bytes):
+        byte_rate = self.rate * self.frame_bytes
+        return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data_bytes, b"WAVE", b"fmt ", 16, 1,
+                           self.out_channels, self.rate, byte_rate, self.frame_bytes, 16,
+                           b"data", data_bytes)
+
+    def summary(self):
+        dropped = sum(track.dropped_chunks for track in self._tracks)
+        return (f"Recorded: {self.frames_recorded / self.rate:.1f}s, Segments written: {self.segments_written}, "
+                f"Dropped chunks: {dropped}, Late frames: {self.late_frames}")
@@ -0,0 +1,189 @@
+# Streaming sample-rate conversion between the devices and the server
+#
+# StreamingResampler converts int16 PCM by the rational factor out_rate / in_rate with a
+# polyphase FIR filter bank (Kaiser-windowed sinc). It keeps the tail of the previous
+# chunk as filter history, so audio can be fed in chunks of any size and comes out as
+# one continuous stream. The device streams stay open at one fixed rate, and a change
+# of server rate only means building a new resampler.
+#
+# The input, the gathered filter windows and the output live in buffers that are
+# allocated for the largest chunk seen so far and reused, so converting a chunk of the
+# same size again allocates no audio buffers. process_into() writes the result into the
+# caller's int16 array (a pooled microphone frame); process() returns new bytes.
+
+import functools
+import math
+
+import numpy as np
+
+# Filter length in samples of the lower rate; more taps give a sharper anti-aliasing
+# filter (flat to about 0.7 of the lower Nyquist frequency with 24)
+FILTER_TAPS = 24
+# Kaiser window shape; about 80 dB of stopband attenuation
+KAISER_BETA = 8.0
+# Passband edge as a fraction of the lower Nyquist frequency
+ROLLOFF = 0.92
+
+
+# Polyphase filter bank for upsampling by up and downsampling by down. Row p holds the
+# taps of branch p, reversed so they line up with a window of input samples.
+@functools.lru_cache(maxsize=16)
+def design_filter_bank(up, down, filter_taps=FILTER_TAPS, beta=KAISER_BETA, rolloff=ROLLOFF):
+    # When decimating, the branches must span more input samples to keep the same
+    # transition band relative to the output rate
+    taps_per_phase = math.ceil(filter_taps * max(up, down) / up)
+    length = taps_per_phase * up
+    cutoff = rolloff * 0.5 / max(up, down)  # Cycles per sample at the upsampled rate
+    t = np.arange(length) - (length - 1) / 2
+    prototype = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(length, beta)
+    # Unity gain for every branch after upsampling
+    prototype *= up / prototype.sum()
+    bank = prototype.reshape(taps_per_phase, up).T
+    return np.ascontiguousarray(bank[:, ::-1], dtype=np.float32)
+
+
+class StreamingResampler:
+    def __init__(self, in_rate, out_rate, channels=1, filter_taps=FILTER_TAPS):
+        divisor = math.gcd(int(in_rate), int(out_rate))
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.channels = channels
+        self.up = int(out_rate) // divisor
+        self.down = int(in_rate) // divisor
+        self.passthrough = self.up == self.down
+        self.taps = 1
+        if not self.passthrough:
+            self._bank = design_filter_bank(self.up, self.down, filter_taps)
+            self.taps = self._bank.shape[1]
+        self.reset()
+
+    # Start a new stream (drops the filter history)
+    def reset(self):
+        self._allocate(0)
+        # Position of the next output sample, in upsampled samples from the start of
+        # the history
+        self._position = (self.taps - 1) * self.up
+
+    # Buffers for chunks of up to `samples` samples per channel; the filter history
+    # (the first taps - 1 rows of _buf) is kept
+    def _allocate(self, samples):
+        history = self._buf[:self.taps - 1] if getattr(self, "_buf", None) is not None else None
+        self._capacity = samples
+        channels = self.channels
+        self._buf = np.zeros((self.taps - 1 + samples, channels), dtype=np.float32)
+        if history is not None:
+            self._buf[:self.taps - 1] = history
+        self._flat = self._buf.reshape(-1)
+        # Outputs per chunk, at most
+        count = (samples * self.up) // self.down + 2
+        self._steps = self.down * np.arange(count)
+        self._starts = np.empty(count, dtype=np.intp)
+        self._phases = np.empty(count, dtype=np.intp)
+        # Element k, c, j of the window gather is input sample start_k + j of channel c,
+        # at flat index start_k * channels + _ramp[k, c, j]
+        offsets = np.arange(self.taps) * channels + np.arange(channels)[:, None]
+        self._ramp = np.ascontiguousarray(np.broadcast_to(offsets, (count, channels, self.taps)))
+        self._index = np.empty((count, channels, self.taps), dtype=np.intp)
+        self._windows = np.empty((count, channels, self.taps), dtype=np.float32)
+        self._branches = np.empty((count, self.taps), dtype=np.float32)
+        self._out = np.empty((count, channels), dtype=np.float32)
+        # 0-d operands, so the ufuncs don't convert Python ints on every call
+        self._origin = np.zeros((), dtype=np.intp)
+        self._up = np.full((), self.up, dtype=np.intp)
+        self._history = np.full((), self.taps - 1, dtype=np.intp)
+        self._channels = np.full((), channels, dtype=np.intp)
+        self._low = np.full((), -32768, dtype=np.float32)
+        self._high = np.full((), 32767, dtype=np.float32)
+        # Views of the buffers by chunk size and by output count, made once each
+        self._input_views = {}
+        self._output_views = {}
+
+    # Where a chunk of `samples` samples per channel goes in _buf, and where the history
+    # for the next chunk starts
+    def _input_view(self, samples):
+        views = self._input_views.get(samples)
+        if views is None:
+            history = self.taps - 1
+            views = (self._flat[history * self.channels:(history + samples) * self.channels],
+                     self._buf[:history], self._buf[samples:samples + history])
+            self._input_views[samples] = views
+        return views
+
+    def _output_view(self, count):
+        views = self._output_views.get(count)
+        if views is None:
+            out = self._out[:count]
+            views = (self._steps[:count], self._starts[:count], self._phases[:count],
+                     self._index[:count], self._ramp[:count], self._starts[:count, None, None],
+                     self._windows[:count], self._branches[:count], self._branches[:count, :, None],
+                     out, out[:, :, None], out.reshape(-1))
+            self._output_views[count] = views
+        return views
+
+    # Input-to-output delay of the filter in seconds
+    def latency(self):
+        if self.passthrough:
+            return 0.0
+        return (self.taps * self.up - 1) / 2 / (self.up * self.in_rate)
+
+    # Convert a chunk of interleaved int16 samples (bytes-like or an int16 array);
+    # returns a flat float32 view of the output in _out, valid until the next call
+    def _convert(self, data):
+        samples = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=np.int16)
+        frames = len(samples) // self.channels
+        if frames > self._capacity:
+            self._allocate(frames)
+        chunk, history, tail = self._input_view(frames)
+        np.copyto(chunk, samples)
+        length = len(history) + frames
+
+        # Every output whose newest input sample has arrived
+        count = max(0, (length * self.up - 1 - self._position) // self.down + 1)
+        steps, starts, phases, index, ramp, start_columns, windows, branches, branch_columns, \
+            out, out_columns, converted = self._output_view(count)
+        self._origin.fill(self._position)
+        np.add(steps, self._origin, out=starts)
+        np.remainder(starts, self._up, out=phases)
+        # Newest input sample of each output, then the flat index of its window's first
+        np.floor_divide(starts, self._up, out=starts)
+        np.subtract(starts, self._history, out=starts)
+        np.multiply(starts, self._channels, out=starts)
+
+        # Output k is the dot product of the taps of its branch with the taps-long
+        # window of input that ends at its newest sample. Gathering by flat index from
+        # the contiguous buffer keeps np.take from copying its source, and the index is
+        # built without broadcasting in a ufunc, which would allocate iterator buffers.
+        np.copyto(index, start_columns)
+        np.add(index, ramp, out=index)
+        np.take(self._flat, index, out=windows, mode="clip")
+        np.take(self._bank, phases, axis=0, out=branches, mode="clip")
+        np.matmul(windows, branch_columns, out=out_columns)
+
+        # Keep the last taps - 1 samples as history for the next chunk
+        self._position += count * self.down - frames * self.up
+        history[...] = tail
+
+        np.rint(out, out=out)
+        np.minimum(out, self._high, out=out)
+        np.maximum(out, self._low, out=out)
+        return converted
+
+    # Convert a chunk of interleaved int16 samples; returns the converted bytes
+    def process(self, data):
+        if self.passthrough:
+            return data
+        return self._convert(data).astype(np.int16).tobytes()
+
+    # Convert a chunk (bytes-like or an int16 array) into `out`, a writable int16 array,
+    # cutting off anything past its end; returns the number of bytes written
+    def process_into(self, data, out):
+        if self.passthrough:
+            samples = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=np.int16)
+            n = min(len(samples), len(out))
+            out[:n] = samples[:n]
+            return 2 * n
+        converted = self._convert(data)
+        n = min(len(converted), len(out))
+        np.copyto(out[:n] if n < len(out) else out, converted[:n] if n < len(converted) else converted,
+                  casting="unsafe")
+        return 2 * n
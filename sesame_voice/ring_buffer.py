@@ -0,0 +1,64 @@
+# Preallocated byte ring buffer for passing audio between one producer and one consumer
+#
+# Only the producer advances the write position and only the consumer advances the
+# read position, so no lock is needed: each position is a single attribute assignment.
+
+
+class RingBuffer:
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("Ring buffer capacity must be positive")
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        # Monotonic byte counters; the fill level is their difference
+        self._write_pos = 0
+        self._read_pos = 0
+
+    def available(self):
+        return self._write_pos - self._read_pos
+
+    def free(self):
+        return self.capacity - self.available()
+
+    # Producer side: copy as much of data as fits, return the number of bytes written
+    def write(self, data):
+        src = memoryview(data).cast('B')
+        n = min(len(src), self.free())
+        if n == 0:
+            return 0
+
+        start = self._write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self._view[start:start + first] = src[:first]
+        if n > first:
+            self._view[0:n - first] = src[first:n]
+
+        self._write_pos += n
+        return n
+
+    # Consumer side: copy up to len(out) bytes into out, return the number of bytes read
+    def read_into(self, out):
+        dst = out if isinstance(out, memoryview) and out.format == 'B' else memoryview(out).cast('B')
+        n = min(len(dst), self.available())
+        if n == 0:
+            return 0
+
+        start = self._read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        dst[:first] = self._view[start:start + first]
+        if n > first:
+            dst[first:n] = self._view[0:n - first]
+
+        self._read_pos += n
+        return n
+
+    # Consumer side: read up to n bytes into a new bytes object
+    def read(self, n):
+        out = bytearray(min(n, self.available()))
+        self.read_into(out)
+        return bytes(out)
+
+    # Consumer side: discard everything currently buffered
+    def clear(self):
+        self._read_pos = self._write_pos
@@ -0,0 +1,1449 @@
+# One voice conversation: websocket connection, audio streams, and the capture,
+# playback, connection and stats loops that keep it running
+#
+# A Session owns all of its state and counters, so any number of them can run in one
+# process. Each session runs either on its own worker threads ("threads" engine) or as
+# tasks on an asyncio event loop ("asyncio" engine); SessionManager runs many at once.
+
+import asyncio
+import copy
+import functools
+import logging
+import math
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from sesame_voice.audio_io import AudioIOStats, flush_output, read_into
+from sesame_voice.autotune import CHUNK_CANDIDATES, ChunkTuner
+from sesame_voice.barge_in import BargeIn
+from sesame_voice.dsp import FrameAnalyzer
+from sesame_voice.frame_pool import Frame, FramePool
+from sesame_voice.health import StreamHealthMonitor
+from sesame_voice.jitter_buffer import JitterBuffer
+from sesame_voice.logs import MeterRenderer
+from sesame_voice.metrics import SessionMetrics
+from sesame_voice.recorder import CHARACTER_TRACK, MIC_TRACK, ConversationRecorder
+from sesame_voice.resample import StreamingResampler
+from sesame_voice.tap import AudioTap
+from sesame_voice.tokens import TokenService
+from sesame_voice.tracing import TurnTracker
+from sesame_voice.uplink import UplinkSender
+from sesame_voice.vad import EnergyVAD
+from sesame_voice.watchdog import Heartbeat
+
+logger = logging.getLogger("sesame_voice")
+
+ENGINES = ("threads", "asyncio")
+
+# Frame energy above which the microphone is considered to pick up speech
+SPEECH_ENERGY = 500
+
+
+class SessionConfig:
+    # Connection timings
+    connect_timeout = 5  # Seconds to wait for the connect callback
+    connection_check_interval = 10  # Safety recheck in case a disconnect callback is missed
+    reconnect_backoff_base = 0.5  # Reconnect delays grow from this...
+    reconnect_backoff_cap = 30  # ...up to this, with full jitter
+    playback_idle_timeout = 0.25  # Wait for the first chunk of a response without polling
+
+    # Audio stream health: a stream is reopened when, within health_window seconds, it
+    # reports max_xruns overflows/underruns, max_stream_errors failed calls or
+    # max_stream_stalls calls slower than stream_stall_ms (see health)
+    health_window = 5.0
+    max_xruns = 5
+    max_stream_errors = 3
+    max_stream_stalls = 2
+    stream_stall_ms = 500
+    stream_reset_cooldown = 10.0  # Minimum time between resets of the same stream
+
+    # A hot loop iteration starting more than this past its deadline is a stall (see watchdog)
+    stall_threshold_ms = 100
+
+    def __init__(self, character="Maya", chunk=1024, chunk_autotune=False, chunk_candidates=CHUNK_CANDIDATES,
+                 sample_width=2, channels=1, rate=16000,
+                 mic_rate=None, speaker_rate=48000, engine="threads", jitter_buffer=True, jitter_min_delay_ms=40,
+                 jitter_max_latency_ms=400, jitter_overflow_policy="compress",
+                 jitter_frame_ms=20, hot_standby=False,
+                 uplink_policy="drop_oldest", uplink_queue_frames=50, uplink_coalesce_max=4,
+                 vad=False, vad_hangover_ms=500, vad_preroll_ms=200, vad_keepalive_ms=0,
+                 mic_agc=False, mic_agc_target=3000, mic_noise_gate=0, barge_in=False,
+                 barge_in_energy=1500, barge_in_ms=100, barge_in_resume_ms=300,
+                 suppress_bleed=False, record_path=None,
+                 record_format="wav", tap_path=None, endpoint_url=None, interactive=True):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine} (expected one of {ENGINES})")
+        self.character = character
+        # Connect sesame_ai's client here instead of to the service, e.g. a StandinServer's url
+        self.endpoint_url = endpoint_url
+        self.chunk = chunk
+        # Pick the smallest glitch-free frame size out of chunk_candidates while running,
+        # instead of using chunk (see autotune)
+        self.chunk_autotune = chunk_autotune
+        self.chunk_candidates = chunk_candidates
+        self.sample_width = sample_width
+        self.channels = channels
+        self.rate = rate  # Sample rate of the audio sent to the server
+        # The devices stay open at these rates; audio is resampled to and from the
+        # server rates (mic_rate defaults to rate, i.e. no conversion)
+        self.mic_rate = mic_rate or rate
+        self.speaker_rate = speaker_rate
+        self.engine = engine
+        self.jitter_buffer = jitter_buffer
+        self.jitter_min_delay_ms = jitter_min_delay_ms
+        self.jitter_max_latency_ms = jitter_max_latency_ms
+        self.jitter_overflow_policy = jitter_overflow_policy
+        self.jitter_frame_ms = jitter_frame_ms
+        # Keep a second, already connected websocket to promote when the active one fails
+        self.hot_standby = hot_standby
+        # Microphone frames wait for the network in a bounded queue (see uplink)
+        self.uplink_policy = uplink_policy
+        self.uplink_queue_frames = uplink_queue_frames
+        self.uplink_coalesce_max = uplink_coalesce_max
+        # Only send microphone audio while the user is speaking (see vad)
+        self.vad = vad
+        self.vad_hangover_ms = vad_hangover_ms
+        self.vad_preroll_ms = vad_preroll_ms
+        self.vad_keepalive_ms = vad_keepalive_ms
+        # Automatic gain control and noise gate on microphone frames (see dsp)
+        self.mic_agc = mic_agc
+        self.mic_agc_target = mic_agc_target
+        self.mic_noise_gate = mic_noise_gate
+        # Flush the character's audio when the user talks over it, and optionally
+        # silence speaker bleed in microphone frames while it plays (see barge_in)
+        self.barge_in = barge_in
+        self.barge_in_energy = barge_in_energy
+        self.barge_in_ms = barge_in_ms
+        self.barge_in_resume_ms = barge_in_resume_ms
+        self.suppress_bleed = suppress_bleed
+        # Record both directions of the conversation to this file (see recorder)
+        self.record_path = record_path
+        self.record_format = record_format
+        # Publish both directions to a shared-memory tap for other processes (see tap);
+        # "{session}" in the path is replaced with the session name
+        self.tap_path = tap_path
+        # Print the level meter and speaking indicators to the console
+        self.interactive = interactive
+
+
+# sesame_ai's client (ws_class), pointed at endpoint_url instead of the service when it is
+# set. SesameWebSocket builds its connect URL from websocket_url when connect() is called.
+def sesame_websocket(ws_class, endpoint_url, id_token, character):
+    ws = ws_class(id_token=id_token, character=character)
+    if endpoint_url:
+        ws.websocket_url = endpoint_url
+    return ws
+
+
+# Delay before reconnect attempt number `attempt`: the first retry is immediate, later
+# ones back off exponentially with full jitter so many sessions don't retry in lockstep
+def reconnect_backoff(attempt, base, cap):
+    if attempt <= 1:
+        return 0.0
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+# Prefixes every message with the session name when there is more than one session
+class SessionLogger(logging.LoggerAdapter):
+    def process(self, msg, kwargs):
+        # record.session, for filters such as logs.RateLimitFilter
+        kwargs["extra"] = self.extra
+        if self.extra["session"]:
+            return f"[{self.extra['session']}] {msg}", kwargs
+        return msg, kwargs
+
+
+# Microphone activity tracking and level meter
+class MicActivity:
+    def __init__(self, session):
+        self.session = session
+        self.log = session.log
+
+        # Variables for voice activity visualization
+        self.silent_frames = 0
+        self.speaking_frames = 0
+
+        # Variables for connection management
+        self.last_activity_time = time.time()
+        self.last_heartbeat = time.time()
+
+    # Track the level of a frame measured by the analyzer and update the meter; returns
+    # the frame's energy
+    def update(self, analyzer):
+        energy = analyzer.rms
+        self.session.tracker.mic(energy > SPEECH_ENERGY)
+
+        # Update activity time if there's significant audio
+        if energy > SPEECH_ENERGY:
+            self.last_activity_time = time.time()
+            self.speaking_frames += 1
+            self.silent_frames = 0
+
+            # Only log occasionally to avoid flooding
+            if self.speaking_frames % 10 == 0:
+                self.log.debug(f"Speaking detected. Energy level: {energy:.1f}")
+
+            # Visual representation of audio level, drawn by the meter thread
+            if self.session.meter:
+                self.session.meter.update(analyzer.level, energy)
+        else:
+            self.silent_frames += 1
+            self.speaking_frames = 0
+
+            # Log silence periods (occasionally)
+            if self.silent_frames % 100 == 0 and self.silent_frames > 0:
+                self.log.debug(f"Silence continues. Frames: {self.silent_frames}")
+
+        return energy
+
+    # Heartbeat logging
+    def housekeeping(self):
+        current_time = time.time()
+
+        # Send a heartbeat ping if there's been no activity
+        if current_time - self.last_heartbeat > 5:  # Heartbeat every 5 seconds
+            self.log.debug("Sending regular heartbeat ping")
+            self.last_heartbeat = current_time
+
+            # If there's been no activity for a while, log it
+            if current_time - self.last_activity_time > 10:
+                self.log.info("No audio activity detected for 10+ seconds")
+
+
+# Speaking indicators and the jitter buffer for received audio
+class PlaybackState:
+    def __init__(self, session):
+        self.session = session
+        self.log = session.log
+        self.jitter_buffer = session.jitter_buffer
+        self.tracker = session.tracker
+        self.barge_in = session.barge_in
+        self.stream_ws = None
+        self.resampler = None
+        self.playout_frame_bytes = 0
+        self.write_time = 0.0  # Length of the last speaker write, in seconds
+
+    # How long to wait for the next chunk; don't wait while the jitter buffer has audio
+    # ready to play, and only poll quickly while a response is in progress
+    def poll_timeout(self, idle_timeout):
+        jitter_buffer = self.jitter_buffer
+        if jitter_buffer and jitter_buffer.ready():
+            return 0
+        if self.tracker.character_speaking or (jitter_buffer and jitter_buffer.depth_ms()):
+            return 0.01
+        if self.barge_in and self.barge_in.discarding:
+            return min(idle_timeout, self.barge_in.resume / 4)
+        return idle_timeout
+
+    # Receive and play whatever audio is available; returns how long to back off
+    # after an error (0 on success)
+    def step(self, ws, idle_timeout):
+        session = self.session
+        config = session.config
+        jitter_buffer = self.jitter_buffer
+
+        # Start a fresh jitter buffer and resampler at the server rate for every new connection
+        if self.stream_ws is not ws:
+            server_rate = getattr(ws, 'server_sample_rate', 16000)
+            if jitter_buffer:
+                jitter_buffer.reset(server_rate)
+                self.playout_frame_bytes = int(server_rate * config.jitter_frame_ms / 1000) * config.sample_width * config.channels
+            if self.resampler is None or self.resampler.in_rate != server_rate:
+                self.log.info(f"Playing {server_rate}Hz server audio on a {config.speaker_rate}Hz speaker stream")
+            self.resampler = StreamingResampler(server_rate, config.speaker_rate, config.channels)
+            self.stream_ws = ws
+
+        barge_in = self.barge_in
+        if barge_in and barge_in.pending:
+            self.interrupt(ws)
+
+        # Waits up to the poll timeout, then plays about a frame
+        timeout = self.poll_timeout(idle_timeout)
+        session.heartbeats["playback"].beat(timeout + self.write_time)
+
+        # Get audio with timeout and error handling
+        try:
+            audio_chunk = ws.get_next_audio_chunk(timeout=timeout)
+        except Exception as e:
+            if "timeout" not in str(e).lower():
+                self.log.warning(f"Error getting audio chunk: {e}")
+            return 0.01
+
+        if barge_in and barge_in.discarding:
+            # The rest of the interrupted reply
+            while audio_chunk:
+                session.bytes_received += len(audio_chunk)
+                barge_in.discarded(len(audio_chunk))
+                audio_chunk = ws.get_next_audio_chunk(timeout=0)
+            if barge_in.idle():
+                self.log.info("Interrupted reply ended, playing the next one")
+        elif audio_chunk:
+            if self.tracker.audio_received():
+                self.log.info("Character started speaking")
+                if config.interactive:
+                    print("\n→ Receiving audio from character...")
+
+            if jitter_buffer:
+                # Move everything that has arrived into the jitter buffer
+                while audio_chunk:
+                    session.bytes_received += len(audio_chunk)
+                    jitter_buffer.push(audio_chunk)
+                    audio_chunk = ws.get_next_audio_chunk(timeout=0)
+            else:
+                session.bytes_received += len(audio_chunk)
+                self.play(audio_chunk)
+        elif self.tracker.playback_idle(jitter_buffer is not None and jitter_buffer.depth_ms() > 0):
+            # Nothing received or played for character_end_ms
+            self.log.info("Character finished speaking")
+            if config.interactive:
+                print("← Character finished speaking")
+
+        # Play the next frame from the jitter buffer
+        if jitter_buffer:
+            frame = jitter_buffer.pop(self.playout_frame_bytes)
+            if frame:
+                session.metrics.playback_depth.observe(jitter_buffer.depth_ms())
+                self.tracker.played()
+                self.play(frame)
+
+        # The frame size changed (see Session.apply_chunk); switch callback streams between replies
+        if session.speaker_chunk not in (None, config.chunk) and not self.tracker.character_speaking:
+            session.reopen_speaker_stream()
+        session.check_speaker_health()
+        return 0
+
+    # The user talked over the character: drop every bit of its audio queued on this
+    # side (jitter buffer, websocket receive queue, speaker ring) at once
+    def interrupt(self, ws):
+        session = self.session
+        flushed = self.jitter_buffer.flush() if self.jitter_buffer else 0
+        audio_chunk = ws.get_next_audio_chunk(timeout=0)
+        while audio_chunk:
+            session.bytes_received += len(audio_chunk)
+            flushed += len(audio_chunk)
+            audio_chunk = ws.get_next_audio_chunk(timeout=0)
+        speaker_flushed = flush_output(session.speaker_stream)
+        self.resampler.reset()
+
+        now = time.monotonic()
+        started = self.barge_in.flushed(flushed, now)
+        self.tracker.interrupted(started, now)
+        config = session.config
+        frame_bytes = config.sample_width * config.channels
+        queued_ms = 1000 * (flushed / (self.resampler.in_rate * frame_bytes) +
+                            speaker_flushed / (config.speaker_rate * frame_bytes))
+        self.log.info(f"Barge-in: flushed {queued_ms:.0f}ms of character audio "
+                      f"{(now - started) * 1000:.0f}ms after you started speaking")
+        if config.interactive:
+            print("← Character interrupted")
+
+    # Convert server audio to the speaker rate and play it
+    def play(self, audio):
+        barge_in = self.barge_in
+        if barge_in:
+            if barge_in.pending:
+                # Don't start a frame that is about to be flushed
+                return
+            barge_in.played()
+        recorder = self.session.recorder
+        if recorder:
+            recorder.record(CHARACTER_TRACK, audio, self.resampler.in_rate)
+        config = self.session.config
+        played = self.resampler.process(audio)
+        start = time.monotonic()
+        if played:
+            self.write_time = len(played) / (config.speaker_rate * config.sample_width * config.channels)
+            # Play audio with error handling
+            health = self.session.health
+            try:
+                self.session.speaker_stream.write(played)
+            except Exception as e:
+                health.record_write(time.monotonic() - start, error=True)
+                self.log.error(f"Error playing audio: {e}")
+            else:
+                health.record_write(time.monotonic() - start)
+        # Published after the device write so the speaker never waits for the tap,
+        # stamped with the time the audio was handed to the device
+        tap = self.session.tap
+        if tap:
+            tap.publish(CHARACTER_TRACK, audio, self.resampler.in_rate, config.channels, start)
+
+
+class Session:
+    # id_token is a fixed token or a TokenService; backend opens the audio streams (see
+    # audio_io); ws_factory builds the websocket and defaults to sesame_ai's SesameWebSocket
+    def __init__(self, id_token, backend, config=None, name="", input_device_index=None,
+                 ws_factory=None):
+        self.id_token = id_token
+        self.backend = backend
+        self.config = config or SessionConfig()
+        if self.config.chunk_autotune:
+            # The frame size changes while this session runs, but not under other sessions
+            # sharing the config; it starts at the smallest candidate
+            self.config = copy.copy(self.config)
+            self.config.chunk = min(self.config.chunk_candidates)
+        self.name = name
+        self.input_device_index = input_device_index
+        self.log = SessionLogger(logger, {"session": name})
+
+        if ws_factory is None:
+            from sesame_ai import SesameWebSocket
+            ws_factory = SesameWebSocket
+            if self.config.endpoint_url:
+                ws_factory = functools.partial(sesame_websocket, SesameWebSocket, self.config.endpoint_url)
+        self.ws_factory = ws_factory
+
+        # Connection state
+        self.active = True
+        self.current_ws = None
+        self.standby_ws = None
+        self._standby_pending = False
+        self._lost_at = None
+        # Initial connection started early by preconnect(), joined by the engines
+        self._preconnect = None
+        self._stopped = threading.Event()
+        self._ws_ready = threading.Event()
+        self._first_frame_sent = threading.Event()
+        # Wakes the connection monitor; the asyncio engine replaces this while it runs
+        self._monitor_wake = threading.Event()
+        self._wake_monitor = self._monitor_wake.set
+
+        # Per-session counters
+        self.reconnect_count = 0
+        self.failover_count = 0
+        self.failover_times_ms = []
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Startup milestones (time.monotonic()): first live connection, first frame sent
+        self.first_connected_at = None
+        self.first_frame_sent_at = None
+        self.io_stats = AudioIOStats()
+        config = self.config
+        self.health = StreamHealthMonitor(self.io_stats, window=config.health_window,
+                                          max_xruns=config.max_xruns,
+                                          max_errors=config.max_stream_errors,
+                                          max_stalls=config.max_stream_stalls,
+                                          stall_ms=max(config.stream_stall_ms,
+                                                       4000 * config.chunk / config.mic_rate),
+                                          cooldown=config.stream_reset_cooldown)
+
+        self.analyzer = FrameAnalyzer(self.config.chunk * self.config.channels,
+                                      agc=self.config.mic_agc,
+                                      agc_target=self.config.mic_agc_target,
+                                      noise_gate=self.config.mic_noise_gate)
+
+        self.uplink = UplinkSender(self, max_frames=self.config.uplink_queue_frames,
+                                   policy=self.config.uplink_policy,
+                                   coalesce_max=self.config.uplink_coalesce_max)
+
+        # Latency histograms and counters for the metrics endpoint (see metrics)
+        self.metrics = SessionMetrics(self)
+        # Turn timeline: user speech, think time, playback and reconnect spans (see tracing)
+        self.tracker = TurnTracker(self.metrics)
+        # Hot loop heartbeats for the stall watchdog (see watchdog)
+        self.heartbeats = {loop: Heartbeat(loop, config.stall_threshold_ms, self.metrics.loop_stalls.histogram(loop))
+                           for loop in ("capture", "playback", "uplink")}
+
+        self.recorder = None
+        if self.config.record_path:
+            self.recorder = ConversationRecorder(self.config.record_path, self.config.rate,
+                                                 channels=self.config.channels,
+                                                 format=self.config.record_format)
+
+        self.tap = None
+        if self.config.tap_path:
+            self.tap = AudioTap(self.config.tap_path.format(session=name or "session"))
+
+        # Level meter on the console, repainted from its own thread
+        self.meter = MeterRenderer() if self.config.interactive else None
+
+        self.vad = None
+        if self.config.vad:
+            self.vad = EnergyVAD(1000 * self.config.chunk / self.config.mic_rate,
+                                 threshold=SPEECH_ENERGY,
+                                 hangover_ms=self.config.vad_hangover_ms,
+                                 preroll_ms=self.config.vad_preroll_ms,
+                                 keepalive_ms=self.config.vad_keepalive_ms,
+                                 discard=Frame.release)
+
+        self.barge_in = None
+        if self.config.barge_in or self.config.suppress_bleed:
+            # Bleed suppression alone never flushes: no interruption lasts long enough
+            self.barge_in = BargeIn(1000 * self.config.chunk / self.config.mic_rate,
+                                    energy=self.config.barge_in_energy,
+                                    min_ms=self.config.barge_in_ms if self.config.barge_in else math.inf,
+                                    resume_ms=self.config.barge_in_resume_ms,
+                                    suppress_bleed=self.config.suppress_bleed,
+                                    metrics=self.metrics)
+
+        self.mic_stream = None
+        self.speaker_stream = None
+        self.speaker_chunk = None  # Buffer size of the speaker stream, None if writes take any size
+        self.mic_resampler = StreamingResampler(self.config.mic_rate, self.config.rate, self.config.channels)
+
+        # Microphone frames are read into pooled buffers and passed along by reference
+        # (see frame_pool). The pool covers a full uplink queue, a message being sent,
+        # the VAD pre-roll and the frame being captured. Resampled frames can be a
+        # sample longer than chunk * rate / mic_rate; they are read into mic_buffer first
+        # and converted straight into the frame.
+        # With autotune, buffers fit the largest frame size (and the pre-roll is counted
+        # in the smallest frames, which it starts at).
+        max_chunk = max(config.chunk_candidates) if config.chunk_autotune else config.chunk
+        frame_bytes = config.sample_width * config.channels
+        self.mic_buffer = Frame(None, max_chunk * frame_bytes)
+        frame_samples = max_chunk
+        if not self.mic_resampler.passthrough:
+            frame_samples = math.ceil(max_chunk * config.rate / config.mic_rate) + 1
+        self.frame_pool = FramePool(frame_samples * frame_bytes,
+                                    config.uplink_queue_frames + config.uplink_coalesce_max + 2 +
+                                    (self.vad.preroll_frames if self.vad else 0))
+
+        self.jitter_buffer = None
+        if self.config.jitter_buffer:
+            self.jitter_buffer = JitterBuffer(16000,
+                                              sample_width=self.config.sample_width,
+                                              channels=self.config.channels,
+                                              min_delay_ms=self.config.jitter_min_delay_ms,
+                                              max_latency_ms=self.config.jitter_max_latency_ms,
+                                              overflow_policy=self.config.jitter_overflow_policy)
+
+        self.chunk_tuner = None
+        if self.config.chunk_autotune:
+            self.chunk_tuner = ChunkTuner(self, self.config.chunk_candidates)
+
+        self.start_time = time.time()
+        self._threads = []
+
+        # asyncio engine state, created by run_async()
+        self._loop = None
+        self._executor = None
+        self._shutdown = None
+        self._connected = None
+        self._disconnected = None
+
+    # Functions to open the audio streams through the backend
+    def open_mic_stream(self, device_index=None):
+        config = self.config
+        self.mic_resampler.reset()
+        return self.backend.open_input(config.sample_width, config.channels, config.mic_rate, config.chunk,
+                                       input_device_index=device_index, stats=self.io_stats)
+
+    def open_speaker_stream(self):
+        config = self.config
+        stream = self.backend.open_output(config.sample_width, config.channels, config.speaker_rate, config.chunk,
+                                          stats=self.io_stats)
+        # Only callback streams are opened with a fixed buffer; blocking streams ignore
+        # frames_per_buffer, so a frame size change never needs to reopen them
+        self.speaker_chunk = getattr(stream, "frames_per_buffer", None)
+        return stream
+
+    def open_streams(self):
+        # Open microphone stream with selected device
+        try:
+            self.mic_stream = self.open_mic_stream(self.input_device_index)
+            self.log.info(f"Successfully connected to selected microphone (Device ID: {self.input_device_index})")
+        except Exception as e:
+            self.log.error(f"Error connecting to selected microphone: {e}")
+            self.log.debug(traceback.format_exc())
+            self.log.info("Falling back to default microphone...")
+            try:
+                self.mic_stream = self.open_mic_stream()
+                self.log.info("Connected to default microphone")
+            except Exception as e:
+                self.log.critical(f"Failed to open any microphone: {e}")
+                self.log.debug(traceback.format_exc())
+                raise
+
+        # Open speaker stream
+        try:
+            self.speaker_stream = self.open_speaker_stream()
+            self.log.info(f"Speaker stream opened successfully at {self.config.speaker_rate}Hz")
+        except Exception as e:
+            self.log.critical(f"Failed to open speaker: {e}")
+            self.log.debug(traceback.format_exc())
+            raise
+
+    # Token for a new connection, already valid and served from memory
+    def current_token(self):
+        if isinstance(self.id_token, TokenService):
+            return self.id_token.get_token()
+        return self.id_token
+
+    # Create a websocket and start connecting it. on_state(ws, connected) is called from
+    # the websocket's own thread when the connection opens or closes.
+    def create_connection(self, on_state=None):
+        character = self.config.character
+        self.log.info("Setting up new WebSocket connection")
+
+        # Set up WebSocket connection
+        ws = self.ws_factory(id_token=self.current_token(), character=character)
+
+        # Connection callbacks
+        def on_connect():
+            self.log.info(f"Connected to {character}! Start speaking...")
+            if on_state:
+                on_state(ws, True)
+
+        def on_disconnect():
+            self.log.info(f"Disconnected from {character}")
+            if on_state:
+                on_state(ws, False)
+
+        ws.set_connect_callback(on_connect)
+        ws.set_disconnect_callback(on_disconnect)
+
+        # Connect to the server
+        self.log.info(f"Connecting to {character}...")
+        try:
+            ws.connect()
+        except Exception as e:
+            self.log.error(f"Connection error: {e}")
+            self.log.debug(traceback.format_exc())
+            return None
+
+        return ws
+
+    # Make an established websocket the current connection
+    def register_connection(self, ws):
+        if ws and ws.is_connected():
+            self.log.info(f"Successfully connected to {self.config.character}")
+            self.current_ws = ws
+            self.reconnect_count += 1
+            if self.first_connected_at is None:
+                self.first_connected_at = time.monotonic()
+            self.log.info(f"Connection established. Reconnect count: {self.reconnect_count}")
+
+            # Time from noticing the failure to having a live connection again
+            if self._lost_at is not None:
+                failover_ms = (time.monotonic() - self._lost_at) * 1000
+                self.failover_times_ms.append(failover_ms)
+                self.metrics.reconnect_duration.observe(failover_ms / 1000)
+                self.tracker.reconnect(self._lost_at, reconnect=self.reconnect_count)
+                self.log.info(f"Connection restored {failover_ms:.0f}ms after it was lost")
+                self._lost_at = None
+
+            self._ws_ready.set()
+            return ws
+        else:
+            self.log.error("Failed to connect. Will retry...")
+            return None
+
+    # Runs on the websocket's thread: note that a connection went away and wake the monitor
+    def note_disconnect(self, ws):
+        if ws is self.current_ws:
+            if self._lost_at is None:
+                self._lost_at = time.monotonic()
+            self._ws_ready.clear()
+            self._wake_monitor()
+        elif ws is self.standby_ws:
+            self.log.warning("Hot standby connection lost")
+            self._wake_monitor()
+
+    # Create a websocket and wait for its connect callback; returns it once connected
+    def connect_new(self):
+        opened = threading.Event()
+
+        def on_state(ws, connected):
+            if connected:
+                opened.set()
+            else:
+                self.note_disconnect(ws)
+
+        ws = self.create_connection(on_state)
+        if ws is None:
+            return None
+
+        # Wait for connection to establish
+        if not opened.wait(self.config.connect_timeout):
+            self.log.warning(f"No connect callback within {self.config.connect_timeout} seconds")
+        if not ws.is_connected():
+            self.disconnect_stale(ws)
+            return None
+        return ws
+
+    # Create and set up a new websocket connection
+    def setup_connection(self):
+        return self.register_connection(self.connect_new())
+
+    # Start the initial connection on a background thread, e.g. while the audio devices
+    # are still being opened. Whichever engine runs the session waits for it instead of
+    # connecting again.
+    def preconnect(self):
+        if self._preconnect is None:
+            self._preconnect = threading.Thread(target=self.initial_connection, name="preconnect", daemon=True)
+            self._preconnect.start()
+
+    def initial_connection(self):
+        self.log.info("Establishing initial connection...")
+        try:
+            self.current_ws = self.setup_connection()
+        except Exception as e:
+            # No token, for one; the connection monitor keeps retrying
+            self.log.error(f"Initial connection failed: {e}")
+            self.log.debug(traceback.format_exc())
+
+    # Connect a hot standby websocket in the background if one is wanted and missing
+    def start_standby(self):
+        if not self.config.hot_standby or not self.active:
+            return
+        if self.standby_ws is not None and self.standby_ws.is_connected():
+            return
+        if self._standby_pending:
+            return
+        self._standby_pending = True
+        threading.Thread(target=self.prepare_standby, daemon=True).start()
+
+    def prepare_standby(self):
+        try:
+            stale = self.standby_ws
+            self.standby_ws = None
+            if stale:
+                self.disconnect_stale(stale)
+
+            self.log.info("Preparing hot standby connection")
+            ws = self.connect_new()
+            if ws is None:
+                return
+            if not self.active:
+                ws.disconnect()
+                return
+            self.standby_ws = ws
+            self.log.info("Hot standby connection ready")
+        except Exception as e:
+            self.log.error(f"Error preparing hot standby connection: {e}")
+            self.log.debug(traceback.format_exc())
+        finally:
+            self._standby_pending = False
+
+    # Replace a failed connection with the standby if one is ready; returns True if it was
+    # promoted. Never blocks: the failed websocket is closed in the background.
+    def promote_standby(self):
+        standby = self.standby_ws
+        self.standby_ws = None
+        if standby is None or not standby.is_connected():
+            return False
+
+        failed = self.current_ws
+        self.log.info("Promoting hot standby connection")
+        self.register_connection(standby)
+        self.failover_count += 1
+        if failed:
+            threading.Thread(target=self.disconnect_stale, args=(failed,), daemon=True).start()
+        return True
+
+    # Disconnect a stale websocket before reconnecting
+    def disconnect_stale(self, ws):
+        try:
+            ws.disconnect()
+            self.log.info("Successfully disconnected old connection")
+        except Exception as e:
+            self.log.warning(f"Error disconnecting: {e}")
+
+    # Reopen the microphone stream; runs on the capture loop, which owns the stream
+    def reset_mic_stream(self, reason):
+        self.log.warning(f"Resetting microphone stream: {reason}")
+        # Brief pause between closing and reopening
+        self.reopen_mic_stream(pause=0.1)
+
+    # Close and reopen the microphone stream with the current settings; runs on the
+    # capture loop, which owns the stream
+    def reopen_mic_stream(self, pause=0.0):
+        log = self.log
+        try:
+            self.mic_stream.stop_stream()
+            self.mic_stream.close()
+            log.info("Microphone stream closed")
+        except Exception as e:
+            log.warning(f"Error closing microphone stream: {e}")
+
+        if pause:
+            time.sleep(pause)
+
+        try:
+            self.mic_stream = self.open_mic_stream(self.input_device_index)
+            log.info("Microphone stream reopened successfully")
+        except Exception as e:
+            log.error(f"Error reopening microphone: {e}")
+            log.debug(traceback.format_exc())
+            # Fall back to the default microphone; if that fails too, the failing reads
+            # trigger another reset once the cooldown has passed
+            try:
+                self.mic_stream = self.open_mic_stream()
+                log.info("Connected to default microphone")
+            except Exception as e2:
+                log.critical(f"Failed to reopen any microphone: {e2}")
+
+    # Reopen the speaker stream; runs on the playback loop, which owns the stream
+    def reset_speaker_stream(self, reason):
+        self.log.warning(f"Resetting speaker stream: {reason}")
+        self.reopen_speaker_stream(pause=0.1)
+
+    # Close and reopen the speaker stream with the current settings; runs on the
+    # playback loop, which owns the stream
+    def reopen_speaker_stream(self, pause=0.0):
+        log = self.log
+        try:
+            self.speaker_stream.stop_stream()
+            self.speaker_stream.close()
+            log.info("Speaker stream closed")
+        except Exception as e:
+            log.warning(f"Error closing speaker stream: {e}")
+
+        if pause:
+            time.sleep(pause)
+
+        try:
+            self.speaker_stream = self.open_speaker_stream()
+            log.info("Speaker stream reopened successfully")
+        except Exception as e:
+            log.critical(f"Failed to reopen speaker: {e}")
+            log.debug(traceback.format_exc())
+
+    # Reset the microphone stream if the health monitor says it is faulty
+    def check_mic_health(self):
+        reason = self.health.input_reset_reason(self.mic_stream)
+        if reason:
+            self.reset_mic_stream(reason)
+
+    # Reset the speaker stream if the health monitor says it is faulty
+    def check_speaker_health(self):
+        reason = self.health.output_reset_reason(self.speaker_stream)
+        if reason:
+            self.reset_speaker_stream(reason)
+
+    # Switch to frames of `chunk` samples without restarting (see autotune). Runs on the
+    # capture loop, which reopens the microphone stream here; the playback loop reopens a
+    # callback speaker stream once the character is quiet.
+    def apply_chunk(self, chunk):
+        config = self.config
+        if chunk == config.chunk:
+            return
+        frame_ms = 1000 * chunk / config.mic_rate
+        self.log.info(f"Frame size: {config.chunk} -> {chunk} samples ({frame_ms:.0f}ms)")
+        config.chunk = chunk
+        self.health.stall = max(config.stream_stall_ms, 4000 * chunk / config.mic_rate) / 1000
+        if self.vad:
+            self.vad.set_frame_ms(frame_ms)
+        if self.barge_in:
+            self.barge_in.frame = frame_ms / 1000
+        if self.mic_stream is not None:
+            self.reopen_mic_stream()
+
+    # Read and meter one microphone frame and queue it for the uplink sender; returns how
+    # long to back off after an error (0 on success). Never waits for the network.
+    def capture_frame(self, activity):
+        heartbeat = self.heartbeats["capture"]
+        heartbeat.beat(self.config.chunk / self.config.mic_rate)
+        # Read audio data with error handling, straight into a pooled frame
+        frame = self.frame_pool.get()
+        start = time.monotonic()
+        try:
+            if self.mic_resampler.passthrough:
+                frame.size = read_into(self.mic_stream, self.config.chunk, frame.view)
+            else:
+                self.mic_buffer.size = read_into(self.mic_stream, self.config.chunk, self.mic_buffer.view)
+                frame.size = self.mic_resampler.process_into(self.mic_buffer.pcm(), frame.samples)
+        except Exception as e:
+            frame.release()
+            self.health.record_read(time.monotonic() - start, error=True)
+            self.log.warning(f"Error reading from microphone: {e}")
+            self.check_mic_health()
+            heartbeat.pause()
+            return 0.1
+        read_at = time.monotonic()
+        self.health.record_read(read_at - start)
+        # Measured before this frame is queued, so the uplink depth is what is still
+        # waiting from earlier frames
+        chunk = self.chunk_tuner.frame(read_at) if self.chunk_tuner else None
+
+        # Measured (and AGC/gate applied) in place; the frame's reference goes to the
+        # VAD or the uplink
+        self.analyzer.process(frame.pcm())
+        energy = activity.update(self.analyzer)
+        if self.barge_in and self.barge_in.mic(energy):
+            # Speaker bleed: send silence instead
+            frame.pcm().fill(0)
+            energy = 0.0
+        # Recorded as captured, so the track keeps its timing and includes the frames
+        # the VAD holds back or the uplink drops
+        if self.recorder:
+            self.recorder.record(MIC_TRACK, frame.data(), self.config.rate)
+        if self.vad:
+            for queued in self.vad.process(frame, energy):
+                self.uplink.put(queued, silent=not self.vad.speaking)
+        else:
+            self.uplink.put(frame, silent=energy <= SPEECH_ENERGY)
+
+        if chunk:
+            self.apply_chunk(chunk)
+        self.check_mic_health()
+        self.metrics.capture_iteration.observe(time.monotonic() - start)
+        return 0
+
+    def is_connected(self):
+        return self.current_ws is not None and self.current_ws.is_connected()
+
+    # Block until a connection is registered (or the session stops); returns is_connected()
+    def wait_for_connection(self, timeout):
+        self._ws_ready.wait(timeout)
+        return self.is_connected()
+
+    # Block until the first microphone frame has been sent (or the session stops);
+    # returns first_frame_sent_at, None if the session stopped first
+    def wait_for_first_frame(self, timeout=None):
+        self._first_frame_sent.wait(timeout)
+        return self.first_frame_sent_at
+
+    # Capture and send microphone audio
+    def capture_microphone(self):
+        self.log.info("Microphone capture thread started")
+        activity = MicActivity(self)
+
+        try:
+            while self.active:
+                if self.is_connected():
+                    try:
+                        backoff = self.capture_frame(activity)
+                        if backoff:
+                            time.sleep(backoff)
+                            continue
+
+                        activity.housekeeping()
+
+                    except Exception as e:
+                        self.heartbeats["capture"].pause()
+                        self.log.error(f"Error in microphone capture loop: {e}")
+                        self.log.debug(traceback.format_exc())
+                        time.sleep(1)
+                else:
+                    self.heartbeats["capture"].pause()
+                    self.log.warning("Not connected in microphone thread. Waiting...")
+                    self._ws_ready.wait(2)
+        except KeyboardInterrupt:
+            self.log.info("Microphone capture stopped by user")
+        except Exception as e:
+            self.log.error(f"Microphone thread crashed: {e}")
+            self.log.debug(traceback.format_exc())
+        finally:
+            self.heartbeats["capture"].pause()
+            self.log.info("Microphone capture thread ending")
+
+    # Play received audio
+    def play_audio(self):
+        self.log.info("Audio playback thread started")
+        state = PlaybackState(self)
+
+        try:
+            while self.active:
+                if self.is_connected():
+                    try:
+                        backoff = state.step(self.current_ws, 0.01)
+                        if backoff:
+                            self.heartbeats["playback"].pause()
+                            time.sleep(backoff)
+                    except Exception as e:
+                        self.heartbeats["playback"].pause()
+                        if "timeout" not in str(e).lower():  # Ignore timeout exceptions
+                            self.log.error(f"Error in audio playback loop: {e}")
+                            self.log.debug(traceback.format_exc())
+                        time.sleep(0.1)
+                else:
+                    self.heartbeats["playback"].pause()
+                    self.log.warning("Not connected in playback thread. Waiting...")
+                    self._ws_ready.wait(2)
+        except KeyboardInterrupt:
+            self.log.info("Audio playback stopped by user")
+        except Exception as e:
+            self.log.error(f"Playback thread crashed: {e}")
+            self.log.debug(traceback.format_exc())
+        finally:
+            self.heartbeats["playback"].pause()
+            self.log.info("Audio playback thread ending")
+
+    # Maintain the connection: sleeps until a disconnect callback (or a periodic safety
+    # recheck) wakes it, fails over to the hot standby when there is one, and otherwise
+    # reconnects with exponential backoff
+    def connection_monitor(self):
+        config = self.config
+        reconnection_attempts = 0
+        self.log.info("Connection monitor thread started")
+
+        while self.active:
+            self._monitor_wake.clear()
+            try:
+                # Check if connection is still active
+                if not self.is_connected():
+                    # Only a connection we had counts as lost, not the first one
+                    if self._lost_at is None and self.reconnect_count:
+                        self._lost_at = time.monotonic()
+
+                    if self.promote_standby():
+                        reconnection_attempts = 0
+                        self.start_standby()
+                        continue
+
+                    reconnection_attempts += 1
+                    self.log.warning(f"Connection lost or not established. Reconnection attempt {reconnection_attempts}...")
+
+                    delay = reconnect_backoff(reconnection_attempts, config.reconnect_backoff_base,
+                                              config.reconnect_backoff_cap)
+                    if delay:
+                        self.log.info(f"Waiting {delay:.1f}s before reconnecting")
+                        if self._stopped.wait(delay):
+                            break
+
+                    # Try to disconnect cleanly if there's an existing connection
+                    if self.current_ws:
+                        self.disconnect_stale(self.current_ws)
+
+                    # Create a new connection
+                    self.current_ws = self.setup_connection()
+                    self.start_standby()
+                    continue
+                else:
+                    # Connection is good, log status occasionally
+                    if reconnection_attempts > 0:
+                        self.log.info(f"Connection stable after {reconnection_attempts} reconnection attempts")
+                        reconnection_attempts = 0
+                    self.start_standby()
+            except Exception as e:
+                self.log.error(f"Error in connection monitor: {e}")
+                self.log.debug(traceback.format_exc())
+
+            # Sleep until a disconnect is reported
+            self._monitor_wake.wait(config.connection_check_interval)
+
+    # Counters for reporting and benchmarks
+    def stats(self):
+        stats = {
+            "session": self.name,
+            "uptime": time.time() - self.start_time,
+            "reconnects": self.reconnect_count,
+            "failovers": self.failover_count,
+            "input_resets": self.health.input.resets,
+            "output_resets": self.health.output.resets,
+            "frames_sent": self.frames_sent,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "input_overruns": self.io_stats.input_overruns,
+            "output_underruns": self.io_stats.output_underruns,
+            "output_overruns": self.io_stats.output_overruns,
+            "uplink_dropped": self.uplink.dropped_frames,
+            "uplink_coalesced": self.uplink.coalesced_frames,
+            "chunk": self.config.chunk,
+            "loop_stalls": sum(heartbeat.stalls for heartbeat in self.heartbeats.values()),
+        }
+        if self.vad:
+            stats["vad_saved_ratio"] = self.vad.saved_ratio()
+        if self.barge_in:
+            stats["barge_ins"] = self.barge_in.interruptions
+        if self.jitter_buffer:
+            stats["jitter_underruns"] = self.jitter_buffer.underruns
+            stats["jitter_overruns"] = self.jitter_buffer.overruns
+        return stats
+
+    # Log system health statistics
+    def log_system_statistics(self):
+        log = self.log
+        uptime = time.time() - self.start_time
+        log.info(f"System statistics - Uptime: {uptime:.1f}s, Reconnects: {self.reconnect_count}")
+        if self.failover_times_ms:
+            worst = max(self.failover_times_ms)
+            last = self.failover_times_ms[-1]
+            log.info(f"Failovers - Standby promotions: {self.failover_count}, Last recovery: {last:.0f}ms, Worst: {worst:.0f}ms")
+
+        # Check if websocket is connected
+        if self.current_ws:
+            log.info(f"WebSocket connected: {self.current_ws.is_connected()}")
+        else:
+            log.warning("WebSocket not initialized")
+
+        # Check audio streams
+        try:
+            mic_active = self.mic_stream.is_active()
+            speaker_active = self.speaker_stream.is_active()
+            log.info(f"Audio streams - Mic active: {mic_active}, Speaker active: {speaker_active}")
+            log.info(f"Audio I/O - {self.io_stats.summary()}")
+            log.info(f"Stream health - {self.health.summary()}")
+        except:
+            log.warning("Could not check audio stream status")
+
+        log.info(f"Latency - {self.metrics.summary()}")
+        log.info(f"Turns - {self.tracker.summary()}")
+        log.info(f"Microphone - {self.analyzer.summary()}")
+        log.info(f"Uplink - {self.uplink.summary()}")
+        log.info(f"Frame pool - {self.frame_pool.summary()}")
+        for loop, heartbeat in self.heartbeats.items():
+            if heartbeat.stalls:
+                log.info(f"Stalls ({loop} loop) - {heartbeat.summary()}")
+        if self.chunk_tuner:
+            log.info(f"Autotune - {self.chunk_tuner.summary()}")
+        if self.tap:
+            log.info(f"Audio tap - {self.tap.summary()}")
+        if self.vad:
+            log.info(f"Voice activity gate - {self.vad.summary()}")
+        if self.barge_in:
+            log.info(f"Barge-in - {self.barge_in.summary()}")
+
+        if self.jitter_buffer:
+            log.info(f"Jitter buffer - {self.jitter_buffer.summary()}")
+
+        if isinstance(self.id_token, TokenService):
+            log.info(f"Token - {self.id_token.summary()}")
+
+    # Periodically check for system health and log statistics
+    def system_monitor(self):
+        self.log.info("System monitor thread started")
+
+        # Track statistics
+        last_stats_time = time.time()
+
+        while self.active:
+            try:
+                current_time = time.time()
+                # Log stats every minute
+                if current_time - last_stats_time >= 60:
+                    self.log_system_statistics()
+                    last_stats_time = current_time
+            except Exception as e:
+                self.log.error(f"Error in system monitor: {e}")
+
+            # Check every 15 seconds; stop() wakes this straight away
+            if self._stopped.wait(15):
+                break
+
+    # Connect and start the worker threads of the threads engine
+    def start_threads(self):
+        # Initial connection, unless preconnect() already started it
+        if self._preconnect is None:
+            self.initial_connection()
+        else:
+            self._preconnect.join()
+        self.start_standby()
+
+        # Start threads
+        self.log.info("Starting worker threads...")
+        if self.recorder:
+            self.recorder.start()
+        self.uplink.start()
+        if self.meter:
+            self.meter.start()
+        for target in (self.capture_microphone, self.play_audio,
+                       self.connection_monitor, self.system_monitor):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    # asyncio engine: the same loops as the threads above, run as tasks on one event
+    # loop. Device and websocket calls that block run on a small executor; everything
+    # else (connection state changes, stats ticks, shutdown) is an awaited event.
+
+    # Run a blocking call on the session's I/O executor
+    def run_blocking(self, func, *args):
+        return self._loop.run_in_executor(self._executor, func, *args)
+
+    # Wait until any of the events is set or the timeout expires
+    async def wait_any(self, events, timeout=None):
+        waiters = [asyncio.ensure_future(event.wait()) for event in events]
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    # Pause for a while, returning early on shutdown
+    async def wait_for_shutdown(self, timeout):
+        await self.wait_any([self._shutdown], timeout)
+
+    # Runs on the event loop: a websocket reported a disconnect
+    def handle_connection_lost(self):
+        if not self.is_connected():
+            self._connected.clear()
+        self._disconnected.set()
+
+    # Called from websocket threads in place of the threads engine's wake-up event
+    def wake_monitor_async(self):
+        try:
+            self._loop.call_soon_threadsafe(self.handle_connection_lost)
+        except RuntimeError:
+            # Event loop already closed, e.g. the websocket is being closed at shutdown
+            pass
+
+    async def connection_monitor_async(self):
+        config = self.config
+        reconnection_attempts = 0
+        self.log.info("Connection monitor task started")
+
+        if self._preconnect is not None:
+            await self.run_blocking(self._preconnect.join)
+            if self.is_connected():
+                self._connected.set()
+
+        while not self._shutdown.is_set():
+            self._disconnected.clear()
+            try:
+                # Check if connection is still active
+                if not self.is_connected():
+                    self._connected.clear()
+                    # Only a connection we had counts as lost, not the first one
+                    if self._lost_at is None and self.reconnect_count:
+                        self._lost_at = time.monotonic()
+
+                    if self.promote_standby():
+                        self._connected.set()
+                        reconnection_attempts = 0
+                        self.start_standby()
+                        continue
+
+                    reconnection_attempts += 1
+                    self.log.warning(f"Connection lost or not established. Reconnection attempt {reconnection_attempts}...")
+
+                    delay = reconnect_backoff(reconnection_attempts, config.reconnect_backoff_base,
+                                              config.reconnect_backoff_cap)
+                    if delay:
+                        self.log.info(f"Waiting {delay:.1f}s before reconnecting")
+                        await self.wait_for_shutdown(delay)
+                        if self._shutdown.is_set():
+                            break
+
+                    # Try to disconnect cleanly if there's an existing connection
+                    if self.current_ws:
+                        await self.run_blocking(self.disconnect_stale, self.current_ws)
+
+                    # Create a new connection
+                    self.current_ws = await self.run_blocking(self.setup_connection)
+                    if self.current_ws is None:
+                        continue
+
+                    self._connected.set()
+                    self.start_standby()
+                    continue
+                elif reconnection_attempts > 0:
+                    self.log.info(f"Connection stable after {reconnection_attempts} reconnection attempts")
+                    reconnection_attempts = 0
+                self.start_standby()
+
+                # Sleep until the websocket reports a disconnect
+                await self.wait_any([self._disconnected, self._shutdown], config.connection_check_interval)
+            except Exception as e:
+                self.log.error(f"Error in connection monitor: {e}")
+                self.log.debug(traceback.format_exc())
+                await self.wait_for_shutdown(1)
+
+        self.log.info("Connection monitor task ending")
+
+    async def capture_microphone_async(self):
+        self.log.info("Microphone capture task started")
+        activity = MicActivity(self)
+
+        try:
+            while not self._shutdown.is_set():
+                if not self._connected.is_set():
+                    self.heartbeats["capture"].pause()
+                    self.log.warning("Not connected in microphone task. Waiting...")
+                    await self.wait_any([self._connected, self._shutdown])
+                    continue
+
+                try:
+                    backoff = await self.run_blocking(self.capture_frame, activity)
+                    if backoff:
+                        await self.wait_for_shutdown(backoff)
+                        continue
+
+                    activity.housekeeping()
+                except Exception as e:
+                    self.heartbeats["capture"].pause()
+                    self.log.error(f"Error in microphone capture loop: {e}")
+                    self.log.debug(traceback.format_exc())
+                    await self.wait_for_shutdown(1)
+        finally:
+            self.heartbeats["capture"].pause()
+            self.log.info("Microphone capture task ending")
+
+    async def play_audio_async(self):
+        self.log.info("Audio playback task started")
+        state = PlaybackState(self)
+
+        try:
+            while not self._shutdown.is_set():
+                if not self._connected.is_set():
+                    self.heartbeats["playback"].pause()
+                    self.log.warning("Not connected in playback task. Waiting...")
+                    await self.wait_any([self._connected, self._shutdown])
+                    continue
+
+                try:
+                    backoff = await self.run_blocking(state.step, self.current_ws,
+                                                      self.config.playback_idle_timeout)
+                    if backoff:
+                        self.heartbeats["playback"].pause()
+                        await self.wait_for_shutdown(backoff)
+                except Exception as e:
+                    self.heartbeats["playback"].pause()
+                    self.log.error(f"Error in audio playback loop: {e}")
+                    self.log.debug(traceback.format_exc())
+                    await self.wait_for_shutdown(0.1)
+        finally:
+            self.heartbeats["playback"].pause()
+            self.log.info("Audio playback task ending")
+
+    async def system_monitor_async(self):
+        self.log.info("System monitor task started")
+
+        # Log stats every minute until shutdown
+        while not self._shutdown.is_set():
+            await self.wait_for_shutdown(60)
+            if self._shutdown.is_set():
+                break
+            try:
+                self.log_system_statistics()
+            except Exception as e:
+                self.log.error(f"Error in system monitor: {e}")
+
+    # Run the session on the current event loop until stop() is called
+    async def run_async(self):
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix=f"sesame-io-{self.name or 'main'}")
+        self._shutdown = asyncio.Event()
+        self._connected = asyncio.Event()
+        self._disconnected = asyncio.Event()
+        self._wake_monitor = self.wake_monitor_async
+        # The loops' work runs in executor threads; stalls may be on the event loop itself
+        for loop in ("capture", "playback"):
+            self.heartbeats[loop].loop_thread = threading.get_ident()
+        if not self.active:
+            self._shutdown.set()
+
+        self.log.info("Starting engine tasks...")
+        if self.recorder:
+            self.recorder.start()
+        self.uplink.start()
+        if self.meter:
+            self.meter.start()
+        tasks = [self._loop.create_task(task()) for task in (self.connection_monitor_async,
+                                                             self.capture_microphone_async,
+                                                             self.play_audio_async,
+                                                             self.system_monitor_async)]
+        try:
+            await self._shutdown.wait()
+        finally:
+            self._shutdown.set()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Let in-flight device and websocket calls finish before anything is closed
+            self._executor.shutdown(wait=True)
+            self._wake_monitor = self._monitor_wake.set
+            for loop in ("capture", "playback"):
+                self.heartbeats[loop].loop_thread = None
+            self.log.info("All engine tasks stopped")
+
+    # Ask the session to stop; safe to call from any thread
+    def stop(self):
+        self.active = False
+        self._stopped.set()
+        self._ws_ready.set()
+        self._first_frame_sent.set()
+        self._monitor_wake.set()
+        self.uplink.stop()
+        if self.meter:
+            self.meter.stop()
+        if self._loop and self._shutdown:
+            try:
+                self._loop.call_soon_threadsafe(self._shutdown.set)
+            except RuntimeError:
+                # Event loop already closed
+                pass
+
+    # Disconnect and close the audio streams
+    def close(self):
+        self.stop()
+
+        if self.standby_ws:
+            self.disconnect_stale(self.standby_ws)
+            self.standby_ws = None
+
+        if self.current_ws:
+            try:
+                self.current_ws.disconnect()
+                self.log.info("WebSocket disconnected")
+            except Exception as e:
+                self.log.error(f"Error disconnecting WebSocket: {e}")
+
+        if self.mic_stream:
+            try:
+                self.mic_stream.stop_stream()
+                self.mic_stream.close()
+                self.log.info("Microphone stream closed")
+            except Exception as e:
+                self.log.error(f"Error closing microphone stream: {e}")
+
+        if self.speaker_stream:
+            try:
+                self.speaker_stream.stop_stream()
+                self.speaker_stream.close()
+                self.log.info("Speaker stream closed")
+            except Exception as e:
+                self.log.error(f"Error closing speaker stream: {e}")
+
+        if self.recorder:
+            self.recorder.close()
+
+        if self.tap:
+            self.tap.close()
+
+
+# Runs many sessions concurrently in one process. With the asyncio engine all sessions
+# share one event loop; with the threads engine each session runs its own threads.
+class SessionManager:
+    def __init__(self, engine="asyncio"):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine} (expected one of {ENGINES})")
+        self.engine = engine
+        self.sessions = []
+        self._stop = threading.Event()
+
+    def add(self, session):
+        self.sessions.append(session)
+        return session
+
+    # Open every session's streams and run them until stop() or the duration expires
+    def run(self, duration=None):
+        logger.info(f"Starting {len(self.sessions)} sessions ({self.engine} engine)")
+        for session in self.sessions:
+            session.open_streams()
+
+        try:
+            if self.engine == "asyncio":
+                asyncio.run(self._run_async(duration))
+            else:
+                # Connect all sessions at once rather than one after another
+                starters = [threading.Thread(target=session.start_threads) for session in self.sessions]
+                for starter in starters:
+                    starter.start()
+                for starter in starters:
+                    starter.join()
+                self._stop.wait(duration)
+        finally:
+            for session in self.sessions:
+                session.close()
+            logger.info(f"All {len(self.sessions)} sessions stopped")
+
+    async def _run_async(self, duration):
+        loop = asyncio.get_running_loop()
+        runners = [loop.create_task(session.run_async()) for session in self.sessions]
+        try:
+            await loop.run_in_executor(None, self._stop.wait, duration)
+        finally:
+            for session in self.sessions:
+                session.stop()
+            await asyncio.gather(*runners, return_exceptions=True)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return [session.stats() for session in self.sessions]
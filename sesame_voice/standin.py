@@ -0,0 +1,673 @@
+# Local stand-in for the Sesame voice service, and fake audio devices
+#
+# StandinServer is a small asyncio websocket server (RFC 6455 framing on plain asyncio
+# streams, no extra dependencies) speaking the JSON messages the SesameWebSocket client
+# exchanges with the service. The server greets with "initialize" and answers
+# "call_connect" with "call_connect_response", which carries its sample rate. Audio
+# travels both ways as base64 16-bit PCM in "audio" messages. In "echo" mode the
+# caller's audio comes back resampled to the server rate; in "reply" mode every
+# utterance (detected by energy, timed on the server) is answered with a synthetic
+# voice. Faults can be injected: think-time latency, per-chunk jitter, bursts (chunks
+# held back and released together), a slow call setup and dropped connections, either
+# every few seconds or on demand with drop(). Server-side timings are collected in
+# stats().
+#
+# The protocol is a guess: the message names and fields follow sesame_ai's client as
+# documented, not a recorded session with the service, and fields the stand-in does not
+# need are ignored. StandinWebSocket follows the same guess, so runs with it only show
+# that the stand-in agrees with itself. To check the guess, point the real client at the
+# server instead (SessionConfig(endpoint_url=server.url), or bench_e2e --client sesame).
+#
+# StandinWebSocket has the same public methods as sesame_ai's SesameWebSocket and is
+# built on websocket-client like it, so a Session runs against the stand-in unchanged
+# (pass it as ws_factory). FakePyAudio mimics the part of the PyAudio API the client
+# uses, with virtual streams behind it, so PyAudioBackend runs without audio hardware in
+# either I/O mode. Callback streams are driven by a thread per stream that moves one
+# buffer at a time between the callback and a virtual stream, whose pacing stands in
+# for the device clock.
+
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import logging
+import queue
+import random
+import struct
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from sesame_voice.audio_io import SilenceSource, VirtualInputStream, VirtualOutputStream
+from sesame_voice.resample import StreamingResampler
+
+logger = logging.getLogger("sesame_voice")
+
+STANDIN_MODES = ("echo", "reply")
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_MESSAGE_BYTES = 16 * 2**20
+
+# Websocket opcodes
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+# Server frames are never masked
+def encode_frame(opcode, payload):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 2**16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def unmask(payload, mask):
+    length = len(payload)
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, "little") ^ int.from_bytes(key, "little")).to_bytes(length, "little")
+
+
+# Read one frame; returns (fin, opcode, payload)
+async def read_frame(reader):
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if length > MAX_MESSAGE_BYTES:
+        raise ConnectionError(f"Frame of {length} bytes is too large")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = unmask(payload, mask)
+    return bool(first & 0x80), first & 0x0F, payload
+
+
+# p50/p95/p99/max of a list of milliseconds
+def describe_ms(values):
+    if not len(values):
+        return None
+    values = np.asarray(values, dtype=float)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": int(len(values)), "p50": round(float(p50), 2), "p95": round(float(p95), 2),
+            "p99": round(float(p99), 2), "max": round(float(values.max()), 2)}
+
+
+# Server side of one connection
+class _Call:
+    def __init__(self, server, reader, writer, number):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.session_id = f"standin-{number}"
+        self.call_id = None
+        self.resampler = None
+        self.audio_bytes_received = 0
+        self.chunk_bytes = int(server.sample_rate * server.chunk_ms / 1000) * 2
+
+        # Outgoing audio: (due, generation, chunk, speech end) in due order
+        self.outgoing = asyncio.Queue()
+        self.last_due = 0.0
+        self.generation = 0  # Bumped to discard a reply the caller talked over
+
+        # Turn detection ("reply" mode)
+        self.speaking = False
+        self.last_loud = None
+        self.reply_sample = 0
+
+    def send_json(self, message):
+        self.writer.write(encode_frame(OP_TEXT, json.dumps(message).encode()))
+
+    async def run(self):
+        server = self.server
+        accepted = self.loop.time()
+        tasks = []
+        try:
+            if not await self.handshake():
+                return
+            server.connections += 1
+            server.calls[self.session_id] = self
+            self.send_json({"type": "initialize", "session_id": self.session_id})
+            tasks.append(asyncio.ensure_future(self.sender()))
+            if server.mode == "reply":
+                tasks.append(asyncio.ensure_future(self.watch_turns()))
+            if server.drop_every:
+                tasks.append(asyncio.ensure_future(self.drop_later()))
+            await self.receive(accepted)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            server.calls.pop(self.session_id, None)
+            for task in tasks:
+                task.cancel()
+            self.writer.close()
+
+    # HTTP upgrade; returns False (after answering 400) for anything else
+    async def handshake(self):
+        request = await self.reader.readuntil(b"\r\n\r\n")
+        lines = request.decode("latin-1").split("\r\n")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if headers.get("upgrade", "").lower() != "websocket" or not key:
+            self.writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            return False
+
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        self.writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                           "Upgrade: websocket\r\n"
+                           "Connection: Upgrade\r\n"
+                           f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        return True
+
+    async def receive(self, accepted):
+        server = self.server
+        fragments = []
+        while True:
+            fin, opcode, payload = await read_frame(self.reader)
+            if opcode == OP_CLOSE:
+                self.writer.write(encode_frame(OP_CLOSE, payload[:2]))
+                return
+            if opcode == OP_PING:
+                self.writer.write(encode_frame(OP_PONG, payload))
+                continue
+            if opcode == OP_PONG:
+                continue
+            fragments.append(payload)
+            if not fin:
+                continue
+            message = b"".join(fragments)
+            fragments = []
+
+            server.messages_received += 1
+            try:
+                message = json.loads(message)
+            except ValueError:
+                continue
+            kind = message.get("type")
+            if kind == "call_connect":
+                content = message.get("content", {})
+                client_rate = int(content.get("sample_rate", 16000))
+                self.resampler = StreamingResampler(client_rate, server.sample_rate)
+                self.call_id = f"{self.session_id}-call"
+                if server.connect_delay:
+                    await asyncio.sleep(server.connect_delay)
+                self.send_json({"type": "call_connect_response", "session_id": self.session_id,
+                                "call_id": self.call_id,
+                                "content": {"sample_rate": server.sample_rate, "audio_codec": "none"}})
+                server.handshake_ms.append((self.loop.time() - accepted) * 1000)
+            elif kind == "audio":
+                pcm = base64.b64decode(message["content"]["audio_data"])
+                server.audio_bytes_received += len(pcm)
+                self.audio_bytes_received += len(pcm)
+                self.handle_audio(pcm)
+            elif kind == "ping":
+                self.send_json({"type": "ping_response", "session_id": self.session_id})
+            elif kind in ("disconnect", "call_disconnect"):
+                return
+            await self.writer.drain()
+
+    def handle_audio(self, pcm):
+        server = self.server
+        now = self.loop.time()
+        if server.mode == "echo":
+            if self.resampler:
+                pcm = self.resampler.process(pcm)
+            if pcm:
+                self.enqueue(now + server.latency, pcm)
+            return
+
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        if len(samples) and np.sqrt(np.dot(samples, samples) / len(samples)) > server.speech_energy:
+            self.last_loud = now
+            if not self.speaking:
+                self.speaking = True
+                # The caller talked over the reply: drop what is left of it
+                if not self.outgoing.empty() or self.last_due > now:
+                    self.generation += 1
+                    self.last_due = 0.0
+                    server.interrupted_replies += 1
+
+    # "reply" mode: answer each utterance once the caller has been quiet for a while
+    async def watch_turns(self):
+        server = self.server
+        while True:
+            await asyncio.sleep(0.01)
+            now = self.loop.time()
+            if self.speaking and now - self.last_loud >= server.end_of_speech:
+                self.speaking = False
+                server.turns += 1
+                server.detect_ms.append((now - self.last_loud) * 1000)
+                self.start_reply(now, self.last_loud)
+
+    def start_reply(self, now, speech_end):
+        server = self.server
+        chunk_samples = self.chunk_bytes // 2
+        chunk_seconds = chunk_samples / server.sample_rate
+        count = int(server.reply_seconds / chunk_seconds)
+        for i in range(count):
+            t = (self.reply_sample + np.arange(chunk_samples)) / server.sample_rate
+            self.reply_sample += chunk_samples
+            voice = 2500 * np.sin(2 * np.pi * 220 * t) + 1500 * np.sin(2 * np.pi * 330 * t)
+            self.enqueue(now + server.latency + i * chunk_seconds, voice.astype(np.int16).tobytes(),
+                         speech_end if i == 0 else None)
+
+    # Queue audio for the sender, applying jitter without reordering
+    def enqueue(self, due, chunk, speech_end=None):
+        server = self.server
+        if server.jitter:
+            due += server.random.uniform(0, server.jitter)
+        due = max(due, self.last_due)
+        self.last_due = due
+        self.outgoing.put_nowait((due, self.generation, chunk, speech_end))
+
+    async def sleep_until(self, due):
+        delay = due - self.loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    # Send queued audio when due; with burst > 1, chunks are held back and released in groups
+    async def sender(self):
+        server = self.server
+        burst_wait = server.burst * server.chunk_ms / 1000
+        while True:
+            item = await self.outgoing.get()
+            await self.sleep_until(item[0])
+            batch = [item]
+            while len(batch) < server.burst:
+                try:
+                    item = await asyncio.wait_for(self.outgoing.get(), burst_wait)
+                except asyncio.TimeoutError:
+                    break
+                await self.sleep_until(item[0])
+                batch.append(item)
+
+            now = self.loop.time()
+            for due, generation, chunk, speech_end in batch:
+                if generation != self.generation:
+                    continue
+                self.send_json({"type": "audio", "session_id": self.session_id, "call_id": self.call_id,
+                                "content": {"audio_data": base64.b64encode(chunk).decode()}})
+                server.audio_bytes_sent += len(chunk)
+                server.send_lateness_ms.append((now - due) * 1000)
+                if speech_end is not None:
+                    server.reply_delay_ms.append((now - speech_end) * 1000)
+            await self.writer.drain()
+
+    # Kill the connection without a close handshake, like a network failure
+    async def drop_later(self):
+        server = self.server
+        await asyncio.sleep(server.drop_every * server.random.uniform(0.5, 1.5))
+        self.drop()
+
+    # Cut the connection without a close handshake, like a network failure
+    def drop(self):
+        if self.writer.is_closing():
+            return
+        self.server.dropped_connections += 1
+        self.writer.transport.abort()
+
+
+class StandinServer:
+    def __init__(self, host="127.0.0.1", port=0, mode="echo", sample_rate=24000, latency_ms=0,
+                 jitter_ms=0, burst=1, chunk_ms=20, drop_every=None, connect_delay_ms=0, reply_seconds=2.0,
+                 speech_energy=500, end_of_speech_ms=400, seed=None):
+        if mode not in STANDIN_MODES:
+            raise ValueError(f"Unknown stand-in mode: {mode} (expected one of {STANDIN_MODES})")
+        self.host = host
+        self.port = port  # 0 picks a free port; the real one is known after start()
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.burst = max(1, burst)
+        self.chunk_ms = chunk_ms
+        self.drop_every = drop_every
+        self.connect_delay = connect_delay_ms / 1000  # Before answering call_connect
+        self.reply_seconds = reply_seconds
+        self.speech_energy = speech_energy
+        self.end_of_speech = end_of_speech_ms / 1000
+        self.random = random.Random(seed)
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._number = 0
+        self.calls = {}  # session_id -> live call
+
+        # Metrics
+        self.connections = 0
+        self.dropped_connections = 0
+        self.messages_received = 0
+        self.audio_bytes_received = 0
+        self.audio_bytes_sent = 0
+        self.turns = 0
+        self.interrupted_replies = 0
+        self.handshake_ms = collections.deque(maxlen=10000)
+        self.detect_ms = collections.deque(maxlen=10000)
+        self.reply_delay_ms = collections.deque(maxlen=10000)
+        self.send_lateness_ms = collections.deque(maxlen=100000)
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/"
+
+    # Serve from a background thread with its own event loop
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="standin-server", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        logger.info(f"Stand-in server listening on {self.url} ({self.mode} mode)")
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self._loop.close()
+
+    async def _handle(self, reader, writer):
+        self._number += 1
+        try:
+            await _Call(self, reader, writer, self._number).run()
+        except asyncio.CancelledError:
+            # stop() cancels calls still in progress
+            pass
+
+    # Drop the connection of the call with this session_id (as the client saw it in
+    # "initialize"); returns False if there is no such call. Safe from any thread.
+    def drop(self, session_id):
+        call = self.calls.get(session_id)
+        if call is None:
+            return False
+        self._loop.call_soon_threadsafe(call.drop)
+        return True
+
+    def stop(self):
+        if self._loop and self._thread:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "connections": self.connections,
+            "dropped_connections": self.dropped_connections,
+            "messages_received": self.messages_received,
+            "audio_bytes_received": self.audio_bytes_received,
+            "audio_bytes_sent": self.audio_bytes_sent,
+            "turns": self.turns,
+            "interrupted_replies": self.interrupted_replies,
+            "handshake_ms": describe_ms(list(self.handshake_ms)),
+            "end_of_speech_detect_ms": describe_ms(list(self.detect_ms)),
+            "reply_delay_ms": describe_ms(list(self.reply_delay_ms)),
+            "send_lateness_ms": describe_ms(list(self.send_lateness_ms)),
+        }
+
+
+# Entry point for a server process: serve until anything arrives on `conn`, then send
+# back the server's stats. The server's URL is sent first.
+def serve_process(conn, server_options):
+    logging.basicConfig(level=logging.ERROR)
+    server = StandinServer(**server_options)
+    server.start()
+    conn.send(server.url)
+    conn.recv()
+    server.stop()
+    conn.send(server.stats())
+
+
+# Client for the stand-in with SesameWebSocket's public methods; it speaks the stand-in's
+# guess at the protocol, not necessarily what SesameWebSocket sends
+class StandinWebSocket:
+    def __init__(self, id_token=None, character="Maya", url="ws://127.0.0.1:8765/",
+                 client_sample_rate=16000, max_queue=1000):
+        self.id_token = id_token
+        self.character = character
+        self.url = url
+        self.client_sample_rate = client_sample_rate
+        self.server_sample_rate = 24000  # Until the server says otherwise
+        self.session_id = None
+        self.call_id = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.dropped_chunks = 0
+        self._audio_queue = queue.Queue(maxsize=max_queue)
+        self._app = None
+        self._connected = False
+        self._connect_callback = None
+        self._disconnect_callback = None
+
+    def set_connect_callback(self, callback):
+        self._connect_callback = callback
+
+    def set_disconnect_callback(self, callback):
+        self._disconnect_callback = callback
+
+    # Connects in the background; the connect callback fires once the call is set up
+    def connect(self):
+        import websocket
+
+        query = urllib.parse.urlencode({"id_token": self.id_token or "", "character": self.character})
+        self._app = websocket.WebSocketApp(f"{self.url}?{query}",
+                                           on_open=self._on_open,
+                                           on_message=self._on_message,
+                                           on_close=self._on_close,
+                                           on_error=self._on_error)
+        threading.Thread(target=self._app.run_forever, kwargs={"skip_utf8_validation": True},
+                         name="standin-client", daemon=True).start()
+
+    def _on_open(self, app):
+        app.send(json.dumps({"type": "call_connect",
+                             "content": {"sample_rate": self.client_sample_rate, "audio_codec": "none",
+                                         "character": self.character}}))
+
+    def _on_message(self, app, message):
+        message = json.loads(message)
+        kind = message.get("type")
+        if kind == "audio":
+            chunk = base64.b64decode(message["content"]["audio_data"])
+            try:
+                self._audio_queue.put_nowait(chunk)
+                self.bytes_received += len(chunk)
+            except queue.Full:
+                self.dropped_chunks += 1
+        elif kind == "initialize":
+            self.session_id = message.get("session_id")
+        elif kind == "call_connect_response":
+            self.call_id = message.get("call_id")
+            self.server_sample_rate = message.get("content", {}).get("sample_rate", self.server_sample_rate)
+            self._connected = True
+            if self._connect_callback:
+                self._connect_callback()
+
+    def _on_close(self, app, status_code, reason):
+        was_connected = self._connected
+        self._connected = False
+        if was_connected and self._disconnect_callback:
+            self._disconnect_callback()
+
+    def _on_error(self, app, error):
+        logger.debug(f"Stand-in client error: {error}")
+
+    def is_connected(self):
+        return self._connected
+
+    def disconnect(self):
+        if self._app:
+            self._app.close()
+
+    def send_audio_data(self, data):
+        if not self._connected:
+            raise ConnectionError("Not connected")
+        self._app.send(json.dumps({"type": "audio", "session_id": self.session_id, "call_id": self.call_id,
+                                   "content": {"audio_data": base64.b64encode(data).decode()}}))
+        self.bytes_sent += len(data)
+
+    def get_next_audio_chunk(self, timeout=None):
+        try:
+            return self._audio_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+# PyAudio sample format constants and their sizes in bytes
+PA_FLOAT32 = 1
+PA_INT32 = 2
+PA_INT24 = 4
+PA_INT16 = 8
+PA_INT8 = 16
+PA_UINT8 = 32
+_SAMPLE_SIZES = {PA_FLOAT32: 4, PA_INT32: 4, PA_INT24: 3, PA_INT16: 2, PA_INT8: 1, PA_UINT8: 1}
+
+# PyAudio callback return codes and status flags
+PA_CONTINUE = 0
+PA_COMPLETE = 1
+PA_ABORT = 2
+PA_INPUT_OVERFLOW = 2
+
+
+# Stands in for a PyAudio stream opened with stream_callback: a thread calls the callback
+# once per frames_per_buffer frames, with audio read from `stream` (input) or writing what
+# it returns to `stream` (output). The virtual stream paces every buffer like a device.
+class FakeCallbackStream:
+    def __init__(self, stream, callback, frames_per_buffer, input, start=True):
+        self._stream = stream
+        self._callback = callback
+        self.frames_per_buffer = frames_per_buffer
+        self._input = input
+        self._active = False
+        self._closed = False
+        self._thread = None
+        self.callbacks = 0
+        if start:
+            self.start_stream()
+
+    def _run(self):
+        frames = self.frames_per_buffer
+        while self._active:
+            try:
+                if self._input:
+                    _, flag = self._callback(self._stream.read(frames), frames, {}, 0)
+                else:
+                    data, flag = self._callback(None, frames, {}, 0)
+                    self._stream.write(data)
+            except IOError:
+                # The virtual stream was stopped under us
+                break
+            self.callbacks += 1
+            if flag != PA_CONTINUE:
+                break
+        self._active = False
+
+    def is_active(self):
+        return self._active
+
+    def start_stream(self):
+        if self._closed or self._active:
+            return
+        self._active = True
+        self._stream.start_stream()
+        self._thread = threading.Thread(target=self._run, name="fake-audio-callback", daemon=True)
+        self._thread.start()
+
+    def stop_stream(self):
+        self._active = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+        self._thread = None
+
+    def close(self):
+        self.stop_stream()
+        self._closed = True
+        self._stream.close()
+
+
+# Stands in for pyaudio.PyAudio: one input and one output device backed by virtual
+# streams. source_factory()/sink_factory() work as for VirtualBackend.
+class FakePyAudio:
+    # pyaudio's module constants, for callback streams (see audio_io.callback_flags)
+    paContinue = PA_CONTINUE
+    paComplete = PA_COMPLETE
+    paAbort = PA_ABORT
+    paInputOverflow = PA_INPUT_OVERFLOW
+
+    def __init__(self, source_factory=SilenceSource, sink_factory=None, speed=1.0,
+                 input_name="Fake microphone", output_name="Fake speaker"):
+        self.source_factory = source_factory
+        self.sink_factory = sink_factory
+        self.speed = speed
+        self.devices = [
+            {"index": 0, "name": input_name, "maxInputChannels": 1, "maxOutputChannels": 0,
+             "defaultSampleRate": 16000.0, "hostApi": 0},
+            {"index": 1, "name": output_name, "maxInputChannels": 0, "maxOutputChannels": 2,
+             "defaultSampleRate": 48000.0, "hostApi": 0},
+        ]
+        self.streams_opened = 0
+        self.terminated = False
+
+    def get_sample_size(self, format):
+        return _SAMPLE_SIZES[format]
+
+    def get_format_from_width(self, width, unsigned=True):
+        return {1: PA_UINT8 if unsigned else PA_INT8, 2: PA_INT16, 3: PA_INT24, 4: PA_FLOAT32}[width]
+
+    def get_host_api_info_by_index(self, host_api_index):
+        return {"index": 0, "name": "Fake", "deviceCount": len(self.devices),
+                "defaultInputDevice": 0, "defaultOutputDevice": 1}
+
+    def get_device_info_by_host_api_device_index(self, host_api_index, host_api_device_index):
+        return self.devices[host_api_device_index]
+
+    def get_device_info_by_index(self, device_index):
+        return self.devices[device_index]
+
+    def get_device_count(self):
+        return len(self.devices)
+
+    def open(self, rate, channels, format, input=False, output=False, input_device_index=None,
+             output_device_index=None, frames_per_buffer=1024, start=True, stream_callback=None):
+        if not input and not output:
+            raise ValueError("Must specify an input or output stream")
+        width = self.get_sample_size(format)
+        self.streams_opened += 1
+        # A device with a callback always runs on its own clock, so never unpaced
+        speed = self.speed if stream_callback is None else self.speed or 1.0
+        if input:
+            stream = VirtualInputStream(self.source_factory(), width, channels, rate, speed=speed)
+        else:
+            sink = self.sink_factory() if self.sink_factory else None
+            stream = VirtualOutputStream(width, channels, rate, sink=sink, speed=speed)
+        if stream_callback is not None:
+            return FakeCallbackStream(stream, stream_callback, frames_per_buffer, input, start=start)
+        return stream
+
+    def terminate(self):
+        self.terminated = True
@@ -0,0 +1,58 @@
+# Startup phase timing
+#
+# StartupTimer records when each startup phase (imports, token, audio devices, streams,
+# connection) began and ended, measured from process start. Phases run on different
+# threads and overlap, so each one is kept as its own interval; milestones (first frame
+# sent) are single instants. summary() lists everything in start order for the log.
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    # origin: time.monotonic() at process start; defaults to now
+    def __init__(self, origin=None):
+        self.origin = time.monotonic() if origin is None else origin
+        self.phases = []  # (name, start, end) in seconds since origin
+        self.milestones = []  # (name, at)
+        self._lock = threading.Lock()
+
+    # Record a phase from monotonic timestamps
+    def add(self, name, start, end):
+        with self._lock:
+            self.phases.append((name, start - self.origin, end - self.origin))
+
+    def mark(self, name, at=None):
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            self.milestones.append((name, at - self.origin))
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.monotonic())
+
+    # func wrapped so that each call is timed as phase `name`, e.g. for an executor
+    def timed(self, name, func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return run
+
+    def elapsed_ms(self):
+        return (time.monotonic() - self.origin) * 1000
+
+    def summary(self):
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+            milestones = sorted(self.milestones, key=lambda milestone: milestone[1])
+        parts = [f"{name}: {(end - start) * 1000:.0f}ms ({start * 1000:.0f}-{end * 1000:.0f})"
+                 for name, start, end in phases]
+        parts += [f"{name} at {at * 1000:.0f}ms" for name, at in milestones]
+        return ", ".join(parts)
@@ -0,0 +1,250 @@
+# Shared-memory audio tap for out-of-process consumers
+#
+# AudioTap publishes both directions of a session into a memory-mapped file (put it on
+# /dev/shm to keep it in memory) so transcription, analytics or QA monitors can run as
+# separate processes. Each direction has its own ring of fixed-size slots with one
+# producer: microphone frames are published by the uplink sender as they are sent, the
+# character's audio by the playback loop right after it is written to the speaker.
+# Publishing is a copy into the next slot and a few header stores, nothing more; the
+# producer never waits for and never even looks at the readers. What that costs the
+# producing loop is measured per track (publish_ns) and shown in the summary.
+#
+# Any number of TapReaders attach to the file. Each keeps its own position, reads frames
+# in place (data is a memoryview into the mapping, not a copy) and may fall behind: once
+# the producer has gone a full ring ahead, the frames in between are overwritten and the
+# reader skips to the oldest frame still there, reporting how many it lost.
+#
+# Every slot is guarded like a seqlock by a stamp: 2n+1 while frame n is written into
+# it and 2n+2 once it is complete, so a reader knows whether the frame it expects is
+# there, still being written or already overwritten, and can check after using a
+# frame's data that it wasn't overwritten in the meantime (TapFrame.valid).
+#
+# Layout (little-endian): a 64-byte file header (with a flag cleared when the session
+# closes the tap), a 64-byte header per track holding the number of frames published,
+# then per track `slots` slots of a 32-byte slot header (stamp, timestamp, rate, length,
+# channels) followed by slot_bytes of audio. Larger chunks are published as several
+# frames. Timestamps are time.monotonic(), which is the
+# same clock in every process on the host.
+
+import mmap
+import os
+import struct
+import time
+
+from sesame_voice.recorder import CHARACTER_TRACK, MIC_TRACK
+
+MAGIC = b"SVTAP\x00\x00\x01"
+TRACKS = (MIC_TRACK, CHARACTER_TRACK)
+
+FILE_HEADER = struct.Struct("<8sIII")  # magic, tracks, slots, slot_bytes
+OPEN_FLAG = struct.Struct("<I")  # 1 while the producer is running, after the file header
+TRACK_HEADER = struct.Struct("<Q")  # frames published
+STAMP = struct.Struct("<Q")
+SLOT_INFO = struct.Struct("<dIIH")  # timestamp, rate, length, channels (after the stamp)
+HEADER_BYTES = 64
+TRACK_HEADER_BYTES = 64
+SLOT_HEADER_BYTES = 32
+
+
+class _Layout:
+    def __init__(self, slots, slot_bytes):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.slot_size = SLOT_HEADER_BYTES + slot_bytes
+        self.rings_offset = HEADER_BYTES + TRACK_HEADER_BYTES * len(TRACKS)
+        self.size = self.rings_offset + len(TRACKS) * slots * self.slot_size
+
+    def track_header(self, track):
+        return HEADER_BYTES + TRACK_HEADER_BYTES * track
+
+    def slot(self, track, seq):
+        return self.rings_offset + (track * self.slots + seq % self.slots) * self.slot_size
+
+
+class AudioTap:
+    # slots * slot_bytes per direction; the defaults hold about 8 s of 16 kHz mono audio
+    def __init__(self, path, slots=1024, slot_bytes=4096):
+        if slots < 2 or slot_bytes <= 0:
+            raise ValueError("A tap needs at least two slots of a positive size")
+        self.path = path
+        self.layout = layout = _Layout(slots, slot_bytes)
+        with open(path, "w+b") as f:
+            f.truncate(layout.size)
+            self._map = mmap.mmap(f.fileno(), layout.size)
+        self._view = memoryview(self._map)
+        FILE_HEADER.pack_into(self._map, 0, MAGIC, len(TRACKS), slots, slot_bytes)
+        OPEN_FLAG.pack_into(self._map, FILE_HEADER.size, 1)
+        self._open = True
+        self._published = [0] * len(TRACKS)
+
+        # Metrics
+        self.frames = [0] * len(TRACKS)
+        self.bytes = [0] * len(TRACKS)
+        self.publishes = [0] * len(TRACKS)
+        self.publish_ns = [0] * len(TRACKS)
+
+    # Producer side (one thread per track): publish a chunk of audio captured or played
+    # at `timestamp`; chunks larger than a slot take several
+    def publish(self, track, data, rate, channels=1, timestamp=None):
+        if not self._open:
+            return
+        began = time.perf_counter_ns()
+        timestamp = timestamp or time.monotonic()
+        layout = self.layout
+        data = memoryview(data).cast('B')
+        seq = self._published[track]
+        view = self._view
+        try:
+            for start in range(0, len(data), layout.slot_bytes):
+                piece = data[start:start + layout.slot_bytes]
+                slot = layout.slot(track, seq)
+                STAMP.pack_into(view, slot, 2 * seq + 1)
+                SLOT_INFO.pack_into(view, slot + STAMP.size, timestamp, rate, len(piece), channels)
+                payload = slot + SLOT_HEADER_BYTES
+                view[payload:payload + len(piece)] = piece
+                STAMP.pack_into(view, slot, 2 * seq + 2)
+                seq += 1
+                TRACK_HEADER.pack_into(view, layout.track_header(track), seq)
+        except ValueError:
+            # Closed under us while the session shuts down
+            return
+        self.frames[track] += seq - self._published[track]
+        self.bytes[track] += len(data)
+        self._published[track] = seq
+        self.publishes[track] += 1
+        self.publish_ns[track] += time.perf_counter_ns() - began
+
+    # Average time a publish on `track` took its producer, in microseconds
+    def publish_cost_us(self, track):
+        return self.publish_ns[track] / self.publishes[track] / 1000 if self.publishes[track] else 0.0
+
+    # Readers that are attached keep their mapping and see the tap as closed
+    def close(self, remove=True):
+        if not self._open:
+            return
+        self._open = False
+        OPEN_FLAG.pack_into(self._view, FILE_HEADER.size, 0)
+        self._view.release()
+        self._map.close()
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def summary(self):
+        return (f"Path: {self.path}, Microphone: {self.frames[MIC_TRACK]} frames "
+                f"({self.publish_cost_us(MIC_TRACK):.1f}us/publish), Character: {self.frames[CHARACTER_TRACK]} "
+                f"frames ({self.publish_cost_us(CHARACTER_TRACK):.1f}us/publish)")
+
+
+class TapFrame:
+    __slots__ = ("reader", "seq", "timestamp", "rate", "channels", "data", "lost", "_slot")
+
+    def __init__(self, reader, seq, slot, timestamp, rate, channels, data, lost):
+        self.reader = reader
+        self.seq = seq
+        self.timestamp = timestamp
+        self.rate = rate
+        self.channels = channels
+        self.data = data  # Memoryview into the tap; see valid()
+        self.lost = lost  # Frames skipped right before this one
+        self._slot = slot
+
+    # False once the producer has overwritten the frame, i.e. data may have changed while
+    # it was being used; check after processing it
+    def valid(self):
+        return STAMP.unpack_from(self.reader._view, self._slot)[0] == 2 * self.seq + 2
+
+    # A copy of the audio, or None if it was overwritten before the copy was complete
+    def copy(self):
+        data = bytes(self.data)
+        return data if self.valid() else None
+
+
+class TapReader:
+    # Attach to the tap at `path` and read one direction (MIC_TRACK or CHARACTER_TRACK),
+    # starting with the next frame published, or the oldest one still there if from_start
+    def __init__(self, path, track, from_start=False):
+        if track not in TRACKS:
+            raise ValueError(f"Unknown track: {track} (expected one of {TRACKS})")
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, tracks, slots, slot_bytes = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not an audio tap")
+        self._view = memoryview(self._map)
+        self.layout = _Layout(slots, slot_bytes)
+        self.track = track
+        self._head_offset = self.layout.track_header(track)
+        published = self._published()
+        self.next_seq = max(published - slots + 1, 0) if from_start else published
+
+        # Metrics
+        self.frames = 0
+        self.lost = 0
+
+    def _published(self):
+        return TRACK_HEADER.unpack_from(self._view, self._head_offset)[0]
+
+    # True once the session has closed the tap; frames still in the ring can be read
+    def closed(self):
+        return OPEN_FLAG.unpack_from(self._view, FILE_HEADER.size)[0] == 0
+
+    # The next frame, or None if the reader has caught up with the producer
+    def read(self):
+        layout = self.layout
+        view = self._view
+        lost = 0
+        while True:
+            published = self._published()
+            if self.next_seq >= published:
+                self.lost += lost
+                return None
+            # The producer may already be rewriting the slot of the oldest frame
+            oldest = published - layout.slots + 1
+            if self.next_seq < oldest:
+                lost += oldest - self.next_seq
+                self.next_seq = oldest
+
+            seq = self.next_seq
+            slot = layout.slot(self.track, seq)
+            stamp = STAMP.unpack_from(view, slot)[0]
+            timestamp, rate, length, channels = SLOT_INFO.unpack_from(view, slot + STAMP.size)
+            # Overwritten before or while the header was read: skip it
+            if stamp != 2 * seq + 2 or STAMP.unpack_from(view, slot)[0] != stamp:
+                lost += 1
+                self.next_seq += 1
+                continue
+
+            self.next_seq += 1
+            self.frames += 1
+            self.lost += lost
+            payload = slot + SLOT_HEADER_BYTES
+            return TapFrame(self, seq, slot, timestamp, rate, channels,
+                            view[payload:payload + min(length, layout.slot_bytes)], lost)
+
+    # The next frame, polling every poll_interval seconds for up to timeout (None waits
+    # until the tap is closed); the producer can't wake readers in another process
+    def wait(self, timeout=None, poll_interval=0.005):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            frame = self.read()
+            if frame is not None:
+                return frame
+            if self.closed() or (deadline is not None and time.monotonic() >= deadline):
+                return None
+            time.sleep(poll_interval)
+
+    # Frames published but not read yet (more than the ring holds means some are lost)
+    def backlog(self):
+        return self._published() - self.next_seq
+
+    # Release every TapFrame's data before closing
+    def close(self):
+        self._view.release()
+        self._map.close()
+
+    def summary(self):
+        return f"Frames: {self.frames}, Lost: {self.lost}, Backlog: {self.backlog()}"
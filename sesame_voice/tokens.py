@@ -0,0 +1,167 @@
+# In-memory authentication token cache with background refresh
+#
+# TokenService keeps the current id token in memory and refreshes it on a background
+# thread shortly before it expires, so reconnects get a valid token without touching
+# token.json or the network. The expiry is read from the token's JWT "exp" claim.
+# SesameTokenSource is the default fetch function, with sesame_ai imported lazily.
+
+import base64
+import collections
+import json
+import logging
+import threading
+import time
+import traceback
+
+logger = logging.getLogger("sesame_voice")
+
+# Lifetime assumed for tokens whose expiry can't be read
+DEFAULT_LIFETIME = 3600
+
+
+# Expiry time (seconds since the epoch) from a JWT's payload, or None if unreadable
+def token_expiry(token):
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return None
+
+
+class TokenService:
+    # fetch() returns a fresh or still-valid id token, e.g. TokenManager.get_valid_token
+    def __init__(self, fetch, refresh_margin=300, retry_delay=5, max_retry_delay=60):
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Metrics
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.refresh_latencies_ms = collections.deque(maxlen=100)
+
+    # Fetch the first token (so startup fails loudly without one) and start refreshing.
+    # The connection may have asked for it first (get_token fetches it then); checked
+    # under the lock, so that token is used rather than fetched again.
+    def start(self):
+        with self._lock:
+            if not self._valid():
+                self._refresh()
+        self._thread = threading.Thread(target=self._run, name="token-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # Token for a new connection. Served from memory; only blocks if the cached token
+    # has already expired, which means background refresh has been failing.
+    def get_token(self):
+        if self._valid():
+            self.cache_hits += 1
+            return self._token
+
+        # Check and fetch under one lock: a caller that arrives while a refresh is in
+        # flight (the first one at startup runs alongside the connection) waits for it
+        # and takes its token, so concurrent misses fetch once
+        with self._lock:
+            if self._valid():
+                self.cache_hits += 1
+                return self._token
+            # No token yet: the connection got here before start(), and this is the
+            # first fetch rather than a miss
+            if self._token is None:
+                return self._refresh()
+
+            self.cache_misses += 1
+            logger.warning("Cached token missing or expired, refreshing on the connection path")
+            return self._refresh()
+
+    # Whether the cached token is still valid
+    def _valid(self):
+        return self._token is not None and time.time() < self._expires_at
+
+    def expires_in(self):
+        return self._expires_at - time.time()
+
+    # Fetch a token and cache it; returns the token
+    def refresh(self):
+        with self._lock:
+            return self._refresh()
+
+    # refresh() with the lock already held
+    def _refresh(self):
+        start = time.monotonic()
+        try:
+            token = self.fetch()
+        except Exception:
+            self.refresh_failures += 1
+            raise
+        latency_ms = (time.monotonic() - start) * 1000
+        self.refresh_latencies_ms.append(latency_ms)
+        self.refreshes += 1
+
+        expires_at = token_expiry(token)
+        if expires_at is None:
+            expires_at = time.time() + DEFAULT_LIFETIME
+        if token != self._token:
+            logger.info(f"Authentication token refreshed in {latency_ms:.0f}ms, valid for {expires_at - time.time():.0f}s")
+        self._token = token
+        self._expires_at = expires_at
+        return token
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            # Refresh refresh_margin seconds before expiry. If the fetch handed back a
+            # token that is already inside the margin (the source still considers it
+            # valid), check again halfway to expiry rather than spinning.
+            remaining = self.expires_in()
+            if remaining > self.refresh_margin:
+                wait = remaining - self.refresh_margin
+            else:
+                wait = max(remaining / 2, 1)
+            if failures:
+                wait = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+            if self._stop.wait(wait):
+                break
+
+            try:
+                self.refresh()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.error(f"Background token refresh failed: {e}")
+                logger.debug(traceback.format_exc())
+
+    def summary(self):
+        latencies = self.refresh_latencies_ms
+        last = latencies[-1] if latencies else 0.0
+        worst = max(latencies) if latencies else 0.0
+        return (f"Expires in: {self.expires_in():.0f}s, Refreshes: {self.refreshes} "
+                f"(failed {self.refresh_failures}), Refresh latency: last {last:.0f}ms, "
+                f"max {worst:.0f}ms, Cache hits: {self.cache_hits}, Misses: {self.cache_misses}")
+
+
+# TokenService fetch function backed by sesame_ai's TokenManager. sesame_ai and the HTTP
+# stack under it are imported on the first fetch, so they load on whichever thread
+# fetches the first token instead of at startup.
+class SesameTokenSource:
+    def __init__(self, token_file="token.json"):
+        self.token_file = token_file
+        self._manager = None
+
+    def __call__(self):
+        if self._manager is None:
+            from sesame_ai import SesameAI, TokenManager
+            self._manager = TokenManager(SesameAI(), token_file=self.token_file)
+        return self._manager.get_valid_token()
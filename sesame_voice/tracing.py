@@ -0,0 +1,155 @@
+# Per-turn conversation timeline
+#
+# TurnTracker follows the turns of a conversation with timestamps rather than loop
+# iterations, so the boundaries stay right whatever rate the loops run at:
+#
+#   idle -> user speech -> server think time -> character playback -> idle
+#
+# User speech starts after min_speech_ms of continuous loud microphone audio and ends
+# after speech_end_ms without any; think time runs from there to the first chunk of the
+# reply; playback ends once nothing has arrived or been played for character_end_ms,
+# or at once when the user barges in. Barge-ins are traced on the user's track and
+# reconnects on their own. Every finished phase is kept as a span (in a bounded
+# buffer) and export_trace() writes them as Chrome trace-event JSON, which
+# chrome://tracing and Perfetto open directly.
+
+import collections
+import json
+import threading
+import time
+
+# Trace tracks (shown as threads in the viewer)
+USER_TRACK = 1
+SERVER_TRACK = 2
+CHARACTER_TRACK = 3
+CONNECTION_TRACK = 4
+TRACK_NAMES = {USER_TRACK: "user", SERVER_TRACK: "server", CHARACTER_TRACK: "character",
+               CONNECTION_TRACK: "connection"}
+
+
+class TurnTracker:
+    # metrics (a SessionMetrics) receives the response latency of every turn
+    def __init__(self, metrics=None, min_speech_ms=150, speech_end_ms=300, character_end_ms=1000,
+                 max_spans=10000):
+        self.metrics = metrics
+        self.min_speech = min_speech_ms / 1000
+        self.speech_end = speech_end_ms / 1000
+        self.character_end = character_end_ms / 1000
+        self.spans = collections.deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+        # Microphone side
+        self.user_speaking = False
+        self._loud_since = None
+        self._last_loud = None
+        self._speech_start = None
+        self._speech_ended_at = None  # Waiting for a reply since then
+
+        # Playback side
+        self.character_speaking = False
+        self._character_start = None
+        self._last_audio = None
+
+        # Metrics
+        self.turns = 0
+        self.think_time_total = 0.0
+
+    def _span(self, name, track, start, end, **args):
+        self.spans.append((name, track, start, max(end - start, 0.0), args))
+
+    # Capture loop: one microphone frame, loud or not
+    def mic(self, loud, now=None):
+        now = now or time.monotonic()
+        if loud:
+            if self._loud_since is None:
+                self._loud_since = now
+            self._last_loud = now
+            if not self.user_speaking and now - self._loud_since >= self.min_speech:
+                with self._lock:
+                    self.user_speaking = True
+                    self._speech_start = self._loud_since
+                    # Speaking again before the reply came: that wait was not a turn
+                    self._speech_ended_at = None
+            return
+
+        self._loud_since = None
+        if self.user_speaking and now - self._last_loud >= self.speech_end:
+            with self._lock:
+                self.user_speaking = False
+                self._span("User speech", USER_TRACK, self._speech_start, self._last_loud)
+                self._speech_ended_at = self._last_loud
+
+    # Playback loop: character audio arrived; returns True when this starts playback
+    def audio_received(self, now=None):
+        now = now or time.monotonic()
+        self._last_audio = now
+        if self.character_speaking:
+            return False
+        with self._lock:
+            self.character_speaking = True
+            self._character_start = now
+            ended = self._speech_ended_at
+            self._speech_ended_at = None
+        if ended is not None:
+            think = now - ended
+            self.turns += 1
+            self.think_time_total += think
+            self._span("Server think time", SERVER_TRACK, ended, now, turn=self.turns)
+            if self.metrics:
+                self.metrics.response_latency.observe(think)
+        return True
+
+    # Playback loop: a frame was played (keeps playback open while the buffer drains)
+    def played(self, now=None):
+        self._last_audio = now or time.monotonic()
+
+    # Playback loop: nothing arrived this iteration; returns True when playback ended
+    def playback_idle(self, buffered, now=None):
+        if not self.character_speaking or buffered:
+            return False
+        now = now or time.monotonic()
+        if now - self._last_audio < self.character_end:
+            return False
+        self.character_speaking = False
+        self._span("Character playback", CHARACTER_TRACK, self._character_start, self._last_audio)
+        return True
+
+    # Playback loop: the user talked over the character from `started` and its audio was
+    # flushed (see barge_in)
+    def interrupted(self, started, now=None):
+        now = now or time.monotonic()
+        self._span("Barge-in", USER_TRACK, started, now)
+        if not self.character_speaking:
+            return
+        self.character_speaking = False
+        self._span("Character playback", CHARACTER_TRACK, self._character_start, now, interrupted=True)
+
+    # A lost connection was replaced
+    def reconnect(self, lost_at, restored_at=None, **args):
+        self._span("Reconnect", CONNECTION_TRACK, lost_at, restored_at or time.monotonic(), **args)
+
+    def summary(self):
+        average = self.think_time_total / self.turns * 1000 if self.turns else 0.0
+        return f"Turns: {self.turns}, Average think time: {average:.0f}ms, Spans: {len(self.spans)}"
+
+
+# Chrome trace events for one tracker; pid groups them per session
+def trace_events(tracker, pid=1, process_name="session"):
+    events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": process_name}}]
+    for track, name in TRACK_NAMES.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": track, "args": {"name": name}})
+        events.append({"name": "thread_sort_index", "ph": "M", "pid": pid, "tid": track,
+                       "args": {"sort_index": track}})
+    for name, track, start, duration, args in list(tracker.spans):
+        events.append({"name": name, "cat": "turn", "ph": "X", "pid": pid, "tid": track,
+                       "ts": round(start * 1e6), "dur": round(duration * 1e6), "args": args})
+    return events
+
+
+# Write the timelines of the given sessions to a Chrome trace JSON file
+def export_trace(path, sessions):
+    events = []
+    for pid, session in enumerate(sessions, 1):
+        events.extend(trace_events(session.tracker, pid, session.name or "session"))
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
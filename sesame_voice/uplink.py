@@ -0,0 +1,204 @@
+# Uplink stage between microphone capture and the websocket
+#
+# The capture loop hands each frame to an UplinkSender and goes straight back to reading
+# the microphone; a sender thread drains a bounded frame queue onto the current
+# websocket. When the network stalls the queue fills up instead of the capture loop
+# blocking, and the overflow policy decides what to give up:
+#
+#   drop_oldest   - discard the oldest queued frame
+#   drop_silence  - discard the oldest silent frame, falling back to the oldest frame
+#   coalesce      - send everything queued (up to coalesce_max frames) as one message,
+#                   dropping the oldest frame only when the queue is still full
+#   block         - make the capture loop wait for room; only for file input that runs
+#                   faster than real time, never for a live microphone
+#
+# Queued frames are pooled frames (see frame_pool); the queue owns one reference to each
+# and releases it once the frame has been sent or dropped. A frame's silent flag and
+# capture time travel on the frame itself, and the sender reuses one batch list, so
+# queueing and sending a frame allocates nothing.
+
+import collections
+import threading
+import time
+import traceback
+
+from sesame_voice.recorder import MIC_TRACK
+
+UPLINK_POLICIES = ("drop_oldest", "drop_silence", "coalesce", "block")
+
+
+class UplinkSender:
+    def __init__(self, session, max_frames=50, policy="drop_oldest", coalesce_max=4,
+                 error_backoff=0.5):
+        if policy not in UPLINK_POLICIES:
+            raise ValueError(f"Unknown uplink policy: {policy} (expected one of {UPLINK_POLICIES})")
+        self.session = session
+        self.log = session.log
+        self.max_frames = max_frames
+        self.policy = policy
+        self.coalesce_max = coalesce_max if policy == "coalesce" else 1
+        self.error_backoff = error_backoff
+
+        # Queued pooled Frames
+        self._frames = collections.deque()
+        self._batch = []  # Frames being sent (sender thread only)
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+        # Metrics
+        self.frames_queued = 0
+        self.dropped_frames = 0
+        self.dropped_silent_frames = 0
+        self.coalesced_frames = 0
+        self.sends = 0
+        self.send_errors = 0
+        self.max_depth = 0
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"uplink-{self.session.name or 'main'}",
+                                        daemon=True)
+        self._thread.start()
+
+    # Stop the sender thread; frames still queued are discarded
+    def stop(self):
+        with self._cond:
+            self._running = False
+            while self._frames:
+                self._frames.popleft().release()
+            self._cond.notify()
+
+    def depth(self):
+        return len(self._frames)
+
+    # Queue a captured frame, taking over the caller's reference to it; never blocks on
+    # the network (except with the block policy)
+    def put(self, frame, silent=False):
+        # acquire()/release() rather than a with block, which allocates (see frame_pool)
+        self._cond.acquire()
+        try:
+            if self.policy == "block":
+                if len(self._frames) >= self.max_frames:
+                    # Waiting for room on purpose, not stalled (see watchdog)
+                    self.session.heartbeats["capture"].pause()
+                while len(self._frames) >= self.max_frames and self._running:
+                    self._cond.wait(0.1)
+            if len(self._frames) >= self.max_frames:
+                self._drop_one()
+            frame.silent = silent
+            frame.captured = time.monotonic()
+            self._frames.append(frame)
+            self.frames_queued += 1
+            if len(self._frames) > self.max_depth:
+                self.max_depth = len(self._frames)
+            # The sender only waits on an empty queue (and notify() allocates)
+            if len(self._frames) == 1:
+                self._cond.notify()
+        finally:
+            self._cond.release()
+
+    # Make room for one frame according to the policy (called with the lock held)
+    def _drop_one(self):
+        if self.policy == "drop_silence":
+            for i, frame in enumerate(self._frames):
+                if frame.silent:
+                    del self._frames[i]
+                    frame.release()
+                    self.dropped_frames += 1
+                    self.dropped_silent_frames += 1
+                    return
+        self._frames.popleft().release()
+        self.dropped_frames += 1
+
+    # Wait for queued frames and take up to coalesce_max of them (in the reused batch list)
+    def _take(self):
+        self._cond.acquire()
+        try:
+            while self._running and not self._frames:
+                self._cond.wait()
+            if not self._running:
+                return None
+            batch = self._batch
+            batch.clear()
+            while self._frames and len(batch) < self.coalesce_max:
+                batch.append(self._frames.popleft())
+            if self.policy == "block":
+                self._cond.notify_all()
+            return batch
+        finally:
+            self._cond.release()
+
+    # Put frames that could not be sent back at the front of the queue
+    def _requeue(self, frames):
+        with self._cond:
+            self._frames.extendleft(reversed(frames))
+            while len(self._frames) > self.max_frames:
+                self._frames.popleft().release()
+                self.dropped_frames += 1
+
+    def _run(self):
+        session = self.session
+        heartbeat = session.heartbeats["uplink"]
+        self.log.info(f"Uplink sender started (policy: {self.policy}, queue: {self.max_frames} frames)")
+
+        while True:
+            frames = self._take()
+            if frames is None:
+                break
+
+            ws = session.current_ws
+            if ws is None or not ws.is_connected():
+                # Hold on to the frames until the connection is back; the bounded queue
+                # drops the oldest audio if the outage lasts
+                self._requeue(frames)
+                if not session.wait_for_connection(0.5):
+                    time.sleep(0.01)
+                continue
+
+            data = frames[0].data() if len(frames) == 1 else b"".join(frame.data() for frame in frames)
+            # Any send slower than the stall threshold is a stall
+            heartbeat.beat(0)
+            try:
+                ws.send_audio_data(data)
+            except Exception as e:
+                heartbeat.pause()
+                self._requeue(frames)
+                # The connection went away under us; pick up the replacement straight away
+                if ws is not session.current_ws or not ws.is_connected():
+                    continue
+                self.send_errors += 1
+                self.log.error(f"Error sending audio data: {e}")
+                self.log.debug(traceback.format_exc())
+                # Back off here rather than in the capture loop
+                time.sleep(self.error_backoff)
+                continue
+
+            heartbeat.pause()
+            self.sends += 1
+            self.coalesced_frames += len(frames) - 1
+            if not session.frames_sent:
+                session.first_frame_sent_at = time.monotonic()
+                session._first_frame_sent.set()
+            session.frames_sent += len(frames)
+            session.bytes_sent += len(data)
+            # Capture to send, measured for the oldest frame in the message
+            session.metrics.frame_send_latency.observe(time.monotonic() - frames[0].captured)
+            # The websocket has copied what it needs; the tap copies each frame with its
+            # capture time
+            tap = session.tap
+            for frame in frames:
+                if tap:
+                    tap.publish(MIC_TRACK, frame.data(), session.config.rate, session.config.channels, frame.captured)
+                frame.release()
+
+        self.log.info("Uplink sender ending")
+
+    def summary(self):
+        return (f"Policy: {self.policy}, Queued: {self.frames_queued}, Sends: {self.sends}, "
+                f"Dropped: {self.dropped_frames} (silent {self.dropped_silent_frames}), "
+                f"Coalesced: {self.coalesced_frames}, Send errors: {self.send_errors}, "
+                f"Max depth: {self.max_depth}/{self.max_frames}")
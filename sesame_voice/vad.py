@@ -0,0 +1,114 @@
+# Voice activity gate for the uplink
+#
+# EnergyVAD decides per microphone frame whether it is worth sending. Frames above the
+# energy threshold open the gate; it stays open for a hangover period after the last
+# loud frame so word endings and short pauses go through, and the last few silent frames
+# before an onset are kept as pre-roll and sent ahead of it so the start of speech is
+# not clipped. While the gate is closed nothing is sent, or one frame every keepalive_ms
+# if the server needs to keep hearing from us.
+#
+# Frames are passed through untouched, so they can be pooled frames (see frame_pool):
+# ownership goes with each frame into the returned list or the pre-roll, and frames
+# that fall out of the pre-roll are handed to discard() so they can go back to the pool.
+# The returned list is reused by the next call, so nothing is allocated per frame.
+
+import collections
+import math
+import time
+
+from sesame_voice.dsp import calculate_energy
+
+
+class EnergyVAD:
+    def __init__(self, frame_ms, threshold=500, hangover_ms=500, preroll_ms=200, keepalive_ms=0,
+                 discard=None):
+        self.threshold = threshold
+        self.hangover_ms = hangover_ms
+        self.preroll_ms = preroll_ms
+        self.keepalive_ms = keepalive_ms
+        self.discard = discard
+        self._preroll = collections.deque()
+        self._out = []
+        self.set_frame_ms(frame_ms)
+
+        self.speaking = False
+        self._quiet_frames = 0  # Silent frames since the last loud one
+        self._since_sent = 0  # Frames since anything was let through
+
+        # Metrics
+        self.frames_in = 0
+        self.frames_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.onsets = 0
+        self.keepalives = 0
+        self.cost_ns = 0
+
+    # The periods are counted in frames, so they follow the frame duration when it
+    # changes mid-session (see autotune)
+    def set_frame_ms(self, frame_ms):
+        self.frame_ms = frame_ms
+        self.hangover_frames = math.ceil(self.hangover_ms / frame_ms)
+        self.keepalive_frames = math.ceil(self.keepalive_ms / frame_ms) if self.keepalive_ms else 0
+        self.preroll_frames = math.ceil(self.preroll_ms / frame_ms)
+        self._drop_preroll(self.preroll_frames)
+
+    # Frames to send for this microphone frame (possibly none), valid until the next
+    # call. energy can be passed in when the caller has already measured the frame.
+    def process(self, frame, energy=None):
+        start = time.perf_counter_ns()
+        if energy is None:
+            energy = calculate_energy(frame)
+        self.frames_in += 1
+        self.bytes_in += len(frame)
+
+        out = self._out
+        out.clear()
+        if energy > self.threshold:
+            if not self.speaking:
+                # Speech onset: send the pre-roll first
+                self.speaking = True
+                self.onsets += 1
+                out.extend(self._preroll)
+                self._preroll.clear()
+            self._quiet_frames = 0
+            out.append(frame)
+        elif self.speaking:
+            self._quiet_frames += 1
+            out.append(frame)
+            if self._quiet_frames >= self.hangover_frames:
+                self.speaking = False
+        elif self.keepalive_frames and self._since_sent + 1 >= self.keepalive_frames:
+            self.keepalives += 1
+            self._drop_preroll(0)
+            out.append(frame)
+        else:
+            self._preroll.append(frame)
+            self._drop_preroll(self.preroll_frames)
+
+        if out:
+            self._since_sent = 0
+            self.frames_out += len(out)
+            for sent in out:
+                self.bytes_out += len(sent)
+        else:
+            self._since_sent += 1
+
+        self.cost_ns += time.perf_counter_ns() - start
+        return out
+
+    # Let go of the oldest pre-roll frames until at most `keep` are left
+    def _drop_preroll(self, keep):
+        while len(self._preroll) > keep:
+            frame = self._preroll.popleft()
+            if self.discard:
+                self.discard(frame)
+
+    # Share of captured bytes that did not have to be sent
+    def saved_ratio(self):
+        return 1 - self.bytes_out / self.bytes_in if self.bytes_in else 0.0
+
+    def summary(self):
+        cost_us = self.cost_ns / self.frames_in / 1000 if self.frames_in else 0.0
+        return (f"Sent: {self.frames_out}/{self.frames_in} frames, Bytes saved: {self.saved_ratio():.1%}, "
+                f"Onsets: {self.onsets}, Keepalives: {self.keepalives}, Cost: {cost_us:.1f}us/frame")
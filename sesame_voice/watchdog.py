@@ -0,0 +1,222 @@
+# Hot-path stall watchdog
+#
+# Every hot loop (capture, playback, uplink sends) owns a Heartbeat and beats it once
+# per iteration with the time its next beat is due in: a frame for the capture loop,
+# the poll timeout plus a frame for playback. A beat is a clock read and a few stores,
+# cheap enough to leave on in production. A beat that comes more than threshold_ms
+# past its deadline is a stall; its overrun goes into the loop's histogram
+# (sesame_loop_stall_seconds) either way.
+#
+# The Watchdog is one thread per process that looks at every heartbeat `interval`
+# times a second. While a loop is stalled it samples the stack of the thread that beat
+# last (and of the event loop thread under the asyncio engine) with
+# sys._current_frames(), logs the first sample of each stall and counts every sample
+# per stack. dump() writes those counts as collapsed stacks, one "frame;frame;... count"
+# line each, which flamegraph.pl, speedscope and similar tools read directly; the
+# client calls it on a signal. Stalls shorter than the sampling interval are still in
+# the histogram, just without a stack.
+#
+# Loops pause their heartbeat while they wait on purpose (disconnected, backing off
+# after an error, nothing to send) so waiting is never mistaken for a stall.
+
+import collections
+import logging
+import math
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger("sesame_voice")
+
+# Stacks kept per heartbeat; samples of any further ones are counted under OTHER_STACK
+MAX_STACKS = 200
+OTHER_STACK = ("[other stacks]",)
+MAX_DEPTH = 64
+
+
+class Heartbeat:
+    # histogram (from SessionMetrics.loop_stalls) receives the overrun of every stall
+    def __init__(self, name, threshold_ms=100, histogram=None):
+        self.name = name
+        self.threshold = threshold_ms / 1000
+        self.histogram = histogram
+        self.due = math.inf
+        self.thread = None
+        self.loop_thread = None  # Event loop thread driving this loop, if any
+
+        # Watchdog side
+        self.profile = collections.Counter()
+        self.samples = 0
+        self._sampled_due = None
+        self._reported_stalls = 0
+
+        # Metrics
+        self.beats = 0
+        self.stalls = 0
+        self.sampled_stalls = 0  # Stalls the watchdog caught while they lasted
+        self.last_stall = 0.0
+        self.worst_stall = 0.0
+
+    # Hot loop: an iteration starts; the next one is due within `deadline` seconds
+    def beat(self, deadline):
+        now = time.monotonic()
+        if now - self.due > self.threshold:
+            self._stall(now - self.due)
+        self.due = now + deadline
+        self.thread = threading.get_ident()
+        self.beats += 1
+
+    # Hot loop: waiting on purpose until the next beat (an iteration that overran its
+    # deadline on the way there still counts)
+    def pause(self):
+        now = time.monotonic()
+        if now - self.due > self.threshold:
+            self._stall(now - self.due)
+        self.due = math.inf
+
+    def _stall(self, late):
+        self.stalls += 1
+        self.last_stall = late
+        if late > self.worst_stall:
+            self.worst_stall = late
+        if self.histogram:
+            self.histogram.observe(late)
+
+    def stalled(self, now=None):
+        return (now or time.monotonic()) - self.due > self.threshold
+
+    def summary(self):
+        return (f"Stalls: {self.stalls} ({self.sampled_stalls} sampled), "
+                f"Worst: {self.worst_stall * 1000:.0f}ms, Stack samples: {self.samples}")
+
+
+# Frames of a thread's stack, outermost first, as "function (file:line)"
+def _stack(frame):
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+class Watchdog:
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.heartbeats = {}  # label -> Heartbeat
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Metrics
+        self.checks = 0
+        self.sampling_time = 0.0
+
+    def watch(self, label, heartbeat):
+        with self._lock:
+            self.heartbeats[label] = heartbeat
+
+    # Watch every hot loop of a session, labelled "<session name>/<loop>"
+    def add(self, session):
+        for loop, heartbeat in session.heartbeats.items():
+            self.watch(f"{session.name or 'session'}/{loop}", heartbeat)
+
+    def remove(self, session):
+        prefix = f"{session.name or 'session'}/"
+        with self._lock:
+            for label in [label for label in self.heartbeats if label.startswith(prefix)]:
+                del self.heartbeats[label]
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="watchdog", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Watchdog check failed: {e}")
+
+    # One pass over the heartbeats: sample stalled loops, report recovered ones
+    def check(self, now=None):
+        now = now or time.monotonic()
+        self.checks += 1
+        with self._lock:
+            heartbeats = list(self.heartbeats.items())
+        frames = None
+        for label, heartbeat in heartbeats:
+            if heartbeat.stalled(now):
+                start = time.perf_counter()
+                if frames is None:
+                    frames = sys._current_frames()
+                self._sample(label, heartbeat, frames, now)
+                self.sampling_time += time.perf_counter() - start
+            if heartbeat.stalls != heartbeat._reported_stalls:
+                # Only stalls long enough to be sampled were announced
+                if heartbeat._sampled_due is not None:
+                    logger.info(f"{label} loop recovered after a {heartbeat.last_stall * 1000:.0f}ms stall")
+                    heartbeat._sampled_due = None
+                heartbeat._reported_stalls = heartbeat.stalls
+        del frames
+
+    def _sample(self, label, heartbeat, frames, now):
+        due = heartbeat.due
+        threads = [heartbeat.thread]
+        if heartbeat.loop_thread is not None and heartbeat.loop_thread != heartbeat.thread:
+            threads.append(heartbeat.loop_thread)
+        stacks = []
+        for ident in threads:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = _stack(frame)
+            if ident == heartbeat.loop_thread:
+                stack = ("[event loop]",) + stack
+            stacks.append(stack)
+            if stack not in heartbeat.profile and len(heartbeat.profile) >= MAX_STACKS:
+                stack = OTHER_STACK
+            heartbeat.profile[stack] += 1
+            heartbeat.samples += 1
+
+        # First sample of this stall
+        if heartbeat._sampled_due != due:
+            heartbeat._sampled_due = due
+            heartbeat.sampled_stalls += 1
+            where = " | ".join(" <- ".join(reversed(stack[-4:])) for stack in stacks) or "unknown"
+            logger.warning(f"{label} loop stalled: {(now - due) * 1000:.0f}ms past its deadline, in {where}")
+
+    # Collapsed stacks of every stall sampled so far, one line per stack, prefixed with
+    # the loop's label; returns the number of lines written
+    def dump(self, path):
+        with self._lock:
+            heartbeats = list(self.heartbeats.items())
+        lines = []
+        for label, heartbeat in heartbeats:
+            for stack, count in list(heartbeat.profile.items()):
+                frames = [label] + [frame.replace(";", ":") for frame in stack]
+                lines.append(f"{';'.join(frames)} {count}")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + ("\n" if lines else ""))
+        logger.info(f"Stall profile: {len(lines)} stacks written to {path}")
+        return len(lines)
+
+    def summary(self):
+        with self._lock:
+            heartbeats = list(self.heartbeats.values())
+        stalls = sum(heartbeat.stalls for heartbeat in heartbeats)
+        samples = sum(heartbeat.samples for heartbeat in heartbeats)
+        worst = max((heartbeat.worst_stall for heartbeat in heartbeats), default=0.0)
+        return (f"Loops: {len(heartbeats)}, Stalls: {stalls}, Worst: {worst * 1000:.0f}ms, "
+                f"Stack samples: {samples}, Sampling time: {self.sampling_time * 1000:.1f}ms")